@@ -6,7 +6,8 @@ let conversationState = {
     extractedData: null,
     validationStatus: null,
     isProcessing: false,
-    canCreateAppointment: false
+    canCreateAppointment: false,
+    canal: 'chat'  // origem dos dados extraídos: 'chat' ou 'pdf'
 };
 
 // DOM Elements
@@ -91,6 +92,7 @@ async function sendMessage() {
         const data = await response.json();
         
         if (data.success) {
+            conversationState.canal = 'chat';
             handleAIResponse(data);
         } else {
             addMessage('❌ Erro ao processar mensagem: ' + data.detail, 'error');
@@ -105,6 +107,22 @@ async function sendMessage() {
     }
 }
 
+async function waitForPdfJob(statusUrl) {
+    while (true) {
+        const response = await fetch(statusUrl);
+        const job = await response.json();
+        console.log(`⏳ Job de PDF: ${job.status} (${job.progresso}%)`);
+
+        if (job.status === "concluido") {
+            return job.resultado;
+        }
+        if (job.status === "erro") {
+            return { success: false, detail: job.erro };
+        }
+        await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+}
+
 document.getElementById("uploadPdf").addEventListener("change", async function (event) {
     const file = event.target.files[0];
     if (!file) return;
@@ -121,7 +139,13 @@ document.getElementById("uploadPdf").addEventListener("change", async function (
             body: formData,
         });
 
-        const result = await response.json();
+        const job = await response.json();
+        if (!job.job_id) {
+            throw new Error(job.detail || "PDF não aceito para processamento");
+        }
+
+        // O PDF é processado em segundo plano: acompanha o job até terminar
+        const result = await waitForPdfJob(job.status_url);
         console.log("📥 Resposta completa do PDF:", result);
         
         if (result.success) {
@@ -130,6 +154,7 @@ document.getElementById("uploadPdf").addEventListener("change", async function (
             console.log("📈 Validação:", result.validation);
             
             // Atualiza o estado da conversa com os dados extraídos
+            conversationState.canal = 'pdf';
             conversationState.extractedData = result.extracted_data;
             conversationState.validationStatus = result.validation;
             conversationState.canCreateAppointment = result.can_proceed;
@@ -208,7 +233,8 @@ async function createAppointment() {
                     ...conversationState.extractedData,
                     dados_extraidos: ['paciente.nome', 'agendamento.tipo_agendamento', 'agendamento.especialidade'],
                     dados_faltantes: []
-                }
+                },
+                canal: conversationState.canal
             })
         });
         
@@ -8,7 +8,7 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from src.routes import ai_booking, patients, booking
 from src.config.settings import settings
-from src.database.connection import db_manager
+from src.database.connection import ensure_schema
 import os
 import logging
 
@@ -57,8 +57,8 @@ async def startup_event():
     """Initialize database and other startup tasks."""
     try:
         logger.info("Inicializando aplicação...")
-        # Initialize database if needed
-        # await db_manager.initialize()
+        # Schema e migrações uma vez por processo (get_db só abre a conexão)
+        await ensure_schema()
         logger.info("✅ Aplicação inicializada com sucesso")
     except Exception as e:
         logger.error(f"❌ Erro na inicialização: {e}")
@@ -0,0 +1,60 @@
+"""
+Arquiva os agendamentos encerrados antigos (Agendamentos -> Agendamentos_Arquivo).
+
+O servidor já faz isso periodicamente (archive_interval_seconds); este script serve para
+a primeira passada num banco com anos de histórico ou para arquivar com outro horizonte.
+Move os agendamentos realizados, cancelados e ausentes que começaram há mais de [dias]
+dias (padrão: archive_horizon_days) em lotes de archive_batch_size, uma transação curta
+por lote, então pode rodar com o servidor no ar. No fim mostra quantas linhas ficaram em
+cada tabela e o tamanho dos índices de Agendamentos (dbstat).
+
+Uso: python scripts/archive_appointments.py [dias]
+"""
+import sys
+import asyncio
+from pathlib import Path
+from datetime import datetime, timedelta
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src.database.connection import db_manager
+from src.services.archive_service import ARCHIVE_TABLE, appointment_archiver, archive_cutoff
+
+
+async def table_sizes(conn) -> dict:
+    async with conn.execute(
+        "SELECT name, SUM(pgsize) FROM dbstat WHERE name LIKE 'idx_agendamentos%' OR name LIKE 'uq_agendamentos%' "
+        "OR name IN ('Agendamentos', ?) GROUP BY name", (ARCHIVE_TABLE,)
+    ) as cursor:
+        return {name: size for name, size in await cursor.fetchall()}
+
+
+async def main():
+    cutoff = datetime.now() - timedelta(days=int(sys.argv[1])) if len(sys.argv) > 1 else archive_cutoff()
+
+    await db_manager.initialize_database()
+    conn = await appointment_archiver.connect()
+    try:
+        before = await table_sizes(conn)
+        result = await appointment_archiver.run_once(conn, cutoff)
+        after = await table_sizes(conn)
+        counts = {}
+        for table in ("Agendamentos", ARCHIVE_TABLE):
+            async with conn.execute(f"SELECT COUNT(*) FROM {table}") as cursor:
+                counts[table] = (await cursor.fetchone())[0]
+    finally:
+        await conn.close()
+
+    print(f"{result['archived']} agendamentos anteriores a {result['cutoff']} arquivados "
+          f"em {result['batches']} lotes ({result['seconds']}s)")
+    for table, count in counts.items():
+        print(f"  {table}: {count} linhas")
+    # As páginas liberadas voltam para a lista livre do arquivo (VACUUM devolve o espaço ao disco)
+    print(f"\n{'tamanho (KB)':<44}{'antes':>10}{'depois':>10}")
+    for name in sorted(set(before) | set(after)):
+        print(f"  {name:<42}{before.get(name, 0) / 1024:>10.0f}{after.get(name, 0) / 1024:>10.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,186 @@
+"""
+Benchmark do índice de disponibilidade com 1 milhão de agendamentos.
+
+Gera agendamentos sintéticos (500 médicos, 50 locais x 6 exames, 365 dias, duração de
+15 a 60 minutos em horário comercial), monta o índice e mede:
+  - tempo de carga e memória do índice;
+  - latência de "este intervalo está livre?" e "próximo horário livre" (p50/p99);
+  - latência da busca dos próximos 10 horários entre 10, 100 e 500 médicos;
+  - com --sql, a mesma checagem feita com a consulta de sobreposição no SQLite (com e
+    sem o limite inferior em data_hora_inicio usado pelo agendamento) e a carga do
+    índice a partir do banco (como na inicialização do servidor).
+
+Uso: python scripts/bench_availability.py [agendamentos] [--sql]
+"""
+import sys
+import time
+import random
+import asyncio
+import sqlite3
+import resource
+import tempfile
+from pathlib import Path
+from datetime import datetime, timedelta
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import aiosqlite
+
+from src.config.settings import settings
+from src.database.codecs import to_epoch
+from src.services.availability_service import AvailabilityIndex
+from src.services.slot_search import SlotCandidate, next_free_slots
+from src.services.booking_service import DOCTOR_OVERLAP_SQL
+
+DOCTORS = 500
+LOCATIONS = 50
+EXAMS = 6
+DAYS = 365
+QUERIES = 20000
+WINDOW = (8 * 60, 18 * 60)
+
+
+def synthetic_appointments(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    first_day = datetime.combine(datetime.today().date(), datetime.min.time())
+    for _ in range(count):
+        start = first_day + timedelta(days=rng.randrange(DAYS), minutes=rng.randrange(8 * 60, 17 * 60, 5))
+        end = start + timedelta(minutes=rng.choice((15, 20, 30, 45, 60)))
+        if rng.random() < 0.7:
+            yield rng.randint(1, DOCTORS), rng.randint(1, LOCATIONS), None, start, end
+        else:
+            yield None, rng.randint(1, LOCATIONS), rng.randint(1, EXAMS), start, end
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2] * 1e6, samples[int(len(samples) * 0.99)] * 1e6
+
+
+def random_queries(rng: random.Random):
+    first_day = datetime.combine(datetime.today().date(), datetime.min.time())
+    for _ in range(QUERIES):
+        start = first_day + timedelta(days=rng.randrange(DAYS), minutes=rng.randrange(8 * 60, 17 * 60, 5))
+        if rng.random() < 0.7:
+            keys = [("medico", rng.randint(1, DOCTORS))]
+        else:
+            keys = [("local", rng.randint(1, LOCATIONS), rng.randint(1, EXAMS))]
+        yield keys, start, start + timedelta(minutes=30)
+
+
+def bench_index(count: int) -> AvailabilityIndex:
+    index = AvailabilityIndex()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    for id_medico, id_local, id_exame, start, end in synthetic_appointments(count):
+        index.add(index.resources_for(id_medico, id_local, id_exame), start, end)
+    elapsed = time.perf_counter() - started
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"Índice com {count:,} agendamentos: {elapsed:.1f}s para montar, ~{(rss_after - rss_before) / 1024:.0f} MB")
+    print(f"  {index.metrics()}")
+
+    rng = random.Random(11)
+    free_times, next_times = [], []
+    for keys, start, end in random_queries(rng):
+        t = time.perf_counter()
+        index.is_free(keys, start, end)
+        free_times.append(time.perf_counter() - t)
+        t = time.perf_counter()
+        index.next_free(keys, start, 30, WINDOW, horizon_days=60)
+        next_times.append(time.perf_counter() - t)
+    print("  is_free:    p50 %.1f µs  p99 %.1f µs" % percentiles(free_times))
+    print("  next_free:  p50 %.1f µs  p99 %.1f µs" % percentiles(next_times))
+    return index
+
+
+def weekday_hours(day):
+    return WINDOW if day.weekday() < 5 else None
+
+
+def bench_search(index: AvailabilityIndex):
+    """Próximos 10 horários entre todos os médicos (k-way merge), horizonte de 90 dias."""
+    doctors = [SlotCandidate([("medico", doctor_id)], id_medico=doctor_id) for doctor_id in range(1, DOCTORS + 1)]
+    rng = random.Random(13)
+    first_day = datetime.combine(datetime.today().date(), datetime.min.time())
+    for size in (10, 100, DOCTORS):
+        times = []
+        for _ in range(200):
+            candidates = rng.sample(doctors, size)
+            after = first_day + timedelta(days=rng.randrange(DAYS - 90), minutes=rng.randrange(8 * 60, 17 * 60, 5))
+            t = time.perf_counter()
+            next_free_slots(index, candidates, 30, after, 10, hours=weekday_hours, horizon_days=90, step_minutes=15)
+            times.append(time.perf_counter() - t)
+        print(f"  próximos 10 horários entre {size:>3} médicos: p50 %.2f ms  p99 %.2f ms"
+              % tuple(value / 1000 for value in percentiles(times)))
+
+
+def build_database(path: Path, count: int):
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        CREATE TABLE Agendamentos (
+            id_agendamento INTEGER PRIMARY KEY, id_paciente INTEGER, id_local INTEGER, id_exame INTEGER,
+            id_medico INTEGER, data_hora_inicio INTEGER, data_hora_fim INTEGER, status TEXT
+        );
+        """
+    )
+    conn.executemany(
+        "INSERT INTO Agendamentos (id_paciente, id_local, id_exame, id_medico, data_hora_inicio, data_hora_fim, status) "
+        "VALUES (1, ?, ?, ?, ?, ?, 'agendado')",
+        ((id_local, id_exame, id_medico, to_epoch(start), to_epoch(end)) for id_medico, id_local, id_exame, start, end in synthetic_appointments(count))
+    )
+    conn.execute("CREATE INDEX idx_agendamentos_medico_data ON Agendamentos (id_medico, data_hora_inicio)")
+    conn.commit()
+    return conn
+
+
+def bench_sql(count: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bench.db"
+        started = time.perf_counter()
+        conn = build_database(path, count)
+        print(f"\nSQLite com {count:,} agendamentos criado em {time.perf_counter() - started:.1f}s")
+
+        rng = random.Random(11)
+        unbounded, bounded = [], []
+        for keys, start, end in random_queries(rng):
+            if keys[0][0] != "medico":
+                continue
+            t = time.perf_counter()
+            conn.execute(
+                "SELECT 1 FROM Agendamentos WHERE id_medico = ? AND status = 'agendado' "
+                "AND data_hora_inicio < ? AND data_hora_fim > ? LIMIT 1",
+                (keys[0][1], to_epoch(end), to_epoch(start))
+            ).fetchone()
+            unbounded.append(time.perf_counter() - t)
+            t = time.perf_counter()
+            lower = start - timedelta(minutes=settings.appointment_max_minutes)
+            conn.execute(DOCTOR_OVERLAP_SQL, (keys[0][1], to_epoch(lower), to_epoch(end), to_epoch(start), 0)).fetchone()
+            bounded.append(time.perf_counter() - t)
+        conn.close()
+        print("  sobreposição sem limite inferior:  p50 %.1f µs  p99 %.1f µs" % percentiles(unbounded))
+        print("  sobreposição com limite inferior:  p50 %.1f µs  p99 %.1f µs" % percentiles(bounded))
+
+        async def load():
+            async with aiosqlite.connect(path) as db:
+                index = AvailabilityIndex()
+                await index.load(db)
+                return index
+        started = time.perf_counter()
+        index = asyncio.run(load())
+        print(f"  carga do índice a partir do banco: {time.perf_counter() - started:.1f}s "
+              f"({index.loaded_appointments:,} agendamentos a partir de hoje)")
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    count = int(args[0]) if args else 1_000_000
+    index = bench_index(count)
+    bench_search(index)
+    if "--sql" in sys.argv:
+        bench_sql(count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Benchmark do armazenamento compacto de datas e CPF (src/database/codecs.py).
+
+Monta duas cópias da mesma massa sintética (por padrão 5 milhões de agendamentos e 1
+milhão de pacientes), uma no formato antigo (data_hora_* como texto 'YYYY-MM-DD
+HH:MM:SS', CPF como texto de 11 dígitos) e outra no atual (segundos desde 1970 e CPF
+como INTEGER), com os índices do schema que usam essas colunas, e compara:
+  - tamanho de cada índice e da tabela (dbstat) e do arquivo;
+  - latência da agenda de um médico numa janela de 7 dias (contagem e leitura das linhas
+    pelo índice (id_medico, data_hora_inicio));
+  - latência da checagem de sobreposição usada no agendamento;
+  - latência da busca de paciente por CPF (índice UNIQUE).
+
+Uso: python scripts/bench_compact_storage.py [agendamentos]
+"""
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+from pathlib import Path
+from datetime import datetime, timedelta
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src.config.settings import settings
+from src.database.codecs import EPOCH, to_epoch
+from src.services.booking_service import DOCTOR_OVERLAP_SQL
+
+DOCTORS = 500
+DAYS = 365
+QUERIES = 2000
+FIRST_DAY = datetime(2027, 1, 4)
+
+# formato -> (tipo das colunas de data, tipo do CPF, conversão da data, conversão do CPF)
+FORMATS = {
+    "texto": ("DATETIME", "TEXT(11)", lambda seconds: str(EPOCH + timedelta(seconds=seconds)), lambda cpf: f"{cpf:011d}"),
+    "inteiro": ("INTEGER", "INTEGER", lambda seconds: seconds, lambda cpf: cpf),
+}
+INDEXES = (
+    # uq_agendamentos_medico_inicio sem UNIQUE: a massa sintética tem horários repetidos
+    "CREATE INDEX uq_agendamentos_medico_inicio ON Agendamentos (id_medico, data_hora_inicio) WHERE status = 'agendado'",
+    "CREATE INDEX idx_agendamentos_medico_data ON Agendamentos (id_medico, data_hora_inicio)",
+    "CREATE INDEX idx_agendamentos_paciente_data ON Agendamentos (id_paciente, data_hora_inicio)",
+    "CREATE INDEX idx_agendamentos_status_data ON Agendamentos (status, data_hora_inicio)",
+)
+
+
+def synthetic_appointments(count: int, patients: int, seed: int = 7):
+    """(id_paciente, id_medico, início, fim, status), com datas em segundos desde 1970."""
+    rng = random.Random(seed)
+    first = to_epoch(FIRST_DAY)
+    for _ in range(count):
+        start = first + rng.randrange(DAYS) * 86400 + rng.randrange(8 * 60, 18 * 60, 5) * 60
+        yield (rng.randint(1, patients), rng.randint(1, DOCTORS), start, start + rng.choice((15, 30, 45, 60)) * 60,
+               rng.choices(("agendado", "cancelado", "realizado"), (8, 1, 1))[0])
+
+
+def synthetic_cpfs(patients: int, seed: int = 3):
+    # Faixa inteira de CPFs, inclusive os que começam com zero
+    return random.Random(seed).sample(range(1, 10 ** 11), patients)
+
+
+def build_database(path: Path, fmt: str, count: int, cpfs) -> sqlite3.Connection:
+    date_type, cpf_type, date, cpf = FORMATS[fmt]
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        f"""
+        PRAGMA journal_mode = OFF;
+        PRAGMA synchronous = OFF;
+        CREATE TABLE Pacientes (
+            id_paciente INTEGER PRIMARY KEY, nome TEXT NOT NULL, cpf {cpf_type} NOT NULL UNIQUE
+        );
+        CREATE TABLE Agendamentos (
+            id_agendamento INTEGER PRIMARY KEY, id_paciente INTEGER NOT NULL, id_medico INTEGER,
+            data_hora_inicio {date_type} NOT NULL, data_hora_fim {date_type} NOT NULL, status TEXT NOT NULL
+        );
+        """
+    )
+    conn.executemany("INSERT INTO Pacientes (nome, cpf) VALUES (?, ?)",
+                     ((f"Paciente {i}", cpf(value)) for i, value in enumerate(cpfs, 1)))
+    for index in INDEXES:
+        conn.execute(index)
+    conn.executemany(
+        "INSERT INTO Agendamentos (id_paciente, id_medico, data_hora_inicio, data_hora_fim, status) VALUES (?, ?, ?, ?, ?)",
+        ((patient, doctor, date(start), date(end), status)
+         for patient, doctor, start, end, status in synthetic_appointments(count, len(cpfs)))
+    )
+    conn.commit()
+    return conn
+
+
+def sizes(conn: sqlite3.Connection) -> dict:
+    return dict(conn.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name"))
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2] * 1e6, samples[int(len(samples) * 0.99)] * 1e6
+
+
+def timed(conn: sqlite3.Connection, query: str, params_list) -> tuple:
+    times = []
+    for params in params_list:
+        started = time.perf_counter()
+        conn.execute(query, params).fetchall()
+        times.append(time.perf_counter() - started)
+    return percentiles(times)
+
+
+def bench_queries(conn: sqlite3.Connection, fmt: str, cpfs) -> dict:
+    _, _, date, cpf = FORMATS[fmt]
+    rng = random.Random(11)
+    first = to_epoch(FIRST_DAY)
+    windows = []
+    for _ in range(QUERIES):
+        start = first + rng.randrange(DAYS - 7) * 86400
+        windows.append((rng.randint(1, DOCTORS), start, start + 7 * 86400))
+    overlaps = []
+    for _ in range(QUERIES):
+        start = first + rng.randrange(DAYS) * 86400 + rng.randrange(8 * 60, 18 * 60, 5) * 60
+        lower = start - settings.appointment_max_minutes * 60
+        overlaps.append((rng.randint(1, DOCTORS), date(lower), date(start + 1800), date(start), 0))
+    range_sql = "FROM Agendamentos WHERE id_medico = ? AND data_hora_inicio >= ? AND data_hora_inicio < ?"
+    window_params = [(doctor, date(start), date(end)) for doctor, start, end in windows]
+    return {
+        "agenda de 7 dias (contagem)": timed(conn, f"SELECT COUNT(*) {range_sql}", window_params),
+        "agenda de 7 dias (linhas)": timed(
+            conn, f"SELECT id_agendamento, data_hora_inicio, data_hora_fim, status {range_sql} ORDER BY data_hora_inicio",
+            window_params
+        ),
+        "checagem de sobreposição": timed(conn, DOCTOR_OVERLAP_SQL, overlaps),
+        "paciente por CPF": timed(conn, "SELECT id_paciente FROM Pacientes WHERE cpf = ?",
+                                  [(cpf(value),) for value in rng.sample(cpfs, QUERIES)]),
+    }
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000_000
+    patients = max(count // 5, QUERIES)
+    cpfs = synthetic_cpfs(patients)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt in FORMATS:
+            path = Path(tmp) / f"{fmt}.db"
+            started = time.perf_counter()
+            conn = build_database(path, fmt, count, cpfs)
+            print(f"Banco '{fmt}' com {count:,} agendamentos e {patients:,} pacientes criado em "
+                  f"{time.perf_counter() - started:.1f}s")
+            results[fmt] = {"sizes": sizes(conn), "file": path.stat().st_size, "queries": bench_queries(conn, fmt, cpfs)}
+            conn.close()
+
+    old, new = results["texto"], results["inteiro"]
+    print(f"\n{'tamanho (MB)':<36}{'texto':>10}{'inteiro':>10}{'redução':>10}")
+    names = sorted(name for name in old["sizes"] if name.startswith(("idx_", "uq_", "sqlite_autoindex", "Agendamentos", "Pacientes")))
+    for name, before, after in [(name, old["sizes"][name], new["sizes"][name]) for name in names] \
+            + [("arquivo", old["file"], new["file"])]:
+        print(f"  {name:<34}{before / 2 ** 20:>10.1f}{after / 2 ** 20:>10.1f}{1 - after / before:>10.0%}")
+
+    print(f"\n{'latência p50 / p99 (µs)':<36}{'texto':>20}{'inteiro':>20}")
+    for name, (p50, p99) in old["queries"].items():
+        new_p50, new_p99 = new["queries"][name]
+        print(f"  {name:<34}{p50:>9.1f} / {p99:<8.1f}{new_p50:>9.1f} / {new_p99:<8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Microbenchmark do overhead por turno do FlowManager (sem a chamada ao LLM).
+
+Compara o processamento antigo, direto sobre o JSON (varredura das palavras-chave,
+consultas ao SQLite para montar a lista de opções e replace no template), com o
+fluxo compilado (regex único, mensagens em cache por versão do catálogo e
+templates pré-processados).
+
+Uso: python scripts/bench_flow_turn.py
+"""
+import sys
+import json
+import sqlite3
+import timeit
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src.config.settings import DATABASE_PATH
+from src.chatbot.flows.flow_compiler import load_flow
+
+FLOW_PATH = ROOT / "src" / "chatbot" / "flows" / "booking_flow.json"
+TURNS = [("GREETING", "quero marcar uma consulta"), ("GET_SPECIALTY", "Cardiologia"),
+         ("CONFIRMATION", "sim, está tudo certo"), ("GET_PATIENT_NAME", "Maria Silva")]
+VALUES = {"contato_telefone": "11999999999", "email_confirmation": ""}
+
+
+def _options(conn):
+    return {
+        "specialties": [r[0] for r in conn.execute("SELECT nome FROM Especialidades ORDER BY nome")],
+        "exams": [r[0] for r in conn.execute("SELECT nome FROM Exames ORDER BY nome")],
+        "locations": [r[0] for r in conn.execute("SELECT nome FROM Locais_Atendimento ORDER BY nome")],
+    }
+
+
+def legacy_turn(flow):
+    for state_key, message in TURNS:
+        state = flow['states'][state_key]
+        next_state = state.get('next_state')
+        for keyword, target in state.get('transitions', {}).items():
+            if keyword in message.lower():
+                next_state = target
+                break
+        text = flow['states'][next_state]['message']
+        if next_state in ('GET_SPECIALTY', 'GET_EXAM_TYPE', 'GET_LOCATION'):
+            with sqlite3.connect(DATABASE_PATH) as conn:
+                options = _options(conn)
+            key = {'GET_SPECIALTY': 'specialties', 'GET_EXAM_TYPE': 'exams', 'GET_LOCATION': 'locations'}[next_state]
+            text += f"\n\nDisponíveis: {', '.join(options[key])}"
+        elif next_state == 'END':
+            text = text.replace('.', '_').format(**VALUES)
+
+
+def compiled_turn(flow, catalog):
+    for state_key, message in TURNS:
+        state = flow[state_key]
+        next_state = state.next_state
+        keyword = state.match_transition(message.lower())
+        if keyword:
+            next_state = state.transitions[keyword]
+        next_info = flow[next_state]
+        flow.entry_message(next_info, catalog, 1)
+        if next_state == 'END':
+            next_info.template.format(**VALUES)
+
+
+if __name__ == "__main__":
+    if not DATABASE_PATH.exists():
+        print(f"❌ Banco não encontrado em {DATABASE_PATH}. Rode src/database/init_database.py antes.")
+        sys.exit(1)
+
+    with open(FLOW_PATH, encoding='utf-8') as f:
+        raw_flow = json.load(f)
+    compiled = load_flow(FLOW_PATH)
+    with sqlite3.connect(DATABASE_PATH) as conn:
+        catalog = _options(conn)
+
+    n = 2000
+    legacy = timeit.timeit(lambda: legacy_turn(raw_flow), number=n) / (n * len(TURNS))
+    fast = timeit.timeit(lambda: compiled_turn(compiled, catalog), number=n) / (n * len(TURNS))
+
+    print("⏱️  Overhead por turno (sem LLM)")
+    print("=" * 40)
+    print(f"JSON bruto + SQLite : {legacy * 1e6:8.1f} µs")
+    print(f"Fluxo compilado     : {fast * 1e6:8.1f} µs")
+    print(f"Ganho               : {legacy / fast:8.1f}x")
@@ -0,0 +1,177 @@
+"""
+Teste de escala da relação médico-local-especialidade com 500 médicos e 50 locais.
+
+Cria um banco temporário com o schema do projeto (database.sql), 30 especialidades,
+500 médicos com 1 a 2 especialidades e agenda semanal em 1 a 3 locais (Medico_Locais),
+e mede:
+  - "locais que atendem a especialidade" com a consulta antiga (JOIN ... ON 1=1) e com a
+    consulta indexada por Medico_Locais, mais o plano de execução desta última;
+  - carga do snapshot do catálogo e a mesma busca feita em memória (specialty_locations);
+  - candidatos (médico x local da agenda) e próximos 10 horários livres por especialidade.
+Confere que a busca em memória devolve exatamente os locais da consulta SQL.
+
+Uso: python scripts/bench_locations.py [médicos] [locais]
+"""
+import sys
+import time
+import random
+import asyncio
+import sqlite3
+import tempfile
+from pathlib import Path
+from datetime import datetime, timedelta
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import aiosqlite
+
+from src.services.availability_service import AvailabilityIndex
+from src.services.catalog_service import load_catalog
+from src.services.slot_search import find_candidates, next_free_slots
+
+SPECIALTIES = 30
+QUERIES = 2000
+
+OLD_QUERY = """
+    SELECT DISTINCT l.id_local, l.nome, l.endereco
+    FROM Locais_Atendimento l
+    JOIN Medico_Especialidades me ON 1=1
+    JOIN Especialidades e ON me.id_especialidade = e.id_especialidade
+    WHERE LOWER(e.nome) = LOWER(?)
+    ORDER BY l.nome
+"""
+
+LOCATIONS_QUERY = """
+    SELECT DISTINCT ml.id_local
+    FROM Especialidades e
+    JOIN Medico_Especialidades me ON me.id_especialidade = e.id_especialidade
+    JOIN Medico_Locais ml ON ml.id_medico = me.id_medico
+    WHERE e.nome = ?
+"""
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2] * 1e6, samples[int(len(samples) * 0.99)] * 1e6
+
+
+def build_database(path: Path, doctors: int, locations: int, seed: int = 5) -> sqlite3.Connection:
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.executescript((ROOT / "src" / "database" / "database.sql").read_text(encoding="utf-8"))
+    conn.executemany("INSERT INTO Especialidades (nome) VALUES (?)",
+                     ((f"Especialidade {i:02d}",) for i in range(1, SPECIALTIES + 1)))
+    conn.executemany("INSERT INTO Locais_Atendimento (nome, endereco) VALUES (?, ?)",
+                     ((f"Local {i:02d}", f"Endereço {i}") for i in range(1, locations + 1)))
+    conn.executemany("INSERT INTO Medicos (nome, documento_conselho) VALUES (?, ?)",
+                     ((f"Médico {i:03d}", f"CRM{i:05d}") for i in range(1, doctors + 1)))
+    for doctor_id in range(1, doctors + 1):
+        for specialty_id in rng.sample(range(1, SPECIALTIES + 1), rng.randint(1, 2)):
+            conn.execute("INSERT INTO Medico_Especialidades (id_medico, id_especialidade) VALUES (?, ?)",
+                         (doctor_id, specialty_id))
+        # Cada dia útil em um dos locais do médico, manhã ou dia inteiro
+        doctor_locations = rng.sample(range(1, locations + 1), rng.randint(1, 3))
+        for weekday in range(5):
+            conn.execute(
+                "INSERT INTO Medico_Locais (id_medico, id_local, dia_semana, hora_inicio, hora_fim) VALUES (?, ?, ?, ?, ?)",
+                (doctor_id, rng.choice(doctor_locations), weekday, "08:00", rng.choice(("12:00", "18:00")))
+            )
+    conn.commit()
+    return conn
+
+
+def bench_sql(conn: sqlite3.Connection, names):
+    rng = random.Random(3)
+    old_rows = len(conn.execute(OLD_QUERY.replace("DISTINCT l.id_local, l.nome, l.endereco", "1")
+                                .replace("ORDER BY l.nome", ""), (names[0],)).fetchall())
+    old, new = [], []
+    for _ in range(QUERIES // 10):
+        name = rng.choice(names)
+        t = time.perf_counter()
+        conn.execute(OLD_QUERY, (name,)).fetchall()
+        old.append(time.perf_counter() - t)
+    for _ in range(QUERIES):
+        name = rng.choice(names)
+        t = time.perf_counter()
+        conn.execute(LOCATIONS_QUERY, (name,)).fetchall()
+        new.append(time.perf_counter() - t)
+    print(f"  consulta antiga (ON 1=1, {old_rows:,} linhas antes do DISTINCT): p50 %.1f µs  p99 %.1f µs"
+          % percentiles(old))
+    print("  consulta por Medico_Locais:                          p50 %.1f µs  p99 %.1f µs" % percentiles(new))
+    print("  plano:")
+    for row in conn.execute("EXPLAIN QUERY PLAN " + LOCATIONS_QUERY, (names[0],)):
+        print(f"    {row[-1]}")
+
+
+def bench_snapshot(path: Path, conn: sqlite3.Connection, names):
+    async def load():
+        async with aiosqlite.connect(path) as db:
+            return await load_catalog(db, 1)
+
+    started = time.perf_counter()
+    snapshot = asyncio.run(load())
+    print(f"\n  snapshot do catálogo carregado em {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    for name in names:
+        expected = sorted(row[0] for row in conn.execute(LOCATIONS_QUERY, (name,)))
+        if snapshot.specialty_locations.get(name.lower(), []) != expected:
+            raise SystemExit(f"Divergência entre snapshot e SQL para {name}")
+    print(f"  locais por especialidade em memória conferem com o SQL ({len(names)} especialidades)")
+
+    rng = random.Random(9)
+    lookups = []
+    for _ in range(QUERIES):
+        name = rng.choice(names).lower()
+        t = time.perf_counter()
+        location_ids = set(snapshot.specialty_locations.get(name, []))
+        [loc for loc in snapshot.locations if loc["id"] in location_ids]
+        lookups.append(time.perf_counter() - t)
+    print("  locais da especialidade em memória: p50 %.1f µs  p99 %.1f µs" % percentiles(lookups))
+    return snapshot
+
+
+def bench_search(snapshot, names, doctors: int):
+    # Índice com ~20 consultas de 30 minutos por médico nas próximas 4 semanas
+    rng = random.Random(17)
+    index = AvailabilityIndex()
+    first_day = datetime.combine(datetime.today().date(), datetime.min.time())
+    for doctor_id in range(1, doctors + 1):
+        for _ in range(20):
+            start = first_day + timedelta(days=rng.randrange(28), minutes=rng.randrange(8 * 60, 17 * 60, 30))
+            index.add([("medico", doctor_id)], start, start + timedelta(minutes=30))
+
+    candidate_counts, candidate_times, search_times = [], [], []
+    for _ in range(200):
+        name = rng.choice(names)
+        t = time.perf_counter()
+        duration, candidates = find_candidates(snapshot, "consulta", name)
+        candidate_times.append(time.perf_counter() - t)
+        candidate_counts.append(len(candidates))
+        t = time.perf_counter()
+        next_free_slots(index, candidates, duration, first_day, 10, step_minutes=15)
+        search_times.append(time.perf_counter() - t)
+    print(f"\n  candidatos (médico x local) por especialidade: média {sum(candidate_counts) / len(candidate_counts):.0f}")
+    print("  montagem dos candidatos:   p50 %.1f µs  p99 %.1f µs" % percentiles(candidate_times))
+    print("  próximos 10 horários:      p50 %.2f ms  p99 %.2f ms" % tuple(v / 1000 for v in percentiles(search_times)))
+
+
+def main():
+    doctors = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    locations = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bench.db"
+        started = time.perf_counter()
+        conn = build_database(path, doctors, locations)
+        schedules = conn.execute("SELECT COUNT(*) FROM Medico_Locais").fetchone()[0]
+        print(f"{doctors} médicos, {locations} locais, {SPECIALTIES} especialidades, {schedules} linhas em "
+              f"Medico_Locais (criado em {time.perf_counter() - started:.1f}s)")
+        names = [row[0] for row in conn.execute("SELECT nome FROM Especialidades")]
+        bench_sql(conn, names)
+        snapshot = bench_snapshot(path, conn, names)
+        bench_search(snapshot, names, doctors)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
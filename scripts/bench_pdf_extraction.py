@@ -0,0 +1,94 @@
+"""
+Benchmark da extração de texto de PDFs grandes.
+
+Gera PDFs com centenas de páginas a partir de pdfs_exemplos (a página com os dados do
+paciente primeiro, seguida de cópias como anexos) e compara:
+  - o caminho antigo: arquivo inteiro em memória (BytesIO) e extract_text duas vezes por página;
+  - leitura única por mmap, em um processo;
+  - leitura paralela por faixas de páginas no ProcessPoolExecutor;
+  - leitura paralela com parada antecipada assim que os campos de agendamento aparecem.
+
+Uso: python scripts/bench_pdf_extraction.py [paginas]
+"""
+import io
+import os
+import sys
+import time
+import asyncio
+import tempfile
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from PyPDF2 import PdfReader, PdfWriter
+
+from src.config.settings import settings
+from src.services.pdf_service import extract_pdf_text, extract_pdf_text_parallel
+
+EXAMPLE = ROOT / "pdfs_exemplos" / "exemplo_consulta.pdf"
+
+
+def build_pdf(pages: int, path: Path):
+    source = PdfReader(str(EXAMPLE))
+    writer = PdfWriter()
+    for _ in range(pages):
+        for page in source.pages:
+            writer.add_page(page)
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+def legacy_extract(path: Path) -> str:
+    reader = PdfReader(io.BytesIO(path.read_bytes()))
+    return "\n".join(page.extract_text() for page in reader.pages if page.extract_text())
+
+
+def timed(label: str, func, baseline: float = None) -> float:
+    start = time.perf_counter()
+    text = func()
+    elapsed = time.perf_counter() - start
+    speedup = f"  ({baseline / elapsed:.1f}x)" if baseline else ""
+    print(f"{label:<32} {elapsed * 1000:9.1f} ms  {len(text):>9} chars{speedup}")
+    return elapsed
+
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    workers = settings.pdf_parse_workers
+    chunk = settings.pdf_pages_per_worker
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "grande.pdf"
+        build_pdf(pages, path)
+        print(f"PDF de {pages} páginas ({path.stat().st_size // 1024} KB), {workers} workers, "
+              f"{chunk} páginas por faixa, {os.cpu_count()} CPUs\n")
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Aquece o pool para não medir o fork dos processos
+            asyncio.run(extract_pdf_text_parallel(executor, str(EXAMPLE), workers, chunk))
+
+            baseline = timed("antigo (BytesIO, 2x por página)", lambda: legacy_extract(path))
+            timed("mmap, leitura única", lambda: extract_pdf_text(str(path)), baseline)
+            timed("paralelo por faixas",
+                  lambda: asyncio.run(_parallel_full(executor, path, workers, chunk)), baseline)
+            timed("paralelo + parada antecipada",
+                  lambda: asyncio.run(extract_pdf_text_parallel(executor, str(path), workers, chunk)), baseline)
+
+
+async def _parallel_full(executor, path: Path, workers: int, chunk: int) -> str:
+    """Todas as faixas em paralelo, sem checar os campos entre as ondas."""
+    from src.services.pdf_service import count_pdf_pages, extract_pages_text
+
+    loop = asyncio.get_running_loop()
+    total = await loop.run_in_executor(executor, count_pdf_pages, str(path))
+    results = await asyncio.gather(*(
+        loop.run_in_executor(executor, extract_pages_text, str(path), start, min(start + chunk, total))
+        for start in range(0, total, chunk)
+    ))
+    return "\n".join(text for pages in results for text in pages if text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Tamanho do prompt e precisão da extração com a seleção de trechos relevantes.
+
+Monta textos longos como os de PDFs clínicos reais (histórico de exames laboratoriais
+e anexos) com a guia de agendamento de pdfs_exemplos no meio, e compara o texto
+completo com o texto selecionado dentro do orçamento de tokens:
+  - tamanho (caracteres e tokens estimados);
+  - precisão: se os campos de agendamento extraídos do texto selecionado são os mesmos
+    do texto completo. Sem chave do Gemini a comparação usa o extrator local por
+    templates; com --gemini as duas versões do prompt são enviadas ao modelo.
+
+Uso: python scripts/bench_pdf_prompt.py [--gemini]
+"""
+import sys
+import json
+import time
+import random
+import sqlite3
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src.config.settings import settings, DATABASE_PATH
+from src.services.pdf_service import extract_pdf_text, select_relevant_text, estimate_tokens
+from src.services.pdf_template_service import PdfTemplateEngine
+
+ANALYTES = ["Glicose", "Creatinina", "Ureia", "Colesterol total", "HDL", "LDL", "Triglicerídeos",
+            "TSH", "T4 livre", "Hemoglobina", "Leucócitos", "Plaquetas", "Sódio", "Potássio"]
+
+
+def load_catalog() -> dict:
+    conn = sqlite3.connect(DATABASE_PATH)
+    try:
+        return {
+            "specialties": [r[0] for r in conn.execute("SELECT nome FROM Especialidades ORDER BY nome")],
+            "exams": [r[0] for r in conn.execute("SELECT nome FROM Exames ORDER BY nome")],
+        }
+    finally:
+        conn.close()
+
+
+def annex_page(rng: random.Random, number: int) -> str:
+    lines = [f"Laboratório Central - Histórico de resultados - página {number}", "Resultados anteriores"]
+    for _ in range(30):
+        day, month, year = rng.randint(1, 28), rng.randint(1, 12), rng.randint(2015, 2024)
+        analyte = rng.choice(ANALYTES)
+        lines.append(f"{day:02d}/{month:02d}/{year}  {analyte}  {rng.uniform(0.5, 250):.1f}  valor de referência {rng.randint(1, 200)}")
+    lines.append("Observações: resultados liberados eletronicamente. Documento sem valor de laudo.")
+    return "\n".join(lines)
+
+
+def build_text(referral: str, pages: int, seed: int) -> str:
+    rng = random.Random(seed)
+    annexes = [annex_page(rng, n) for n in range(1, pages + 1)]
+    position = rng.randint(0, pages)
+    return "\n".join(annexes[:position] + [referral] + annexes[position:])
+
+
+def gemini_extract(text: str):
+    import google.generativeai as genai
+    from src.services.pdf_service import extract_conversation_data
+
+    genai.configure(api_key=settings.gemini_api_key)
+    model = genai.GenerativeModel(settings.gemini_model)
+    started = time.perf_counter()
+    data = extract_conversation_data(model, text)
+    return data, time.perf_counter() - started
+
+
+def main():
+    use_gemini = "--gemini" in sys.argv
+    catalog = load_catalog()
+    engine = PdfTemplateEngine()
+    budget, chunk_chars = settings.pdf_prompt_token_budget, settings.pdf_prompt_chunk_chars
+    print(f"Orçamento: {budget} tokens, trechos de {chunk_chars} caracteres\n")
+    print(f"{'PDF':<24} {'anexos':>6} {'tokens (completo)':>18} {'tokens (seleção)':>17} {'campos iguais':>14}")
+
+    total = matches = 0
+    for pdf in sorted((ROOT / "pdfs_exemplos").glob("*.pdf")):
+        referral = extract_pdf_text(str(pdf))
+        for pages in (5, 20, 80):
+            for seed in range(3):
+                full_text = build_text(referral, pages, seed)
+                selected = select_relevant_text(full_text, catalog, budget, chunk_chars)
+                if use_gemini:
+                    baseline, full_seconds = gemini_extract(full_text)
+                    reduced, reduced_seconds = gemini_extract(selected)
+                    timing = f"  {full_seconds:.1f}s -> {reduced_seconds:.1f}s"
+                else:
+                    baseline = engine.extract(full_text, catalog)
+                    reduced = engine.extract(selected, catalog)
+                    timing = ""
+                same = baseline is not None and json.dumps(baseline, sort_keys=True) == json.dumps(reduced, sort_keys=True)
+                total += 1
+                matches += same
+                print(f"{pdf.name:<24} {pages:>6} {estimate_tokens(full_text):>18} {estimate_tokens(selected):>17} "
+                      f"{'sim' if same else 'NÃO':>14}{timing}")
+
+    print(f"\nExtrações iguais ao texto completo: {matches}/{total}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Taxa de acerto e latência do extrator local por templates sobre um diretório de PDFs.
+
+Para cada PDF mostra qual template reconheceu o layout (ou se iria para o Gemini) e o
+tempo da extração local. A latência economizada em produção, calculada com a latência
+real observada do Gemini, fica em GET /api/v1/ai-booking/metrics/pdf.
+
+Uso: python scripts/bench_pdf_templates.py [diretorio_de_pdfs]
+"""
+import sys
+import sqlite3
+import timeit
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src.config.settings import DATABASE_PATH
+from src.services.pdf_service import extract_pdf_text
+from src.services.pdf_template_service import PdfTemplateEngine
+
+
+def load_catalog() -> dict:
+    conn = sqlite3.connect(DATABASE_PATH)
+    try:
+        return {
+            "specialties": [r[0] for r in conn.execute("SELECT nome FROM Especialidades ORDER BY nome")],
+            "exams": [r[0] for r in conn.execute("SELECT nome FROM Exames ORDER BY nome")],
+        }
+    finally:
+        conn.close()
+
+
+def main():
+    pdf_dir = Path(sys.argv[1]) if len(sys.argv) > 1 else ROOT / "pdfs_exemplos"
+    catalog = load_catalog()
+    engine = PdfTemplateEngine()
+    pdfs = sorted(pdf_dir.glob("*.pdf"))
+    hits = 0
+
+    for pdf in pdfs:
+        text = extract_pdf_text(str(pdf))
+        matched = engine.extract(text, catalog)
+        hits += matched is not None
+        runs = 1000
+        elapsed = timeit.timeit(lambda: engine.extract(text, catalog), number=runs) / runs
+        label = matched[0] if matched else "-> Gemini"
+        print(f"{pdf.name:<32} {label:<16} {elapsed * 1e6:8.1f} µs")
+
+    if pdfs:
+        print(f"\nTaxa de acerto dos templates: {hits}/{len(pdfs)} ({hits / len(pdfs):.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Confere os planos de execução da listagem de agendamentos (appointment_query).
+
+Cria um banco temporário com o schema do projeto (database.sql) e ~50 mil agendamentos
+e, para cada variante da listagem (por médico, local, paciente e status, com filtros
+combinados, com cursor e com projeção só de colunas do índice), verifica com EXPLAIN
+QUERY PLAN que:
+  - a busca é uma faixa no índice (chave, data_hora_inicio) esperado;
+  - não há varredura da tabela nem ordenação em B-tree temporária;
+  - quando a janela alcança o arquivo (Agendamentos_Arquivo), o índice correspondente
+    do arquivo também é usado e as duas faixas são intercaladas sem ordenação.
+Também arquiva os agendamentos encerrados dos primeiros dias, confere que as páginas por
+cursor juntas devolvem exatamente a janela de antes do arquivamento e compara o tempo da
+primeira página com o de uma página profunda.
+
+Sai com código 1 se alguma variante não usar o índice esperado.
+
+Uso: python scripts/check_query_plans.py [agendamentos]
+"""
+import sys
+import time
+import random
+import asyncio
+import sqlite3
+import tempfile
+from pathlib import Path
+from datetime import datetime, timedelta
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import aiosqlite
+
+from src.database.codecs import to_epoch
+from src.services.appointment_query import build_range_query, list_appointments
+from src.services.archive_service import AppointmentArchiver, archive_reach
+
+DOCTORS = 200
+LOCATIONS = 20
+PATIENTS = 5000
+FIRST_DAY = datetime(2027, 1, 4, 8, 0)
+
+WINDOW = (FIRST_DAY, FIRST_DAY + timedelta(days=30))
+# Agendamentos encerrados antes disto vão para o arquivo: a janela cobre as duas tabelas
+ARCHIVE_CUTOFF = FIRST_DAY + timedelta(days=10)
+
+# (descrição, filtros, campos)
+VARIANTS = [
+    ("médico", {"id_medico": 7}, None),
+    ("local", {"id_local": 3}, None),
+    ("paciente", {"id_paciente": 42}, None),
+    ("status", {"status": "cancelado"}, None),
+    ("médico + status", {"id_medico": 7, "status": "agendado"}, None),
+    ("local + status", {"id_local": 3, "status": "agendado"}, None),
+    ("paciente + local", {"id_paciente": 42, "id_local": 3}, None),
+    ("médico + local + paciente + status", {"id_medico": 7, "id_local": 3, "id_paciente": 42, "status": "agendado"}, None),
+    ("médico, só colunas do índice", {"id_medico": 7}, ["id_medico", "data_hora_inicio"]),
+    ("status, projeção reduzida", {"status": "agendado"}, ["id_paciente", "status"]),
+]
+
+
+def build_database(path: Path, appointments: int, seed: int = 11) -> sqlite3.Connection:
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.executescript((ROOT / "src" / "database" / "database.sql").read_text(encoding="utf-8"))
+    conn.executemany("INSERT INTO Locais_Atendimento (nome, endereco) VALUES (?, ?)",
+                     ((f"Local {i}", f"Endereço {i}") for i in range(1, LOCATIONS + 1)))
+    conn.execute("INSERT INTO Tipos_Consulta (descricao, duracao_padrao_minutos) VALUES ('Consulta', 30)")
+    conn.executemany("INSERT INTO Medicos (nome, documento_conselho) VALUES (?, ?)",
+                     ((f"Médico {i}", f"CRM{i:05d}") for i in range(1, DOCTORS + 1)))
+    conn.executemany("INSERT INTO Pacientes (nome, cpf, data_nascimento, sexo) VALUES (?, ?, ?, ?)",
+                     ((f"Paciente {i}", i, "1980-01-01", "F") for i in range(1, PATIENTS + 1)))
+    rows = []
+    for _ in range(appointments):
+        start = FIRST_DAY + timedelta(days=rng.randrange(120), minutes=rng.randrange(0, 10 * 60, 30))
+        rows.append((rng.randint(1, PATIENTS), rng.randint(1, LOCATIONS), 1, rng.randint(1, DOCTORS),
+                     to_epoch(start), to_epoch(start + timedelta(minutes=30)),
+                     rng.choices(("agendado", "cancelado", "realizado"), (8, 1, 1))[0]))
+    # Sem as restrições de unicidade: aqui só importam os planos e a paginação
+    conn.execute("DROP INDEX IF EXISTS uq_agendamentos_medico_inicio")
+    conn.executemany(
+        "INSERT INTO Agendamentos (id_paciente, id_local, id_tipo_consulta, id_medico, data_hora_inicio, "
+        "data_hora_fim, status) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        rows
+    )
+    conn.commit()
+    return conn
+
+
+def check_plans(conn: sqlite3.Connection) -> bool:
+    ok = True
+    for name, filters, fields in VARIANTS:
+        for archived_before in (None, to_epoch(ARCHIVE_CUTOFF)):
+            for after in (None, (to_epoch(WINDOW[0] + timedelta(days=3)), 1)):
+                query, params, index = build_range_query(filters, *WINDOW, fields, after, 100, archived_before)
+                plan = [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+                indexes = [index] + ([index.replace("idx_agendamentos_", "idx_agendamentos_arquivo_")]
+                                     if archived_before else [])
+                uses_index = all(any(f"INDEX {expected} (" in step and "data_hora_inicio>" in step for step in plan)
+                                 for expected in indexes)
+                scans = any(step.startswith("SCAN") for step in plan)
+                sorts = any("TEMP B-TREE" in step for step in plan)
+                passed = uses_index and not scans and not sorts
+                ok &= passed
+                label = f"{name}{' (com cursor)' if after else ''}{' (com arquivo)' if archived_before else ''}"
+                print(f"  {'ok ' if passed else 'ERRO'} {label:<62} {' | '.join(plan)}")
+    return ok
+
+
+async def check_pages(path: Path) -> bool:
+    async with aiosqlite.connect(path) as db:
+        db.row_factory = aiosqlite.Row
+        filters = {"id_local": 3}
+        query, params, _ = build_range_query(filters, *WINDOW)
+        async with db.execute(query, params) as cursor:
+            expected = [row["id_agendamento"] for row in await cursor.fetchall()]
+
+        result = await AppointmentArchiver().run_once(db, ARCHIVE_CUTOFF)
+        print(f"\n  {result['archived']} agendamentos anteriores a {ARCHIVE_CUTOFF:%d/%m/%Y} arquivados "
+              f"em {result['batches']} lotes")
+
+        seen, cursor, pages, timings = [], None, 0, []
+        while True:
+            started = time.perf_counter()
+            items, cursor = await list_appointments(db, filters, *WINDOW, cursor=cursor, limit=50)
+            timings.append(time.perf_counter() - started)
+            seen.extend(item["id_agendamento"] for item in items)
+            pages += 1
+            if cursor is None:
+                break
+
+        print(f"  {pages} páginas de 50 por cursor, {len(seen)} agendamentos "
+              f"({'iguais' if seen == expected else 'DIFERENTES de'} à janela antes do arquivamento)")
+        print(f"  primeira página {timings[0] * 1000:.2f} ms, última {timings[-1] * 1000:.2f} ms")
+
+        # Mesma página profunda com OFFSET, para comparação
+        query, params, _ = build_range_query(filters, *WINDOW, limit=50, archived_before=await archive_reach(db))
+        started = time.perf_counter()
+        async with db.execute(query.replace("LIMIT ?", "LIMIT ? OFFSET ?"), params + ((pages - 1) * 50,)) as result:
+            await result.fetchall()
+        print(f"  última página com OFFSET: {(time.perf_counter() - started) * 1000:.2f} ms")
+        return seen == expected
+
+
+def main():
+    appointments = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "plans.db"
+        conn = build_database(path, appointments)
+        print(f"{appointments} agendamentos, {DOCTORS} médicos, {LOCATIONS} locais, {PATIENTS} pacientes\n")
+        plans_ok = check_plans(conn)
+        conn.close()
+        pages_ok = asyncio.run(check_pages(path))
+    if not (plans_ok and pages_ok):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
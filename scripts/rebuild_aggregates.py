@@ -0,0 +1,66 @@
+"""
+Recalcula os agregados de ocupação (Ocupacao_Diaria) e demanda (Demanda_Diaria).
+
+Os gatilhos de Agendamentos mantêm os agregados em dia; este script serve para a carga
+inicial de um banco antigo, para reprocessar um período depois de uma correção manual
+dos dados e para conferir os agregados. Antes de recalcular, guarda os valores atuais
+do período e, no fim, informa quantas linhas mudaram (zero quando os gatilhos estavam
+corretos). A ocupação é refeita em blocos de `aggregate_rebuild_chunk_days` dias, uma
+transação por bloco, então o servidor pode continuar agendando durante o processo.
+
+Datas no formato AAAA-MM-DD; fim exclusivo. Sem datas, recalcula todos os dias com
+agendamentos.
+
+Uso: python scripts/rebuild_aggregates.py [inicio] [fim]
+"""
+import sys
+import asyncio
+from pathlib import Path
+from datetime import date
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src.database.connection import db_manager
+from src.services.occupancy_service import rebuild_aggregates
+
+SNAPSHOTS = {
+    "Ocupacao_Diaria": "SELECT tipo_recurso, dia, id_recurso, agendados, realizados, ausentes, cancelados, "
+                       "minutos_ocupados FROM Ocupacao_Diaria",
+    "Demanda_Diaria": "SELECT dia, canal, agendamentos, cancelados FROM Demanda_Diaria",
+}
+
+
+async def snapshot(conn, start, end) -> dict:
+    where, params = ("", ()) if start is None else (" WHERE dia >= ? AND dia < ?", (start.isoformat(), end.isoformat()))
+    tables = {}
+    for table, query in SNAPSHOTS.items():
+        async with conn.execute(query + where, params) as cursor:
+            # Linhas zeradas equivalem a linhas ausentes
+            tables[table] = {tuple(row) for row in await cursor.fetchall() if any(row[-4:])}
+    return tables
+
+
+async def main():
+    start = date.fromisoformat(sys.argv[1]) if len(sys.argv) > 1 else None
+    end = date.fromisoformat(sys.argv[2]) if len(sys.argv) > 2 else None
+    if (start is None) != (end is None):
+        raise SystemExit("Informe início e fim, ou nenhum dos dois")
+
+    await db_manager.initialize_database()
+    conn = await db_manager.get_connection()
+    try:
+        before = await snapshot(conn, start, end)
+        result = await rebuild_aggregates(conn, start, end)
+        after = await snapshot(conn, start, end)
+    finally:
+        await conn.close()
+
+    print(f"Período {result['inicio']} a {result['fim']}: {result['blocos']} blocos em {result['segundos']}s")
+    for table in SNAPSHOTS:
+        changed = len(before[table] ^ after[table])
+        print(f"  {table}: {len(after[table])} linhas, {changed} diferenças em relação ao que havia")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
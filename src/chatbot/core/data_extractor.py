@@ -64,18 +64,22 @@ class ConsultationDataExtractor:
 
     def analyze_user_response(self, chatbot_question: str, user_message: str, target_field: str,
                               valid_options: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Interpreta a resposta do usuário: pelo cache, por regras locais ou pelo Gemini. O
+        resultado traz em "resolucao" qual deles respondeu ('cache', 'local', 'llm' ou 'erro').
+        """
 
         cache_key = self._generate_cache_key(user_message, target_field, valid_options)
         if cache_key in self._cache:
             self._cache_hits += 1
             logging.info(f"✅ Cache HIT para '{user_message}' (hits: {self._cache_hits})")
-            return self._cache[cache_key]
+            return {**self._cache[cache_key], "resolucao": "cache"}
 
         local_result = self._try_local_processing(user_message, target_field, valid_options)
         if local_result:
             logging.info(f"⚡ Processamento LOCAL para '{user_message}'")
             self._cache[cache_key] = local_result
-            return local_result
+            return {**local_result, "resolucao": "local"}
 
         validation_text = f"Opções válidas: {valid_options}" if valid_options else "Sem validação específica"
         prompt = f"""Analise rapidamente:
@@ -111,7 +115,7 @@ JSON:"""
 
             self._cache[cache_key] = analysis
             logging.info(f"💾 Resultado salvo no cache (total: {len(self._cache)} entradas)")
-            return analysis
+            return {**analysis, "resolucao": "llm"}
 
         except json.JSONDecodeError as e:
             logging.error(f"JSON inválido: {e}")
@@ -322,7 +326,8 @@ JSON:"""
             "intent": "PROVIDE_INFO",
             "is_valid": False,
             "extracted_value": user_message,
-            "error_message": msg
+            "error_message": msg,
+            "resolucao": "erro"
         }
 
     def get_cache_stats(self) -> Dict[str, int]:
@@ -0,0 +1,140 @@
+# chatbot/flows/flow_compiler.py
+"""
+Compila o arquivo de fluxo (booking_flow.json) em objetos prontos para uso por turno.
+
+No carregamento, cada estado ganha:
+- um único regex com todas as palavras-chave de transição;
+- o template da mensagem já convertido para o formato do str.format
+  ({paciente.nome} -> {paciente_nome});
+- o tipo de lista de opções que deve ser anexada à mensagem (especialidades,
+  exames ou locais), renderizada uma vez por versão do catálogo.
+"""
+import re
+import json
+import string
+from pathlib import Path
+from typing import Dict, Optional
+
+
+# Campo extraído no estado -> (chave no catálogo, rótulo da lista de opções)
+OPTION_LISTS = {
+    "especialidade": ("specialties", "Especialidades disponíveis"),
+    "nome_exame": ("exams", "Exames disponíveis"),
+    "local": ("locations", "Locais disponíveis"),
+    "convenio": ("insurances", "Convênios aceitos"),
+}
+
+
+def _compile_template(message: str) -> str:
+    """Troca os pontos dos nomes de campo por underscores, preservando o resto do texto."""
+    parts = []
+    for literal, field_name, format_spec, conversion in string.Formatter().parse(message):
+        parts.append(literal.replace('{', '{{').replace('}', '}}'))
+        if field_name is not None:
+            field = field_name.replace('.', '_')
+            if conversion:
+                field += f"!{conversion}"
+            if format_spec:
+                field += f":{format_spec}"
+            parts.append('{' + field + '}')
+    return ''.join(parts)
+
+
+class CompiledState:
+    """Estado do fluxo com transições, template e lista de opções pré-processados."""
+    __slots__ = ('name', 'message', 'template', 'extract', 'target_field', 'next_state',
+                 'transitions', 'option_list', '_keywords', '_transition_regex', '_keyword_priority')
+
+    def __init__(self, name: str, raw: dict):
+        self.name = name
+        self.message = raw['message']
+        self.template = _compile_template(self.message)
+        self.extract = raw.get('extract')
+        self.target_field = (self.extract or "none").split('.')[-1]
+        self.next_state = raw.get('next_state')
+        self.transitions = raw.get('transitions', {})
+        self.option_list = OPTION_LISTS.get(self.target_field)
+
+        # Lookahead permite achar palavras-chave sobrepostas; a prioridade é a ordem do JSON
+        self._keywords = list(self.transitions.keys())
+        self._keyword_priority = {keyword: index for index, keyword in enumerate(self._keywords)}
+        if self._keywords:
+            alternation = '|'.join(re.escape(keyword) for keyword in self._keywords)
+            self._transition_regex = re.compile(f"(?=({alternation}))")
+        else:
+            self._transition_regex = None
+
+    @property
+    def is_terminal(self) -> bool:
+        """Estado final: não leva a nenhum outro estado."""
+        return not self.next_state and not self.transitions
+
+    def match_transition(self, message_lower: str) -> Optional[str]:
+        """
+        Retorna a primeira palavra-chave (na ordem do JSON) contida na mensagem,
+        com uma única passada do regex sobre o texto.
+        """
+        if self._transition_regex is None:
+            return None
+        best = None
+        for match in self._transition_regex.finditer(message_lower):
+            priority = self._keyword_priority[match.group(1)]
+            if best is None or priority < best:
+                best = priority
+                if best == 0:
+                    break
+        return None if best is None else self._keywords[best]
+
+
+def options_message(state: CompiledState, catalog: dict) -> str:
+    """Mensagem do estado com a lista de opções do catálogo anexada."""
+    message = state.message
+    if state.option_list:
+        catalog_key, label = state.option_list
+        options = catalog.get(catalog_key) or []
+        if options:
+            message += f"\n\n{label}: {', '.join(options)}"
+        elif catalog_key == "locations":
+            message += "\n\nErro ao carregar locais do banco de dados."
+    return message
+
+
+class CompiledFlow:
+    """Fluxo compilado com cache das mensagens de entrada por versão do catálogo."""
+
+    def __init__(self, raw_flow: dict):
+        self.version = 0
+        self.initial_state = raw_flow['initial_state']
+        self.states: Dict[str, CompiledState] = {
+            name: CompiledState(name, raw) for name, raw in raw_flow['states'].items()
+        }
+        for state in self.states.values():
+            for target in [state.next_state, *state.transitions.values()]:
+                if target and target not in self.states:
+                    raise ValueError(f"Estado '{state.name}' aponta para estado inexistente '{target}'")
+        self._entry_messages: Dict[str, str] = {}
+        self._entry_catalog_version = None
+
+    def __getitem__(self, state_name: str) -> CompiledState:
+        return self.states[state_name]
+
+    def entry_message(self, state: CompiledState, catalog: dict, catalog_version: int) -> str:
+        """
+        Mensagem exibida ao entrar no estado, com a lista de opções já anexada.
+        O resultado fica em cache até a versão do catálogo mudar.
+        """
+        if catalog_version != self._entry_catalog_version:
+            self._entry_messages = {}
+            self._entry_catalog_version = catalog_version
+
+        message = self._entry_messages.get(state.name)
+        if message is None:
+            message = options_message(state, catalog)
+            self._entry_messages[state.name] = message
+        return message
+
+
+def load_flow(flow_path: Path) -> CompiledFlow:
+    """Lê e compila um arquivo de fluxo."""
+    with open(flow_path, 'r', encoding='utf-8') as f:
+        return CompiledFlow(json.load(f))
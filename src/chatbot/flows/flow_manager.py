@@ -1,105 +1,137 @@
 # chatbot/flows/flow_manager.py
-import json
+import re
+import time
 import logging
 from pathlib import Path
 from datetime import datetime
+from typing import Optional
 from dateutil.parser import parse, ParserError
 from src.chatbot.core.data_extractor import ConsultationDataExtractor
-import sqlite3
-import aiosqlite
+from src.chatbot.flows.session_store import SessionStore
+from src.chatbot.flows.flow_compiler import CompiledState, options_message
+from src.chatbot.flows.flow_registry import FlowRegistry
+from src.config.settings import settings
+from src.services.catalog_service import CatalogService, catalog_service
+from src.services.availability_service import AvailabilityIndex, availability_index
+from src.services.booking_service import preferred_start
+from src.services.conversation_events import ConversationEventLog, conversation_events
+from src.services.slot_search import find_candidates, find_location, free_candidate, next_free_slots
+
+# Estado oferecido quando o horário preferido está ocupado (versões antigas do fluxo não o têm)
+ALTERNATIVE_SLOT_STATE = 'CHOOSE_ALTERNATIVE_SLOT'
 
 class FlowManager:
-    def __init__(self, flow_file='booking_flow.json', model=None):
+    def __init__(self, flow_file='booking_flow.json', model=None, catalog: CatalogService = catalog_service,
+                 availability: AvailabilityIndex = availability_index,
+                 events: ConversationEventLog = conversation_events):
         flow_path = Path(__file__).parent / flow_file
-        with open(flow_path, 'r', encoding='utf-8') as f:
-            self.flow = json.load(f)
-        self.user_conversations = {}
+        self.flows = FlowRegistry(flow_path)
+        # Log de eventos do funil: início, turnos e abandonos das conversas
+        self.events = events
+        self.user_conversations = SessionStore(
+            idle_timeout_seconds=settings.session_idle_timeout_seconds,
+            max_sessions=settings.session_max_count,
+            on_evict=self._record_abandon
+        )
         self.data_extractor = ConsultationDataExtractor()
-        self.db_path = 'src/database/medical_system.db'
+        # Catálogo (especialidades, exames, locais) lido do snapshot em memória, sem I/O por turno
+        self.catalog = catalog
+        # Índice de horários ocupados, consultado antes da confirmação
+        self.availability = availability
         
         logging.info("✅ FlowManager inicializado com validação local de datas")
 
     def get_specialties(self) -> list[str]:
-        """Busca especialidades diretamente do banco de dados."""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.execute("SELECT nome FROM Especialidades ORDER BY nome")
-                return [row[0] for row in cursor.fetchall()]
-        except sqlite3.Error as e:
-            logging.error(f"Erro ao buscar especialidades: {e}")
-            return ["Cardiologia", "Dermatologia", "Ortopedia", "Ginecologia", "Pediatria", "Neurologia"]
+        """Retorna as especialidades do catálogo em memória."""
+        return self.catalog.snapshot.specialties
 
     def get_exams(self) -> list[str]:
-        """Busca exames diretamente do banco de dados."""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.execute("SELECT nome FROM Exames ORDER BY nome")
-                return [row[0] for row in cursor.fetchall()]
-        except sqlite3.Error as e:
-            logging.error(f"Erro ao buscar exames: {e}")
-            return ["Hemograma Completo", "Raio-X Tórax", "Ultrassonografia Abdominal", "Eletrocardiograma"]
-
-    def get_locations_by_specialty(self, specialty_name: str) -> list[dict]:
-        """Busca locais por especialidade diretamente do banco de dados."""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                # Busca locais através dos médicos que atendem a especialidade
-                query = """
-                SELECT DISTINCT l.id_local, l.nome, l.endereco 
-                FROM Locais_Atendimento l
-                JOIN Medico_Especialidades me ON 1=1
-                JOIN Especialidades e ON me.id_especialidade = e.id_especialidade
-                WHERE LOWER(e.nome) = LOWER(?)
-                ORDER BY l.nome
-                """
-                cursor = conn.execute(query, (specialty_name,))
-                rows = cursor.fetchall()
-                locations = [{"id": row[0], "nome": row[1], "endereco": row[2]} for row in rows]
-                
-                # Se não encontrar, retorna todos os locais
-                if not locations:
-                    locations = self.get_all_locations()
-                    
-                return locations
-        except sqlite3.Error as e:
-            logging.error(f"Erro ao buscar locais por especialidade: {e}")
+        """Retorna os exames do catálogo em memória."""
+        return self.catalog.snapshot.exams
+
+    def get_locations_by_specialty(self, specialty_name: str, convenio: Optional[str] = None) -> list[dict]:
+        """
+        Retorna os locais onde algum médico da especialidade atende (Medico_Locais); com o
+        convênio, só aqueles onde um desses médicos aceita o convênio.
+        """
+        snapshot = self.catalog.snapshot
+        if convenio:
+            location_ids = set(snapshot.eligibility.locations(specialty_name, convenio))
+        else:
+            location_ids = set(snapshot.specialty_locations.get(specialty_name.lower().strip(), []))
+
+        # Especialidade sem agenda cadastrada: retorna todos os locais
+        if not location_ids:
             return self.get_all_locations()
+        return [loc for loc in snapshot.locations if loc["id"] in location_ids]
 
     def get_locations_for_exam(self, exam_name: str) -> list[dict]:
-        """Busca locais por exame diretamente do banco de dados."""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                query = """
-                SELECT l.id_local, l.nome, l.endereco
-                FROM Locais_Atendimento l
-                JOIN Local_Exames le ON l.id_local = le.id_local
-                JOIN Exames e ON le.id_exame = e.id_exame
-                WHERE LOWER(e.nome) LIKE LOWER(?)
-                ORDER BY l.nome
-                """
-                cursor = conn.execute(query, (f"%{exam_name}%",))
-                rows = cursor.fetchall()
-                locations = [{"id": row[0], "nome": row[1], "endereco": row[2]} for row in rows]
-                
-                # Se não encontrar locais específicos, retorna todos os locais
-                if not locations:
-                    return self.get_all_locations()
-                    
-                return locations
-        except sqlite3.Error as e:
-            logging.error(f"Erro ao buscar locais por exame: {e}")
+        """Retorna os locais onde o exame é realizado (busca parcial pelo nome)."""
+        snapshot = self.catalog.snapshot
+        exam_name = exam_name.lower()
+        location_ids = set()
+        for name, ids in snapshot.exam_locations.items():
+            if exam_name in name:
+                location_ids.update(ids)
+
+        # Se não encontrar locais específicos, retorna todos os locais
+        if not location_ids:
             return self.get_all_locations()
+        return [loc for loc in snapshot.locations if loc["id"] in location_ids]
 
     def get_all_locations(self) -> list[dict]:
-        """Busca todos os locais de atendimento do banco de dados."""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.execute("SELECT id_local, nome, endereco FROM Locais_Atendimento ORDER BY nome")
-                rows = cursor.fetchall()
-                return [{"id": row[0], "nome": row[1], "endereco": row[2]} for row in rows]
-        except sqlite3.Error as e:
-            logging.error(f"Erro ao buscar todos os locais: {e}")
-            return []
+        """Retorna todos os locais de atendimento do catálogo em memória."""
+        return self.catalog.snapshot.locations
+
+    def get_insurances_by_specialty(self, specialty_name: str, location_name: Optional[str] = None) -> list[str]:
+        """Retorna os convênios aceitos por algum médico da especialidade (no local escolhido, se houver)."""
+        snapshot = self.catalog.snapshot
+        insurances = snapshot.eligibility.insurances(specialty_name, find_location(snapshot, location_name))
+        # Especialidade sem médicos com convênio cadastrado: retorna todos os convênios
+        return insurances or snapshot.options["insurances"]
+
+    def _get_catalog(self, conversation=None) -> dict:
+        """
+        Listas de opções (especialidades, exames, nomes de locais e convênios) da versão atual do
+        catálogo. Com a conversa, os locais ficam restritos aos que atendem a especialidade ou o
+        exame escolhido e os convênios aos aceitos pelos médicos da especialidade no local escolhido.
+        """
+        options = self.catalog.snapshot.options
+        if conversation is None:
+            return options
+        agendamento = conversation.data.get('agendamento_info', {})
+        if str(agendamento.get('tipo') or '').lower() == 'exame' and agendamento.get('nome_exame'):
+            locations = self.get_locations_for_exam(agendamento['nome_exame'])
+            insurances = options["insurances"]
+        elif agendamento.get('especialidade'):
+            locations = self.get_locations_by_specialty(agendamento['especialidade'], agendamento.get('convenio'))
+            insurances = self.get_insurances_by_specialty(agendamento['especialidade'], agendamento.get('local'))
+        else:
+            return options
+        if locations is self.catalog.snapshot.locations and insurances == options["insurances"]:
+            return options
+        return {**options, "locations": [loc["nome"] for loc in locations], "insurances": insurances}
+
+    def _entry_message(self, flow, state_info: CompiledState, conversation) -> str:
+        """Mensagem de entrada do estado; só a versão com todas as opções fica em cache."""
+        catalog = self._get_catalog(conversation)
+        if catalog is self.catalog.snapshot.options:
+            return flow.entry_message(state_info, catalog, self.catalog_version)
+        return options_message(state_info, catalog)
+
+    @property
+    def catalog_version(self) -> int:
+        return self.catalog.version
+
+    def collect_flow_versions(self) -> list[int]:
+        """Descarta versões antigas do fluxo que nenhuma conversa em andamento usa mais."""
+        in_use = set()
+        for session in self.user_conversations.snapshot():
+            flow = self.flows.get(session.flow_version)
+            state = flow.states.get(session.current_state) if flow else None
+            if state is not None and not state.is_terminal:
+                in_use.add(session.flow_version)
+        return self.flows.collect_garbage(in_use)
 
     def validar_data_agendamento_local(self, entrada_usuario: str) -> dict:
         """
@@ -147,76 +179,94 @@ class FlowManager:
             return
             
         keys = data_key.split('.')
-        d = self.user_conversations[user_id]['data']
+        d = self.user_conversations.peek(user_id).data
         for key in keys[:-1]:
             d = d.setdefault(key, {})
         d[keys[-1]] = value
 
     def _get_current_state_response(self, user_id: str, message: str) -> dict:
         """Constrói o dicionário de resposta padrão com o estado atualizado."""
-        state = self.user_conversations.get(user_id, {})
+        session = self.user_conversations.peek(user_id)
         return {
             "next_question": message,
-            "conversation_data": state.get('data', {}),
-            "current_state": state.get('current_state', 'GREETING')
+            "conversation_data": session.data if session else {},
+            "current_state": session.current_state if session else 'GREETING'
         }
 
     def get_initial_message(self, user_id: str) -> dict:
         """Inicia uma nova conversa e retorna o estado inicial completo."""
-        initial_state_key = self.flow['initial_state']
-        self.user_conversations[user_id] = {
-            'current_state': initial_state_key,
-            'data': {}
-        }
+        # Novas conversas usam a versão atual do fluxo e ficam presas a ela até terminar
+        flow = self.flows.current
+        initial_state_key = flow.initial_state
+        self.user_conversations.create(user_id, initial_state_key, flow.version)
+        self.events.record("inicio", user_id, flow.version, initial_state_key)
         
         # Para o estado inicial, apenas retorna a mensagem sem modificações
-        initial_state_info = self.flow['states'][initial_state_key]
-        message = initial_state_info['message']
+        message = flow[initial_state_key].message
         
         return self._get_current_state_response(user_id, message)
 
-    def _handle_user_question(self, user_id: str, current_state_info: dict) -> dict:
+    def _handle_user_question(self, user_id: str, current_state_info: CompiledState) -> dict:
         """Gera uma resposta quando o usuário faz uma pergunta sobre as opções."""
-        target_field = current_state_info.get("extract", "")
-        current_state = self.user_conversations[user_id]['current_state']
+        target_field = current_state_info.extract or ""
+        catalog = self._get_catalog(self.user_conversations.get(user_id))
 
         if "especialidade" in target_field:
-            try:
-                specialties = self.get_specialties()
-                specialty_list = ", ".join(specialties)
-                message = f"As especialidades disponíveis são: {specialty_list}. Qual delas você gostaria?"
-            except Exception as e:
-                logging.error(f"Erro ao buscar especialidades: {e}")
-                message = "Houve um erro ao buscar as especialidades. Por favor, me informe qual especialidade você precisa."
+            specialty_list = ", ".join(catalog["specialties"])
+            message = f"As especialidades disponíveis são: {specialty_list}. Qual delas você gostaria?"
         elif "local" in target_field:
-            # Para o estado de local, mostra TODOS os locais do banco de dados
-            try:
-                locations = self.get_all_locations()
-                if locations:
-                    location_list = ", ".join([loc['nome'] for loc in locations])
-                    message = f"Os locais disponíveis são: {location_list}. Qual você escolhe?"
-                else:
-                    message = "Não encontrei locais disponíveis. Por favor, me informe um local de sua preferência."
-            except Exception as e:
-                logging.error(f"Erro ao buscar locais: {e}")
-                message = "Houve um erro ao buscar os locais. Por favor, me informe qual local você prefere."
+            # Para o estado de local, mostra os locais que atendem a especialidade ou o exame escolhido
+            if catalog["locations"]:
+                location_list = ", ".join(catalog["locations"])
+                message = f"Os locais disponíveis são: {location_list}. Qual você escolhe?"
+            else:
+                message = "Não encontrei locais disponíveis. Por favor, me informe um local de sua preferência."
+        elif "convenio" in target_field and catalog["insurances"]:
+            # Convênios aceitos pelos médicos da especialidade escolhida
+            insurance_list = ", ".join(catalog["insurances"])
+            message = f"Os convênios aceitos são: {insurance_list}. Qual é o seu?"
         else:
             message = "Não tenho uma lista de opções para esta pergunta. Por favor, me informe o que você precisa."
         
         return self._get_current_state_response(user_id, message)
 
+    def _record_abandon(self, user_id: str, session, reason: str):
+        """Sessão descartada (inatividade ou capacidade) antes de chegar a um estado final."""
+        flow = self.flows.get(session.flow_version)
+        state = flow.states.get(session.current_state) if flow else None
+        if state is None or not state.is_terminal:
+            self.events.record("abandono", user_id, session.flow_version, session.current_state)
+
     def process_user_response(self, user_id: str, user_message: str) -> dict:
         """Processa a resposta e retorna um dicionário completo com o novo estado."""
-        if user_id not in self.user_conversations:
+        started = time.perf_counter()
+        # Preenchido pelo turno: estado de partida, como a resposta foi interpretada e se foi aceita
+        turn = {"estado": None, "versao": None, "resolucao": "local", "valido": True}
+        response = self._process_turn(user_id, user_message, turn)
+        if turn["estado"] is not None:
+            self.events.record(
+                "turno", user_id, turn["versao"], turn["estado"], response["current_state"], turn["resolucao"],
+                turn["valido"], int((time.perf_counter() - started) * 1_000_000)
+            )
+        return response
+
+    def _process_turn(self, user_id: str, user_message: str, turn: dict) -> dict:
+        conversation = self.user_conversations.get(user_id)
+        if conversation is None:
             return self.get_initial_message(user_id)
 
-        conversation = self.user_conversations[user_id]
-        current_state_key = conversation['current_state']
-        current_state_info = self.flow['states'][current_state_key]
+        current_state_key = conversation.current_state
+        flow = self.flows.get(conversation.flow_version)
+        if flow is None or current_state_key not in flow.states:
+            # A versão do fluxo desta conversa já foi descartada: recomeça na versão atual
+            return self.get_initial_message(user_id)
+        current_state_info = flow[current_state_key]
+        turn.update(estado=current_state_key, versao=conversation.flow_version)
 
-        logging.info(f"--- INÍCIO DA DEPURAÇÃO ---")
-        logging.info(f"Estado Atual Recebido: '{current_state_key}'")
-        logging.info(f"Processando a mensagem do usuário: '{user_message}'")
+        # Rastro detalhado do turno; o funil e as latências por estado ficam no log de eventos
+        logging.debug(f"--- INÍCIO DA DEPURAÇÃO ---")
+        logging.debug(f"Estado Atual Recebido: '{current_state_key}'")
+        logging.debug(f"Processando a mensagem do usuário: '{user_message}'")
 
         # --- INÍCIO DA IMPLEMENTAÇÃO OBRIGATÓRIA ---
         # Verificação especial para o estado de data, ANTES de qualquer outra coisa.
@@ -229,139 +279,196 @@ class FlowManager:
                 self._save_data(user_id, "preferencias.data_preferencia", resultado_validacao["data_formatada"])
                 
                 # Lógica para encontrar o próximo estado
-                current_state_info = self.flow['states'][current_state_key]
-                next_state = current_state_info.get('next_state')  # Deve ser 'GET_PREFERRED_TIME'
+                next_state = current_state_info.next_state  # Deve ser 'GET_PREFERRED_TIME'
                 
                 if next_state:
-                    conversation['current_state'] = next_state
-                    next_state_info = self.flow['states'][next_state]
-                    return self._get_current_state_response(user_id, next_state_info['message'])
+                    conversation.current_state = next_state
+                    return self._get_current_state_response(user_id, flow[next_state].message)
                 else:
                     # ERRO NO ARQUIVO JSON DO FLUXO
                     return self._get_current_state_response(user_id, "Erro de configuração: próximo estado não definido.")
 
             else:
                 # Se a data for INVÁLIDA, retorne a mensagem de erro e NÃO avance.
+                turn["valido"] = False
                 return self._get_current_state_response(user_id, resultado_validacao["mensagem_erro"])
 
+        # Escolha entre os horários alternativos também é resolvida localmente, sem IA
+        if current_state_key == ALTERNATIVE_SLOT_STATE:
+            response = self._choose_alternative_slot(user_id, conversation, flow, current_state_info, user_message)
+            # Sem uma opção válida a conversa fica no mesmo estado
+            turn["valido"] = conversation.current_state != current_state_key
+            return response
+
         # O resto do processamento, que inclui a chamada à IA, só deve ser executado
         # para os OUTROS estados. A lógica acima intercepta e resolve o estado da data.
         # --- FIM DA IMPLEMENTAÇÃO OBRIGATÓRIA ---
 
-        target_field_key = current_state_info.get("extract", "none").split('.')[-1]
+        target_field_key = current_state_info.target_field
         
-        # Define opções válidas baseadas no estado atual
+        # Define opções válidas baseadas no estado atual (já carregadas no catálogo em memória)
         valid_options = None
-        if target_field_key == "especialidade":
-            try:
-                valid_options = self.get_specialties()
-            except Exception as e:
-                logging.error(f"Erro ao buscar especialidades: {e}")
-                valid_options = []
-        elif target_field_key == "nome_exame":
-            try:
-                valid_options = self.get_exams()
-            except Exception as e:
-                logging.error(f"Erro ao buscar exames: {e}")
-                valid_options = []
-        elif target_field_key == "local":
-            try:
-                # Sempre mostra TODOS os locais do banco de dados
-                locations = self.get_all_locations()
-                valid_options = [loc['nome'] for loc in locations] if locations else []
-            except Exception as e:
-                logging.error(f"Erro ao buscar locais: {e}")
-                valid_options = []
+        if current_state_info.option_list:
+            valid_options = self._get_catalog(conversation)[current_state_info.option_list[0]]
 
         analysis = self.data_extractor.analyze_user_response(
-            chatbot_question=current_state_info['message'],
+            chatbot_question=current_state_info.message,
             user_message=user_message,
             target_field=target_field_key,
             valid_options=valid_options
         )
+        turn["resolucao"] = analysis.get('resolucao', 'llm')
 
         if analysis['intent'] == 'ASK_QUESTION':
             return self._handle_user_question(user_id, current_state_info)
 
         if not analysis['is_valid']:
+            turn["valido"] = False
             error_message = analysis.get('error_message', "A informação fornecida não é válida.")
             return self._get_current_state_response(user_id, error_message)
 
         # Extrai o valor da análise (para todos os estados EXCETO data_preferencia)
         extracted_value = analysis['extracted_value']
 
-        self._save_data(user_id, current_state_info.get('extract'), extracted_value)
-        logging.info(f"Dados salvos. Conteúdo de conversation['data']: {conversation['data']}")
+        self._save_data(user_id, current_state_info.extract, extracted_value)
+        logging.debug(f"Dados salvos. Conteúdo de conversation['data']: {conversation.data}")
 
         # Lógica de transição - PONTO MAIS CRÍTICO
-        next_state = current_state_info.get('next_state')
-        logging.info(f"Próximo estado definido no JSON: '{next_state}'")
+        next_state = current_state_info.next_state
+        logging.debug(f"Próximo estado definido no JSON: '{next_state}'")
         
-        if 'transitions' in current_state_info:
-            logging.info(f"Transitions encontradas: {current_state_info['transitions']}")
-            for keyword, state in current_state_info['transitions'].items():
-                if keyword in user_message.lower():
-                    next_state = state
-                    logging.info(f"Keyword '{keyword}' encontrada! Redirecionando para estado: '{state}'")
-                    break
+        keyword = current_state_info.match_transition(user_message.lower())
+        if keyword:
+            next_state = current_state_info.transitions[keyword]
+            logging.debug(f"Keyword '{keyword}' encontrada! Redirecionando para estado: '{next_state}'")
         
+        if next_state == 'CONFIRMATION' and ALTERNATIVE_SLOT_STATE in flow.states:
+            # Antes de confirmar, verifica se o horário preferido está livre; se não, oferece os próximos
+            alternatives = self._check_preferred_slot(conversation)
+            if alternatives is not None:
+                return self._offer_alternative_slots(user_id, conversation, flow, alternatives)
+
         if next_state:
-            conversation['current_state'] = next_state
-            logging.info(f"TRANSIÇÃO APLICADA. Novo estado será: '{conversation['current_state']}'")
-            next_state_info = self.flow['states'][next_state]
+            conversation.current_state = next_state
+            logging.debug(f"TRANSIÇÃO APLICADA. Novo estado será: '{conversation.current_state}'")
+            next_state_info = flow[next_state]
             
-            message = next_state_info['message']
+            # Mensagem do estado com a lista de opções (especialidades, exames ou locais) já anexada
+            message = self._entry_message(flow, next_state_info, conversation)
             
-            # Personaliza mensagens baseadas no estado
-            if next_state == 'GET_SPECIALTY':
-                # Adiciona lista de especialidades disponíveis
-                try:
-                    specialties = self.get_specialties()
-                    if specialties:
-                        specialty_list = ", ".join(specialties)
-                        message += f"\n\nEspecialidades disponíveis: {specialty_list}"
-                except Exception as e:
-                    logging.error(f"Erro ao buscar especialidades: {e}")
-            elif next_state == 'GET_EXAM_TYPE':
-                # Adiciona lista de exames disponíveis
-                try:
-                    exams = self.get_exams()
-                    if exams:
-                        exam_list = ", ".join(exams)
-                        message += f"\n\nExames disponíveis: {exam_list}"
-                except Exception as e:
-                    logging.error(f"Erro ao buscar exames: {e}")
-            elif next_state == 'GET_LOCATION':
-                # Sempre mostra TODOS os locais do banco de dados
-                try:
-                    all_locations = self.get_all_locations()
-                    if all_locations:
-                        location_names = [loc['nome'] for loc in all_locations]
-                        location_list = ", ".join(location_names)
-                        message += f"\n\nLocais disponíveis: {location_list}"
-                    else:
-                        message += f"\n\nErro ao carregar locais do banco de dados."
-                except Exception as e:
-                    logging.error(f"Erro ao buscar locais: {e}")
-                    message += f"\n\nErro ao carregar locais. Por favor, informe um local de sua preferência."
-            elif next_state == 'CONFIRMATION':
-                message = self._format_confirmation_message(user_id, message)
+            if next_state == 'CONFIRMATION':
+                message = self._format_confirmation_message(user_id, next_state_info.template)
             elif next_state == 'END':
-                message = self._format_end_message(user_id, message)
+                message = self._format_end_message(user_id, next_state_info.template)
                 # LOG CRÍTICO: Mostra dados quando usuário atinge estado END
-                logging.info(f"🎯 USUÁRIO ATINGIU ESTADO END - DADOS COLETADOS: {conversation['data']}")
+                logging.info(f"🎯 USUÁRIO ATINGIU ESTADO END - DADOS COLETADOS: {conversation.data}")
 
-            logging.info(f"--- FIM DA DEPURAÇÃO ---")
+            logging.debug(f"--- FIM DA DEPURAÇÃO ---")
             return self._get_current_state_response(user_id, message)
         else:
             logging.error("FALHA CRÍTICA: NENHUM 'next_state' FOI DETERMINADO. O FLUXO ESTÁ QUEBRADO.")
-            logging.info(f"--- FIM DA DEPURAÇÃO ---")
+            turn["valido"] = False
+            logging.debug(f"--- FIM DA DEPURAÇÃO ---")
         
         return self._get_current_state_response(user_id, "Desculpe, não entendi. Pode repetir?")
 
+    def _check_preferred_slot(self, conversation) -> Optional[list]:
+        """
+        Retorna None quando o horário preferido está livre (ou não há como verificar) e,
+        caso contrário, os próximos horários livres para a especialidade ou exame escolhido.
+        Com o horário livre, o médico disponível fica salvo em agendamento_info.id_medico.
+        """
+        agendamento = conversation.data.setdefault('agendamento_info', {})
+        preferencias = conversation.data.get('preferencias', {})
+        tipo = str(agendamento.get('tipo') or '').lower()
+        nome = agendamento.get('nome_exame') if tipo == 'exame' else agendamento.get('especialidade')
+        if not nome or not preferencias.get('data_preferencia'):
+            return None
+
+        snapshot = self.catalog.snapshot
+        duration, candidates = find_candidates(snapshot, tipo, nome, agendamento.get('convenio'),
+                                               find_location(snapshot, agendamento.get('local')))
+        if not candidates:
+            return None
+        try:
+            start = preferred_start(preferencias['data_preferencia'], preferencias.get('horario_preferencia'))
+        except ValueError:
+            return None
+
+        free = free_candidate(self.availability, candidates, start, duration)
+        if free is not None:
+            if free.id_medico is not None:
+                agendamento['id_medico'] = free.id_medico
+            return None
+
+        after = max(datetime.now(), start.replace(hour=0, minute=0))
+        return next_free_slots(self.availability, candidates, duration, after,
+                               settings.chatbot_alternative_slots, distinct_times=True)
+
+    def _offer_alternative_slots(self, user_id: str, conversation, flow, alternatives: list) -> dict:
+        """Leva a conversa ao estado de escolha de horário (ou de volta à data, se não houver opções)."""
+        if not alternatives:
+            conversation.current_state = 'GET_PREFERRED_DATE'
+            message = (f"Não encontrei horários livres nos próximos {settings.slot_search_horizon_days} dias "
+                       f"a partir da data escolhida. {flow['GET_PREFERRED_DATE'].message}")
+            return self._get_current_state_response(user_id, message)
+
+        conversation.slot_options = alternatives
+        conversation.current_state = ALTERNATIVE_SLOT_STATE
+        return self._get_current_state_response(
+            user_id, self._format_slot_options(flow[ALTERNATIVE_SLOT_STATE].template, alternatives)
+        )
+
+    def _choose_alternative_slot(self, user_id: str, conversation, flow, state_info: CompiledState,
+                                 user_message: str) -> dict:
+        """Aplica a opção escolhida (pelo número) ou segue a transição pedida ('outra data')."""
+        options = conversation.slot_options or []
+        keyword = state_info.match_transition(user_message.lower())
+        if keyword:
+            conversation.slot_options = None
+            next_state = state_info.transitions[keyword]
+            conversation.current_state = next_state
+            return self._get_current_state_response(
+                user_id, self._entry_message(flow, flow[next_state], conversation)
+            )
+
+        choice = re.search(r"\d+", user_message)
+        if not choice or not 1 <= int(choice.group()) <= len(options):
+            message = f"Por favor, responda com o número de uma das opções (1 a {len(options)}) ou 'outra data'."
+            return self._get_current_state_response(user_id, message)
+
+        slot = options[int(choice.group()) - 1]
+        start = datetime.fromisoformat(slot['data_hora_inicio'])
+        self._save_data(user_id, "preferencias.data_preferencia", start.strftime('%Y-%m-%d'))
+        self._save_data(user_id, "preferencias.horario_preferencia", start.strftime('%H:%M'))
+        if slot.get('id_medico') is not None:
+            self._save_data(user_id, "agendamento_info.id_medico", slot['id_medico'])
+        conversation.slot_options = None
+
+        next_state = state_info.next_state
+        conversation.current_state = next_state
+        if next_state == 'CONFIRMATION':
+            message = self._format_confirmation_message(user_id, flow[next_state].template)
+        else:
+            message = self._entry_message(flow, flow[next_state], conversation)
+        return self._get_current_state_response(user_id, message)
+
+    def _format_slot_options(self, message_template: str, options: list) -> str:
+        """Lista numerada dos horários oferecidos, com o médico ou o local de cada um."""
+        lines = []
+        for number, slot in enumerate(options, start=1):
+            start = datetime.fromisoformat(slot['data_hora_inicio'])
+            where = slot.get('nome_medico') or slot.get('nome_local')
+            lines.append(f"{number}. {start:%d/%m/%Y} às {start:%H:%M}" + (f" — {where}" if where else ""))
+        try:
+            return message_template.format(opcoes="\n".join(lines))
+        except KeyError as e:
+            logging.error(f"Erro ao formatar horários alternativos: {e}")
+            return "\n".join(lines)
+
     def _format_confirmation_message(self, user_id: str, message_template: str) -> str:
         """Formata a mensagem de confirmação com todos os dados coletados."""
-        data = self.user_conversations[user_id]['data']
+        data = self.user_conversations.peek(user_id).data
         
         # Extrai dados aninhados com valores padrão
         paciente = data.get('paciente', {})
@@ -398,18 +505,16 @@ class FlowManager:
             'agendamento_info_convenio': agendamento.get('convenio', 'Não informado')
         }
         
-        # Converte template para usar underscores
-        template_fixed = message_template.replace('.', '_')
-        
+        # O template já vem compilado com underscores no lugar dos pontos (flow_compiler)
         try:
-            return template_fixed.format(**format_values)
+            return message_template.format(**format_values)
         except KeyError as e:
             logging.error(f"Erro ao formatar mensagem de confirmação: {e}")
             return "Erro ao gerar resumo dos dados. Vamos prosseguir com o agendamento?"
 
     def _format_end_message(self, user_id: str, message_template: str) -> str:
         """Formata a mensagem final com dados de contato."""
-        data = self.user_conversations[user_id]['data']
+        data = self.user_conversations.peek(user_id).data
         contato = data.get('contato', {})
         
         telefone = contato.get('telefone', 'seu telefone')
@@ -421,11 +526,8 @@ class FlowManager:
             'email_confirmation': email_confirmation
         }
         
-        # Converte template para usar underscores
-        template_fixed = message_template.replace('.', '_')
-        
         try:
-            return template_fixed.format(**format_values)
+            return message_template.format(**format_values)
         except KeyError as e:
             logging.error(f"Erro ao formatar mensagem final: {e}")
             return "Agendamento processado com sucesso! Obrigado por usar nosso sistema!"
\ No newline at end of file
@@ -0,0 +1,98 @@
+# chatbot/flows/flow_registry.py
+"""
+Versões compiladas do fluxo de agendamento com recarga a quente.
+
+Uma nova versão de booking_flow.json é compilada por completo antes de ser publicada,
+e a troca é atômica: se o arquivo tiver erro, a versão atual continua em uso.
+Conversas em andamento continuam presas à versão com que começaram; versões antigas
+são descartadas quando nenhuma conversa ativa as usa mais.
+"""
+import asyncio
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from src.chatbot.flows.flow_compiler import CompiledFlow, load_flow
+
+
+class FlowRegistry:
+    """Mantém as versões compiladas do fluxo e qual delas é a atual."""
+
+    def __init__(self, flow_path: Path):
+        self.flow_path = flow_path
+        self._versions: Dict[int, CompiledFlow] = {}
+        self._lock = threading.Lock()
+        self.current_version = 0
+        self._content_hash = None
+        self._mtime = None
+        self.reload()
+
+    @property
+    def current(self) -> CompiledFlow:
+        return self._versions[self.current_version]
+
+    def get(self, version: int) -> Optional[CompiledFlow]:
+        """Retorna a versão pedida, ou None se ela já foi descartada."""
+        return self._versions.get(version)
+
+    def reload(self, force: bool = False) -> int:
+        """
+        Compila o arquivo de fluxo e publica como nova versão se o conteúdo mudou.
+        Levanta exceção (sem alterar a versão atual) se o arquivo for inválido.
+        """
+        raw = self.flow_path.read_bytes()
+        content_hash = hashlib.sha256(raw).hexdigest()
+        self._mtime = self.flow_path.stat().st_mtime
+        if content_hash == self._content_hash and not force:
+            return self.current_version
+
+        flow = load_flow(self.flow_path)
+        with self._lock:
+            version = self.current_version + 1
+            flow.version = version
+            self._versions[version] = flow
+            self.current_version = version
+            self._content_hash = content_hash
+        logging.info(f"🔄 Fluxo de agendamento carregado na versão {version}")
+        return version
+
+    def check_for_changes(self) -> bool:
+        """Recarrega o fluxo se o arquivo foi modificado. Retorna True se uma nova versão foi publicada."""
+        try:
+            if self.flow_path.stat().st_mtime == self._mtime:
+                return False
+            previous = self.current_version
+            return self.reload() != previous
+        except Exception as e:
+            logging.error(f"Erro ao recarregar {self.flow_path.name}, mantendo versão {self.current_version}: {e}")
+            return False
+
+    def collect_garbage(self, versions_in_use: Iterable[int]) -> List[int]:
+        """Descarta versões antigas que nenhuma conversa ativa usa."""
+        in_use = set(versions_in_use)
+        with self._lock:
+            stale = [v for v in self._versions if v != self.current_version and v not in in_use]
+            for version in stale:
+                del self._versions[version]
+        if stale:
+            logging.info(f"🗑️ Versões do fluxo descartadas: {stale}")
+        return stale
+
+    def metrics(self) -> dict:
+        return {
+            "current_version": self.current_version,
+            "loaded_versions": sorted(self._versions),
+        }
+
+
+async def run_flow_watcher(flow_manager, interval_seconds: int):
+    """Tarefa de fundo que recarrega o fluxo quando o arquivo muda e descarta versões sem uso."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            flow_manager.flows.check_for_changes()
+            flow_manager.collect_flow_versions()
+        except Exception as e:
+            logging.error(f"Erro no monitoramento do fluxo: {e}")
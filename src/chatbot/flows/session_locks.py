@@ -0,0 +1,78 @@
+# chatbot/flows/session_locks.py
+"""
+Serialização das mensagens de uma mesma conversa.
+
+Cliques duplos e novas tentativas do frontend podem enviar duas mensagens do mesmo
+user_id ao mesmo tempo. Cada sessão tem seu próprio lock assíncrono, de modo que os
+turnos de uma conversa rodam estritamente em ordem enquanto conversas diferentes
+continuam em paralelo. Uma mensagem idêntica a outra ainda em andamento não é
+processada de novo: aguarda e recebe o mesmo resultado da primeira.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+class SessionSerializer:
+    """Locks por sessão com deduplicação de mensagens idênticas em andamento."""
+
+    def __init__(self):
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._lock_users: Dict[str, int] = {}
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self.deduplicated = 0
+
+    def _acquire_entry(self, user_id: str) -> asyncio.Lock:
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        self._lock_users[user_id] = self._lock_users.get(user_id, 0) + 1
+        return lock
+
+    def _release_entry(self, user_id: str):
+        remaining = self._lock_users[user_id] - 1
+        if remaining:
+            self._lock_users[user_id] = remaining
+        else:
+            # Ninguém mais usa o lock desta sessão: remove para não acumular memória
+            del self._lock_users[user_id]
+            del self._locks[user_id]
+
+    async def run(self, user_id: str, message: str, handler: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Executa `handler` com o lock da sessão. Se a mesma mensagem já estiver em
+        andamento para esta sessão, aguarda o resultado dela em vez de reprocessar.
+        """
+        key = (user_id, message)
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.deduplicated += 1
+            logging.info(f"♻️ Mensagem duplicada em andamento para user_id='{user_id}', reutilizando resultado")
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        lock = self._acquire_entry(user_id)
+        try:
+            async with lock:
+                result = await handler()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Evita o aviso "exception was never retrieved" quando não houve duplicatas
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+            self._release_entry(user_id)
+
+    def metrics(self) -> dict:
+        return {
+            "active_sessions": len(self._locks),
+            "inflight_messages": len(self._inflight),
+            "deduplicated_messages": self.deduplicated,
+        }
@@ -0,0 +1,166 @@
+# chatbot/flows/session_store.py
+"""
+Armazenamento em memória das conversas ativas do chatbot.
+
+Cada conversa expira após um tempo ocioso e o total de sessões vivas é limitado;
+quando o limite é atingido, a sessão usada há mais tempo (LRU) é descartada.
+"""
+import sys
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+
+class ConversationSession:
+    """Estado compacto de uma conversa (estado atual, dados coletados e versão do fluxo)."""
+    __slots__ = ('current_state', 'data', 'flow_version', 'last_seen', 'slot_options')
+
+    def __init__(self, current_state: str, data: Optional[dict] = None, flow_version: int = 0):
+        self.current_state = current_state
+        self.data = data if data is not None else {}
+        self.flow_version = flow_version
+        self.last_seen = time.monotonic()
+        # Horários alternativos oferecidos quando o horário preferido está ocupado
+        self.slot_options: Optional[list] = None
+
+
+def _deep_sizeof(obj) -> int:
+    """Tamanho aproximado em bytes de um objeto e de tudo que ele referencia."""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_sizeof(k) + _deep_sizeof(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(_deep_sizeof(item) for item in obj)
+    elif hasattr(obj, '__slots__'):
+        size += sum(_deep_sizeof(getattr(obj, slot)) for slot in obj.__slots__ if hasattr(obj, slot))
+    return size
+
+
+class SessionStore:
+    """
+    Mapa user_id -> ConversationSession com expiração por inatividade e limite LRU.
+
+    As sessões ficam ordenadas da menos para a mais recentemente usada, então tanto a
+    varredura de expiradas quanto o descarte por capacidade só olham o início da fila.
+    """
+
+    def __init__(self, idle_timeout_seconds: int, max_sessions: int,
+                 on_evict: Optional[Callable[[str, ConversationSession, str], None]] = None):
+        self.idle_timeout = idle_timeout_seconds
+        self.max_sessions = max_sessions
+        # Chamado com (user_id, sessão, motivo) para cada sessão descartada ('idle' ou 'capacity')
+        self.on_evict = on_evict
+        self._sessions: "OrderedDict[str, ConversationSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = {"idle": 0, "capacity": 0}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, user_id: str) -> bool:
+        return self.peek(user_id) is not None
+
+    def _is_expired(self, session: ConversationSession, now: float) -> bool:
+        return now - session.last_seen > self.idle_timeout
+
+    def _evicted(self, user_id: str, session: ConversationSession, reason: str):
+        if self.on_evict is not None:
+            try:
+                self.on_evict(user_id, session, reason)
+            except Exception as e:
+                logging.error(f"Erro ao registrar o descarte da sessão '{user_id}': {e}")
+
+    def peek(self, user_id: str) -> Optional[ConversationSession]:
+        """Retorna a sessão sem renovar o tempo de inatividade."""
+        return self._sessions.get(user_id)
+
+    def get(self, user_id: str) -> Optional[ConversationSession]:
+        """Retorna a sessão ativa e renova seu tempo de inatividade; None se não existir ou tiver expirado."""
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None:
+                return None
+            if self._is_expired(session, now):
+                del self._sessions[user_id]
+                self.evictions["idle"] += 1
+                self._evicted(user_id, session, "idle")
+                return None
+            session.last_seen = now
+            self._sessions.move_to_end(user_id)
+            return session
+
+    def create(self, user_id: str, current_state: str, flow_version: int = 0) -> ConversationSession:
+        """Cria (ou reinicia) a sessão do usuário, descartando as menos usadas se o limite for excedido."""
+        session = ConversationSession(current_state, flow_version=flow_version)
+        with self._lock:
+            self._sessions[user_id] = session
+            self._sessions.move_to_end(user_id)
+            while len(self._sessions) > self.max_sessions:
+                evicted_id, evicted = self._sessions.popitem(last=False)
+                self.evictions["capacity"] += 1
+                self._evicted(evicted_id, evicted, "capacity")
+                logging.info(f"Sessão '{evicted_id}' descartada por limite de capacidade")
+        return session
+
+    def pop(self, user_id: str) -> Optional[ConversationSession]:
+        with self._lock:
+            return self._sessions.pop(user_id, None)
+
+    def snapshot(self) -> list:
+        """Cópia da lista de sessões vivas, para varreduras fora do lock."""
+        with self._lock:
+            return list(self._sessions.values())
+
+    def sweep(self) -> int:
+        """Remove as sessões ociosas além do tempo limite. Retorna quantas foram removidas."""
+        now = time.monotonic()
+        removed = 0
+        with self._lock:
+            while self._sessions:
+                user_id, session = next(iter(self._sessions.items()))
+                if not self._is_expired(session, now):
+                    break
+                del self._sessions[user_id]
+                removed += 1
+                self._evicted(user_id, session, "idle")
+            self.evictions["idle"] += removed
+        return removed
+
+    def metrics(self, sample_size: int = 32) -> dict:
+        """Métricas de uso: sessões vivas, descartes e tamanho médio aproximado por sessão."""
+        with self._lock:
+            sample = list(self._sessions.values())[-sample_size:]
+            live = len(self._sessions)
+        # As sessões da amostra podem estar sendo alteradas por um turno em andamento (em outra
+        # thread): a que mudar de tamanho durante a medição fica fora da média
+        sizes = []
+        for session in sample:
+            try:
+                sizes.append(_deep_sizeof(session))
+            except RuntimeError:
+                continue
+        approx_bytes = int(sum(sizes) / len(sizes)) if sizes else 0
+        return {
+            "live_sessions": live,
+            "max_sessions": self.max_sessions,
+            "idle_timeout_seconds": self.idle_timeout,
+            "evictions_idle": self.evictions["idle"],
+            "evictions_capacity": self.evictions["capacity"],
+            "approx_bytes_per_session": approx_bytes,
+        }
+
+
+async def run_session_sweeper(store: SessionStore, interval_seconds: int):
+    """Tarefa de fundo que varre periodicamente as sessões expiradas."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            removed = store.sweep()
+            if removed:
+                logging.info(f"🧹 {removed} sessões ociosas removidas (vivas: {len(store)})")
+        except Exception as e:
+            logging.error(f"Erro ao varrer sessões expiradas: {e}")
@@ -27,6 +27,107 @@ class Settings(BaseSettings):
     secret_key: str = "your-secret-key-change-this-in-production"
     access_token_expire_minutes: int = 30
     
+    # Chatbot session settings
+    session_idle_timeout_seconds: int = 1800
+    session_max_count: int = 10000
+    session_sweep_interval_seconds: int = 60
+    catalog_refresh_seconds: int = 300
+    flow_watch_interval_seconds: int = 5
+    
+    # PDF intake settings
+    pdf_parse_workers: int = 2
+    pdf_job_concurrency: int = 4
+    pdf_max_upload_bytes: int = 20 * 1024 * 1024
+    pdf_spool_memory_bytes: int = 1024 * 1024
+    pdf_pages_per_worker: int = 32
+    pdf_cache_ttl_seconds: int = 7 * 24 * 3600
+    pdf_prompt_token_budget: int = 2000
+    pdf_prompt_chunk_chars: int = 1200
+    pdf_bulk_max_upload_bytes: int = 500 * 1024 * 1024
+    pdf_bulk_max_files: int = 1000
+    pdf_bulk_concurrency: int = 8
+    pdf_bulk_commit_batch: int = 50
+    
+    # Scheduling settings
+    appointment_default_minutes: int = 60
+    # Longest appointment accepted; bounds the range scanned by the overlap checks
+    appointment_max_minutes: int = 240
+    working_hours_start: str = "08:00"
+    working_hours_end: str = "18:00"
+    # 0 = Monday
+    working_weekdays: list = [0, 1, 2, 3, 4]
+    slot_search_step_minutes: int = 15
+    slot_search_horizon_days: int = 90
+    slot_search_max_results: int = 20
+    chatbot_alternative_slots: int = 3
+    # earliest_free, least_loaded or round_robin
+    doctor_assignment_strategy: str = "least_loaded"
+    # How often past days are dropped from the in-memory availability index
+    availability_prune_interval_seconds: int = 3600
+    
+    # Appointment listing (keyset pages) and streaming export
+    appointment_list_default_limit: int = 100
+    appointment_list_max_limit: int = 1000
+    appointment_export_batch: int = 1000
+    
+    # Archival of old appointments (Agendamentos_Arquivo)
+    # Finished appointments that started more than this many days ago are archived
+    archive_horizon_days: int = 730
+    archive_batch_size: int = 500
+    # Pause between batches, so bookings get the write lock
+    archive_batch_pause_seconds: float = 0.05
+    # 0 disables the periodic archiver
+    archive_interval_seconds: int = 3600
+    
+    # Occupancy and demand dashboards (aggregates kept by triggers)
+    # Longest window, in days, one dashboard request may cover
+    dashboard_max_days: int = 366
+    # Days of appointments recomputed per transaction by the aggregate rebuild
+    aggregate_rebuild_chunk_days: int = 31
+    
+    # Waitlist settings
+    # How long a freed slot stays reserved for the waitlisted patient it was offered to
+    waitlist_offer_minutes: int = 30
+    # Freed slots starting sooner than this are not offered
+    waitlist_min_notice_minutes: int = 60
+    # Queue entries read per indexed page while looking for a compatible patient
+    waitlist_match_batch: int = 20
+    waitlist_sweep_interval_seconds: int = 60
+    
+    # Notification settings (outbox dispatcher)
+    notification_batch_size: int = 50
+    notification_concurrency: int = 5
+    notification_max_attempts: int = 5
+    # Retry n waits base * 2^(n-1) seconds, up to the max
+    notification_retry_base_seconds: int = 30
+    notification_retry_max_seconds: int = 3600
+    notification_poll_interval_seconds: int = 5
+    notification_send_timeout_seconds: int = 30
+    # D-1 reminders are queued from this hour of the day before the appointment
+    reminder_hour: int = 8
+    reminder_scan_interval_seconds: int = 600
+    # "sink" (local stand-in: log plus optional JSONL file) or "smtp" for e-mail; SMS/WhatsApp only have "sink"
+    notification_email_backend: str = "sink"
+    notification_sms_backend: str = "sink"
+    notification_sink_path: str = ""
+    smtp_host: str = "localhost"
+    smtp_port: int = 25
+    smtp_username: str = ""
+    smtp_password: str = ""
+    smtp_starttls: bool = False
+    smtp_sender: str = "agendamentos@clinica.local"
+    
+    # Conversation event log (chatbot funnel and per-state latency)
+    # Buffered turn events are written to Eventos_Conversa in one transaction this often
+    conversation_event_flush_seconds: int = 2
+    # Events waiting for a flush; beyond this new events are dropped (and counted)
+    conversation_event_buffer_max: int = 10000
+    # Events read per page by the funnel aggregator
+    conversation_event_read_batch: int = 1000
+    conversation_event_retention_days: int = 30
+    # Relative error of the per-state latency percentiles
+    funnel_latency_relative_accuracy: float = 0.01
+    
     # CORS settings
     allowed_origins: list = ["http://localhost:3000", "http://localhost:8080", "http://localhost:8000"]
     
@@ -42,3 +143,6 @@ settings = Settings()
 # Database file path
 DATABASE_PATH = Path(__file__).parent.parent / "database" / "medical_system.db"
 DATABASE_SCHEMA_PATH = Path(__file__).parent.parent / "database" / "database.sql"
+
+# Uploaded PDFs waiting for background processing
+PDF_JOBS_DIR = Path(__file__).parent.parent / "database" / "pdf_jobs"
@@ -0,0 +1,79 @@
+"""
+Representações compactas usadas no armazenamento.
+
+- Datas e horas de Agendamentos (data_hora_inicio, data_hora_fim), da lista de espera
+  (Lista_Espera.data_limite, Ofertas_Espera.data_hora_inicio/data_hora_fim/expira_em) e
+  Notificacoes_Saida.data_referencia são gravadas como INTEGER: segundos desde
+  1970-01-01 00:00 do horário local da clínica, sem fuso. É o mesmo valor que
+  strftime('%s', ...) do SQLite dá para o texto 'YYYY-MM-DD HH:MM:SS', então consultas
+  manuais podem usar datetime(data_hora_inicio, 'unixepoch').
+- O CPF de Pacientes é gravado como INTEGER (os 11 dígitos, sem zeros à esquerda).
+
+As conversões acontecem na fronteira dos serviços: parâmetros de SQL passam por
+`to_epoch` / `cpf_to_int` e linhas lidas por `from_epoch` / `cpf_digits`. A API
+continua recebendo e devolvendo datetime e CPF como texto de 11 dígitos.
+"""
+import re
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple, Union
+
+EPOCH = datetime(1970, 1, 1)
+APPOINTMENT_TIME_COLUMNS = ("data_hora_inicio", "data_hora_fim")
+WAITLIST_TIME_COLUMNS = ("data_limite",)
+OFFER_TIME_COLUMNS = ("data_hora_inicio", "data_hora_fim", "expira_em")
+CPF_LENGTH = 11
+
+_NOT_DIGITS = re.compile(r"\D")
+
+
+def to_epoch(value: Union[datetime, str, int, None]) -> Optional[int]:
+    """Segundos desde EPOCH do horário de parede (o fuso, se houver, é descartado)."""
+    if value is None or isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return (value.replace(tzinfo=None) - EPOCH) // timedelta(seconds=1)
+
+
+def from_epoch(value: Union[int, str, datetime, None]) -> Optional[datetime]:
+    """Inverso de `to_epoch`. Aceita também o texto ISO de bancos ainda não migrados."""
+    if value is None or isinstance(value, datetime):
+        return value
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return EPOCH + timedelta(seconds=value)
+
+
+def decode_times(row: Dict[str, Any], columns: Tuple[str, ...]) -> Dict[str, Any]:
+    """Linha com as colunas de data `columns` convertidas para datetime."""
+    for column in columns:
+        if column in row:
+            row[column] = from_epoch(row[column])
+    return row
+
+
+def decode_appointment(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Linha de Agendamentos com as colunas de data convertidas para datetime."""
+    return decode_times(row, APPOINTMENT_TIME_COLUMNS)
+
+
+def cpf_to_int(value: Union[str, int]) -> int:
+    """CPF (com ou sem máscara) como inteiro. ValueError se não tiver 11 dígitos."""
+    if isinstance(value, int):
+        digits = f"{value:0{CPF_LENGTH}d}"
+    else:
+        digits = _NOT_DIGITS.sub("", str(value))
+    if len(digits) != CPF_LENGTH:
+        raise ValueError(f"CPF deve ter {CPF_LENGTH} dígitos: {value}")
+    return int(digits)
+
+
+def cpf_digits(value: Union[int, str]) -> str:
+    """Os 11 dígitos do CPF, com os zeros à esquerda restaurados."""
+    return f"{cpf_to_int(value):0{CPF_LENGTH}d}"
+
+
+def format_cpf(value: Union[int, str]) -> str:
+    """CPF para exibição: 000.000.000-00."""
+    digits = cpf_digits(value)
+    return f"{digits[:3]}.{digits[3:6]}.{digits[6:9]}-{digits[9:]}"
@@ -6,8 +6,49 @@ import sqlite3
 from pathlib import Path
 from src.config.settings import DATABASE_PATH, DATABASE_SCHEMA_PATH
 import asyncio
+import re
 from typing import AsyncGenerator
 
+# Restrição antiga da tabela Agendamentos, substituída por um índice único parcial
+LEGACY_APPOINTMENT_UNIQUE = re.compile(r"UNIQUE\s*\(\s*id_medico\s*,\s*data_hora_inicio\s*\)")
+
+# Texto 'YYYY-MM-DD HH:MM:SS' -> segundos desde 1970 (o mesmo que src/database/codecs.to_epoch)
+_EPOCH_SQL = "CASE WHEN typeof({0}) = 'text' THEN CAST(strftime('%s', {0}) AS INTEGER) ELSE {0} END AS {0}"
+# Colunas gravadas como INTEGER: tabela -> coluna -> expressão que converte o valor antigo
+COMPACT_COLUMNS = {
+    "Pacientes": {
+        "cpf": "CAST(replace(replace(replace(trim(cpf), '.', ''), '-', ''), ' ', '') AS INTEGER) AS cpf",
+    },
+    "Agendamentos": {
+        "data_hora_inicio": _EPOCH_SQL.format("data_hora_inicio"),
+        "data_hora_fim": _EPOCH_SQL.format("data_hora_fim"),
+    },
+    "Lista_Espera": {
+        "data_limite": _EPOCH_SQL.format("data_limite"),
+    },
+    "Ofertas_Espera": {
+        "data_hora_inicio": _EPOCH_SQL.format("data_hora_inicio"),
+        "data_hora_fim": _EPOCH_SQL.format("data_hora_fim"),
+        "expira_em": _EPOCH_SQL.format("expira_em"),
+    },
+    "Notificacoes_Saida": {
+        "data_referencia": _EPOCH_SQL.format("data_referencia"),
+    },
+}
+# Colunas acrescentadas a tabelas existentes: tabela -> coluna -> (definição para ALTER TABLE
+# ADD COLUMN, expressão que preenche as linhas antigas ou None)
+ADDED_COLUMNS = {
+    "Agendamentos": {
+        # Consultas antigas: a especialidade do médico, quando ele só tem uma
+        "id_especialidade": (
+            "INTEGER REFERENCES Especialidades (id_especialidade)",
+            "(SELECT MIN(me.id_especialidade) FROM Medico_Especialidades me "
+            "WHERE me.id_medico = Agendamentos.id_medico HAVING COUNT(*) = 1)",
+        ),
+        "canal": ("TEXT NOT NULL DEFAULT 'api' CHECK(canal IN ('api', 'chat', 'pdf', 'lista_espera'))", None),
+    },
+}
+
 class DatabaseManager:
     """Database manager for SQLite operations."""
     
@@ -36,8 +77,14 @@ class DatabaseManager:
                 # Execute schema
                 conn = await self.get_connection()
                 try:
+                    # Antes do schema, cujos gatilhos e índices usam as colunas novas
+                    await self._add_missing_columns(conn)
                     await conn.executescript(schema_sql)
                     await conn.commit()
+                    if await self._rebuild_legacy_tables(conn, schema_sql):
+                        # Recria os índices da tabela reconstruída
+                        await conn.executescript(schema_sql)
+                        await conn.commit()
                     print(f"Database initialized successfully at {self.database_path}")
                 finally:
                     await conn.close()
@@ -48,6 +95,65 @@ class DatabaseManager:
             print(f"Error initializing database: {e}")
             raise
     
+    async def _add_missing_columns(self, conn: aiosqlite.Connection):
+        """Acrescenta às tabelas já existentes as colunas de ADDED_COLUMNS que faltam."""
+        for table, added in ADDED_COLUMNS.items():
+            async with conn.execute(f"PRAGMA table_info({table})") as cursor:
+                columns = {column[1] for column in await cursor.fetchall()}
+            if not columns:
+                continue
+            for name, (definition, fill) in added.items():
+                if name not in columns:
+                    print(f"Acrescentando a coluna {table}.{name}...")
+                    await conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+                    if fill:
+                        await conn.execute(f"UPDATE {table} SET {name} = {fill}")
+        await conn.commit()
+
+    async def _rebuild_legacy_tables(self, conn: aiosqlite.Connection, schema_sql: str) -> bool:
+        """
+        O SQLite não altera restrições nem tipos de colunas existentes, então tabelas criadas
+        com definições antigas são recriadas com a definição atual do schema:
+        - Agendamentos com UNIQUE (id_medico, data_hora_inicio) na própria tabela, o que
+          impede reagendar um horário cancelado (a unicidade passa a ser o índice parcial
+          uq_agendamentos_medico_inicio);
+        - colunas de COMPACT_COLUMNS ainda declaradas como texto, cujos valores são
+          convertidos na cópia.
+        """
+        rebuilt = False
+        for table, conversions in COMPACT_COLUMNS.items():
+            async with conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)) as cursor:
+                row = await cursor.fetchone()
+            if row is None:
+                continue
+            async with conn.execute(f"PRAGMA table_info({table})") as cursor:
+                columns = {column[1]: column[2].upper() for column in await cursor.fetchall()}
+            reasons = [f"{name} {columns[name]} -> INTEGER" for name in conversions if columns.get(name, "INTEGER") != "INTEGER"]
+            if table == "Agendamentos" and LEGACY_APPOINTMENT_UNIQUE.search(row[0]):
+                reasons.append("sem a restrição UNIQUE (id_medico, data_hora_inicio)")
+            if not reasons:
+                continue
+
+            definition = re.search(rf"CREATE TABLE IF NOT EXISTS {table} \(.*?\n\);", schema_sql, re.S).group(0)
+            source = ", ".join(conversions.get(name, name) for name in columns)
+            print(f"Recriando a tabela {table} ({'; '.join(reasons)})...")
+            await conn.execute("PRAGMA foreign_keys = OFF")
+            try:
+                await conn.executescript(
+                    f"""
+                    BEGIN;
+                    {definition.replace(f"IF NOT EXISTS {table}", f"{table}_nova")}
+                    INSERT INTO {table}_nova ({", ".join(columns)}) SELECT {source} FROM {table};
+                    DROP TABLE {table};
+                    ALTER TABLE {table}_nova RENAME TO {table};
+                    COMMIT;
+                    """
+                )
+            finally:
+                await conn.execute("PRAGMA foreign_keys = ON")
+            rebuilt = True
+        return rebuilt
+
     def get_sync_connection(self) -> sqlite3.Connection:
         """Get synchronous database connection for non-async operations."""
         conn = sqlite3.connect(self.database_path)
@@ -58,9 +164,18 @@ class DatabaseManager:
 # Global database manager instance
 db_manager = DatabaseManager()
 
+# Schema e migrações já aplicados neste processo
+_schema_ready = False
+
+async def ensure_schema():
+    """Aplica o schema e as migrações uma vez por processo, na inicialização da aplicação."""
+    global _schema_ready
+    if not _schema_ready:
+        await db_manager.initialize_database()
+        _schema_ready = True
+
 async def get_db() -> AsyncGenerator[aiosqlite.Connection, None]:
-    """Dependency for getting database connection."""
-    await db_manager.initialize_database() # Ensure schema is applied
+    """Dependency for getting database connection (the schema is applied at startup, see ensure_schema)."""
     conn = await db_manager.get_connection()
     try:
         yield conn
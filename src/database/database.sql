@@ -8,7 +8,7 @@ PRAGMA foreign_keys = ON;
 CREATE TABLE IF NOT EXISTS Pacientes (
     id_paciente INTEGER PRIMARY KEY AUTOINCREMENT,
     nome TEXT NOT NULL,
-    cpf TEXT(11) NOT NULL UNIQUE,
+    cpf INTEGER NOT NULL UNIQUE, -- Os 11 dígitos como inteiro (ver src/database/codecs.py).
     data_nascimento TEXT NOT NULL,
     sexo TEXT CHECK(sexo IN ('M', 'F', 'O')) NOT NULL
 );
@@ -59,6 +59,20 @@ CREATE TABLE IF NOT EXISTS Medico_Convenios (
     FOREIGN KEY (id_convenio) REFERENCES Convenios (id_convenio) ON DELETE CASCADE
 );
 
+-- Onde e quando cada médico atende: uma janela por local e dia da semana (0 = segunda).
+-- As especialidades de um local são as dos médicos que atendem nele.
+CREATE TABLE IF NOT EXISTS Medico_Locais (
+    id_medico INTEGER NOT NULL,
+    id_local INTEGER NOT NULL,
+    dia_semana INTEGER NOT NULL CHECK(dia_semana BETWEEN 0 AND 6),
+    hora_inicio TEXT NOT NULL, -- 'HH:MM'
+    hora_fim TEXT NOT NULL, -- 'HH:MM'
+    PRIMARY KEY (id_medico, id_local, dia_semana),
+    FOREIGN KEY (id_medico) REFERENCES Medicos (id_medico) ON DELETE CASCADE,
+    FOREIGN KEY (id_local) REFERENCES Locais_Atendimento (id_local) ON DELETE CASCADE,
+    CHECK (hora_inicio < hora_fim)
+);
+
 -- ----------------------------------------------------------------
 -- NOVAS TABELAS E MODIFICAÇÕES PARA EXAMES (Etapa 4)
 -- ----------------------------------------------------------------
@@ -100,9 +114,14 @@ CREATE TABLE IF NOT EXISTS Agendamentos (
 
     -- O médico pode ser o que executa a consulta ou o que analisa o exame. Pode ser nulo para exames simples.
     id_medico INTEGER,
+    -- Especialidade da consulta (um médico pode ter várias); nulo para exames.
+    id_especialidade INTEGER,
+    -- Por onde o agendamento foi feito: API, chatbot, PDF ou lista de espera.
+    canal TEXT NOT NULL DEFAULT 'api' CHECK(canal IN ('api', 'chat', 'pdf', 'lista_espera')),
     
-    data_hora_inicio DATETIME NOT NULL,
-    data_hora_fim DATETIME NOT NULL,
+    -- Segundos desde 1970-01-01 do horário local, sem fuso (ver src/database/codecs.py).
+    data_hora_inicio INTEGER NOT NULL,
+    data_hora_fim INTEGER NOT NULL,
     status TEXT NOT NULL CHECK(status IN ('agendado', 'cancelado', 'realizado', 'ausente')),
     observacoes TEXT,
     data_criacao DATETIME DEFAULT CURRENT_TIMESTAMP,
@@ -112,6 +131,7 @@ CREATE TABLE IF NOT EXISTS Agendamentos (
     FOREIGN KEY (id_local) REFERENCES Locais_Atendimento (id_local),
     FOREIGN KEY (id_convenio) REFERENCES Convenios (id_convenio),
     FOREIGN KEY (id_medico) REFERENCES Medicos (id_medico),
+    FOREIGN KEY (id_especialidade) REFERENCES Especialidades (id_especialidade),
     FOREIGN KEY (id_tipo_consulta) REFERENCES Tipos_Consulta (id_tipo_consulta),
     FOREIGN KEY (id_exame) REFERENCES Exames (id_exame),
 
@@ -119,12 +139,14 @@ CREATE TABLE IF NOT EXISTS Agendamentos (
     CHECK (
         (id_tipo_consulta IS NOT NULL AND id_exame IS NULL) OR 
         (id_tipo_consulta IS NULL AND id_exame IS NOT NULL)
-    ),
-
-    -- Garante que um mesmo médico não tenha dois eventos (consulta ou exame) no mesmo horário.
-    UNIQUE (id_medico, data_hora_inicio)
+    )
 );
 
+-- Garante que um mesmo médico não tenha dois eventos (consulta ou exame) ativos no mesmo horário.
+-- Só vale para agendamentos ativos: um horário cancelado pode ser agendado de novo.
+CREATE UNIQUE INDEX IF NOT EXISTS uq_agendamentos_medico_inicio ON Agendamentos (id_medico, data_hora_inicio)
+WHERE status = 'agendado';
+
 -- ----------------------------------------------------------------
 -- ÍNDICES FINAIS PARA OTIMIZAÇÃO
 -- ----------------------------------------------------------------
@@ -133,11 +155,311 @@ CREATE INDEX IF NOT EXISTS idx_contatos_entidade ON Contatos (entidade_id, entid
 CREATE INDEX IF NOT EXISTS idx_medico_especialidades_medico ON Medico_Especialidades (id_medico);
 CREATE INDEX IF NOT EXISTS idx_medico_especialidades_especialidade ON Medico_Especialidades (id_especialidade);
 CREATE INDEX IF NOT EXISTS idx_local_exames_exame ON Local_Exames (id_exame);
+-- Médicos de um local (e, com Medico_Especialidades, as especialidades atendidas nele)
+CREATE INDEX IF NOT EXISTS idx_medico_locais_local ON Medico_Locais (id_local, id_medico);
 
 -- Tabela Horarios_Disponiveis foi removida em favor de uma lógica mais dinâmica que pode ser
 -- implementada na aplicação, mas pode ser adicionada de volta se a regra de negócio for estática.
 -- Para este modelo final, a disponibilidade será calculada pela aplicação com base nos agendamentos existentes.
 
-CREATE INDEX IF NOT EXISTS idx_agendamentos_paciente ON Agendamentos (id_paciente);
+-- Agenda por médico, local e paciente em uma janela de datas (consultas por faixa,
+-- listagem paginada e checagens de sobreposição). Os índices compostos substituem os de uma coluna.
+DROP INDEX IF EXISTS idx_agendamentos_paciente;
+CREATE INDEX IF NOT EXISTS idx_agendamentos_paciente_data ON Agendamentos (id_paciente, data_hora_inicio);
 CREATE INDEX IF NOT EXISTS idx_agendamentos_medico_data ON Agendamentos (id_medico, data_hora_inicio);
-CREATE INDEX IF NOT EXISTS idx_agendamentos_local_data ON Agendamentos (id_local, data_hora_inicio);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_agendamentos_local_data ON Agendamentos (id_local, data_hora_inicio);
+-- Checagem de sobreposição por sala de exame (mesmo local e mesmo exame)
+CREATE INDEX IF NOT EXISTS idx_agendamentos_local_exame_data ON Agendamentos (id_local, id_exame, data_hora_inicio);
+
+-- ----------------------------------------------------------------
+-- ARQUIVO DE AGENDAMENTOS ANTIGOS
+-- ----------------------------------------------------------------
+
+-- Agendamentos encerrados (realizados, cancelados, ausentes) que começaram antes de
+-- archive_horizon_days, movidos de Agendamentos em lotes pequenos por
+-- src/services/archive_service.py para manter a tabela quente e seus índices pequenos.
+-- As linhas mantêm o id_agendamento (AUTOINCREMENT: nunca reaproveitado), então
+-- id_agendamento de Lista_Espera, Ofertas_Espera e Notificacoes_Saida já encerradas pode
+-- apontar para cá. A listagem e a exportação consultam as duas tabelas quando a janela
+-- começa antes do agendamento arquivado mais recente.
+CREATE TABLE IF NOT EXISTS Agendamentos_Arquivo (
+    id_agendamento INTEGER PRIMARY KEY,
+    id_paciente INTEGER NOT NULL,
+    id_local INTEGER NOT NULL,
+    id_convenio INTEGER,
+    id_tipo_consulta INTEGER,
+    id_exame INTEGER,
+    id_medico INTEGER,
+    id_especialidade INTEGER,
+    canal TEXT NOT NULL,
+    data_hora_inicio INTEGER NOT NULL,
+    data_hora_fim INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    observacoes TEXT,
+    data_criacao DATETIME,
+    data_arquivamento DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Os mesmos índices de faixa da listagem em Agendamentos
+CREATE INDEX IF NOT EXISTS idx_agendamentos_arquivo_paciente_data ON Agendamentos_Arquivo (id_paciente, data_hora_inicio);
+CREATE INDEX IF NOT EXISTS idx_agendamentos_arquivo_medico_data ON Agendamentos_Arquivo (id_medico, data_hora_inicio);
+CREATE INDEX IF NOT EXISTS idx_agendamentos_arquivo_local_data ON Agendamentos_Arquivo (id_local, data_hora_inicio);
+CREATE INDEX IF NOT EXISTS idx_agendamentos_arquivo_status_data ON Agendamentos_Arquivo (status, data_hora_inicio);
+
+-- ----------------------------------------------------------------
+-- AGREGADOS DE OCUPAÇÃO E DEMANDA
+-- ----------------------------------------------------------------
+
+-- Mantidos pelos gatilhos abaixo na mesma transação de cada INSERT, UPDATE ou DELETE em
+-- Agendamentos: cada linha soma sua contribuição e, ao mudar, subtrai a antiga. Os painéis
+-- leem só estas tabelas. Para recalcular (carga inicial, correções): scripts/rebuild_aggregates.py.
+
+-- Por recurso e dia de início: quantos agendamentos em cada status e os minutos ocupados
+-- (todos menos os cancelados). Um agendamento conta para o médico, o local, a especialidade
+-- e o exame que tiver preenchidos.
+CREATE TABLE IF NOT EXISTS Ocupacao_Diaria (
+    tipo_recurso TEXT NOT NULL CHECK(tipo_recurso IN ('medico', 'local', 'especialidade', 'exame')),
+    dia TEXT NOT NULL, -- 'YYYY-MM-DD'
+    id_recurso INTEGER NOT NULL,
+    agendados INTEGER NOT NULL DEFAULT 0,
+    realizados INTEGER NOT NULL DEFAULT 0,
+    ausentes INTEGER NOT NULL DEFAULT 0,
+    cancelados INTEGER NOT NULL DEFAULT 0,
+    minutos_ocupados INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (tipo_recurso, dia, id_recurso)
+) WITHOUT ROWID;
+
+-- Por dia de criação (horário local) e canal: agendamentos feitos e quantos deles estão cancelados.
+CREATE TABLE IF NOT EXISTS Demanda_Diaria (
+    dia TEXT NOT NULL, -- 'YYYY-MM-DD'
+    canal TEXT NOT NULL,
+    agendamentos INTEGER NOT NULL DEFAULT 0,
+    cancelados INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (dia, canal)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS trg_agendamentos_agregados_insert AFTER INSERT ON Agendamentos
+BEGIN
+    INSERT INTO Ocupacao_Diaria (tipo_recurso, dia, id_recurso, agendados, realizados, ausentes, cancelados, minutos_ocupados)
+    SELECT r.tipo, date(NEW.data_hora_inicio, 'unixepoch'), r.id,
+           NEW.status = 'agendado', NEW.status = 'realizado', NEW.status = 'ausente', NEW.status = 'cancelado',
+           (NEW.status != 'cancelado') * ((NEW.data_hora_fim - NEW.data_hora_inicio) / 60)
+    FROM (SELECT 'medico' AS tipo, NEW.id_medico AS id UNION ALL SELECT 'local', NEW.id_local
+          UNION ALL SELECT 'especialidade', NEW.id_especialidade UNION ALL SELECT 'exame', NEW.id_exame) r
+    WHERE r.id IS NOT NULL
+    ON CONFLICT (tipo_recurso, dia, id_recurso) DO UPDATE SET
+        agendados = agendados + excluded.agendados, realizados = realizados + excluded.realizados,
+        ausentes = ausentes + excluded.ausentes, cancelados = cancelados + excluded.cancelados,
+        minutos_ocupados = minutos_ocupados + excluded.minutos_ocupados;
+
+    INSERT INTO Demanda_Diaria (dia, canal, agendamentos, cancelados)
+    VALUES (COALESCE(date(NEW.data_criacao, 'localtime'), date(NEW.data_hora_inicio, 'unixepoch')), NEW.canal, 1, NEW.status = 'cancelado')
+    ON CONFLICT (dia, canal) DO UPDATE SET
+        agendamentos = agendamentos + excluded.agendamentos, cancelados = cancelados + excluded.cancelados;
+END;
+
+-- Agendamentos movidos para Agendamentos_Arquivo continuam contando nos agregados
+CREATE TRIGGER IF NOT EXISTS trg_agendamentos_agregados_delete AFTER DELETE ON Agendamentos
+WHEN NOT EXISTS (SELECT 1 FROM Agendamentos_Arquivo WHERE id_agendamento = OLD.id_agendamento)
+BEGIN
+    INSERT INTO Ocupacao_Diaria (tipo_recurso, dia, id_recurso, agendados, realizados, ausentes, cancelados, minutos_ocupados)
+    SELECT r.tipo, date(OLD.data_hora_inicio, 'unixepoch'), r.id,
+           -(OLD.status = 'agendado'), -(OLD.status = 'realizado'), -(OLD.status = 'ausente'), -(OLD.status = 'cancelado'),
+           -(OLD.status != 'cancelado') * ((OLD.data_hora_fim - OLD.data_hora_inicio) / 60)
+    FROM (SELECT 'medico' AS tipo, OLD.id_medico AS id UNION ALL SELECT 'local', OLD.id_local
+          UNION ALL SELECT 'especialidade', OLD.id_especialidade UNION ALL SELECT 'exame', OLD.id_exame) r
+    WHERE r.id IS NOT NULL
+    ON CONFLICT (tipo_recurso, dia, id_recurso) DO UPDATE SET
+        agendados = agendados + excluded.agendados, realizados = realizados + excluded.realizados,
+        ausentes = ausentes + excluded.ausentes, cancelados = cancelados + excluded.cancelados,
+        minutos_ocupados = minutos_ocupados + excluded.minutos_ocupados;
+
+    INSERT INTO Demanda_Diaria (dia, canal, agendamentos, cancelados)
+    VALUES (COALESCE(date(OLD.data_criacao, 'localtime'), date(OLD.data_hora_inicio, 'unixepoch')), OLD.canal, -1, -(OLD.status = 'cancelado'))
+    ON CONFLICT (dia, canal) DO UPDATE SET
+        agendamentos = agendamentos + excluded.agendamentos, cancelados = cancelados + excluded.cancelados;
+END;
+
+-- Cancelamento, mudança de status, remarcação ou troca de médico/local: sai a contribuição
+-- antiga e entra a nova. Mudanças só em observações não disparam o gatilho.
+CREATE TRIGGER IF NOT EXISTS trg_agendamentos_agregados_update
+AFTER UPDATE OF id_local, id_medico, id_especialidade, id_exame, canal, data_hora_inicio, data_hora_fim, status, data_criacao
+ON Agendamentos
+BEGIN
+    INSERT INTO Ocupacao_Diaria (tipo_recurso, dia, id_recurso, agendados, realizados, ausentes, cancelados, minutos_ocupados)
+    SELECT r.tipo, date(OLD.data_hora_inicio, 'unixepoch'), r.id,
+           -(OLD.status = 'agendado'), -(OLD.status = 'realizado'), -(OLD.status = 'ausente'), -(OLD.status = 'cancelado'),
+           -(OLD.status != 'cancelado') * ((OLD.data_hora_fim - OLD.data_hora_inicio) / 60)
+    FROM (SELECT 'medico' AS tipo, OLD.id_medico AS id UNION ALL SELECT 'local', OLD.id_local
+          UNION ALL SELECT 'especialidade', OLD.id_especialidade UNION ALL SELECT 'exame', OLD.id_exame) r
+    WHERE r.id IS NOT NULL
+    ON CONFLICT (tipo_recurso, dia, id_recurso) DO UPDATE SET
+        agendados = agendados + excluded.agendados, realizados = realizados + excluded.realizados,
+        ausentes = ausentes + excluded.ausentes, cancelados = cancelados + excluded.cancelados,
+        minutos_ocupados = minutos_ocupados + excluded.minutos_ocupados;
+
+    INSERT INTO Ocupacao_Diaria (tipo_recurso, dia, id_recurso, agendados, realizados, ausentes, cancelados, minutos_ocupados)
+    SELECT r.tipo, date(NEW.data_hora_inicio, 'unixepoch'), r.id,
+           NEW.status = 'agendado', NEW.status = 'realizado', NEW.status = 'ausente', NEW.status = 'cancelado',
+           (NEW.status != 'cancelado') * ((NEW.data_hora_fim - NEW.data_hora_inicio) / 60)
+    FROM (SELECT 'medico' AS tipo, NEW.id_medico AS id UNION ALL SELECT 'local', NEW.id_local
+          UNION ALL SELECT 'especialidade', NEW.id_especialidade UNION ALL SELECT 'exame', NEW.id_exame) r
+    WHERE r.id IS NOT NULL
+    ON CONFLICT (tipo_recurso, dia, id_recurso) DO UPDATE SET
+        agendados = agendados + excluded.agendados, realizados = realizados + excluded.realizados,
+        ausentes = ausentes + excluded.ausentes, cancelados = cancelados + excluded.cancelados,
+        minutos_ocupados = minutos_ocupados + excluded.minutos_ocupados;
+
+    INSERT INTO Demanda_Diaria (dia, canal, agendamentos, cancelados)
+    VALUES (COALESCE(date(OLD.data_criacao, 'localtime'), date(OLD.data_hora_inicio, 'unixepoch')), OLD.canal, -1, -(OLD.status = 'cancelado'))
+    ON CONFLICT (dia, canal) DO UPDATE SET
+        agendamentos = agendamentos + excluded.agendamentos, cancelados = cancelados + excluded.cancelados;
+    INSERT INTO Demanda_Diaria (dia, canal, agendamentos, cancelados)
+    VALUES (COALESCE(date(NEW.data_criacao, 'localtime'), date(NEW.data_hora_inicio, 'unixepoch')), NEW.canal, 1, NEW.status = 'cancelado')
+    ON CONFLICT (dia, canal) DO UPDATE SET
+        agendamentos = agendamentos + excluded.agendamentos, cancelados = cancelados + excluded.cancelados;
+END;
+
+-- ----------------------------------------------------------------
+-- LISTA DE ESPERA
+-- ----------------------------------------------------------------
+
+-- Pacientes que querem um horário (ou um horário mais cedo) para uma especialidade ou exame.
+-- Horários liberados por cancelamento ou remarcação são oferecidos ao primeiro da fila compatível.
+CREATE TABLE IF NOT EXISTS Lista_Espera (
+    id_espera INTEGER PRIMARY KEY AUTOINCREMENT,
+    id_paciente INTEGER NOT NULL,
+    id_especialidade INTEGER,
+    id_exame INTEGER,
+    id_convenio INTEGER, -- Nulo se for particular.
+    id_local INTEGER, -- Nulo aceita qualquer local.
+    id_agendamento INTEGER, -- Agendamento atual a antecipar (nulo se o paciente ainda não tem horário).
+    data_limite INTEGER, -- Só aceita horários que comecem antes desta data (nulo = qualquer data); segundos desde 1970, como em Agendamentos.
+    prioridade INTEGER NOT NULL DEFAULT 0, -- Maior primeiro; empates pela ordem de entrada.
+    status TEXT NOT NULL DEFAULT 'aguardando' CHECK(status IN ('aguardando', 'ofertado', 'atendido', 'cancelado')),
+    data_criacao DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (id_paciente) REFERENCES Pacientes (id_paciente) ON DELETE CASCADE,
+    FOREIGN KEY (id_especialidade) REFERENCES Especialidades (id_especialidade),
+    FOREIGN KEY (id_exame) REFERENCES Exames (id_exame),
+    FOREIGN KEY (id_convenio) REFERENCES Convenios (id_convenio),
+    FOREIGN KEY (id_local) REFERENCES Locais_Atendimento (id_local),
+    FOREIGN KEY (id_agendamento) REFERENCES Agendamentos (id_agendamento),
+    CHECK (
+        (id_especialidade IS NOT NULL AND id_exame IS NULL) OR
+        (id_especialidade IS NULL AND id_exame IS NOT NULL)
+    )
+);
+
+-- A fila de uma especialidade ou exame sai do índice já na ordem de atendimento
+CREATE INDEX IF NOT EXISTS idx_lista_espera_especialidade ON Lista_Espera (id_especialidade, status, prioridade DESC, id_espera);
+CREATE INDEX IF NOT EXISTS idx_lista_espera_exame ON Lista_Espera (id_exame, status, prioridade DESC, id_espera);
+CREATE INDEX IF NOT EXISTS idx_lista_espera_agendamento ON Lista_Espera (id_agendamento);
+
+-- Horário liberado oferecido a um paciente da fila; fica reservado até ser aceito, recusado ou expirar.
+CREATE TABLE IF NOT EXISTS Ofertas_Espera (
+    id_oferta INTEGER PRIMARY KEY AUTOINCREMENT,
+    id_espera INTEGER NOT NULL,
+    id_medico INTEGER,
+    id_local INTEGER NOT NULL,
+    id_exame INTEGER,
+    data_hora_inicio INTEGER NOT NULL, -- Segundos desde 1970, como em Agendamentos.
+    data_hora_fim INTEGER NOT NULL,
+    expira_em INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pendente' CHECK(status IN ('pendente', 'aceita', 'recusada', 'expirada')),
+    id_agendamento INTEGER, -- Agendamento criado ou remarcado ao aceitar.
+    data_criacao DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (id_espera) REFERENCES Lista_Espera (id_espera) ON DELETE CASCADE,
+    FOREIGN KEY (id_agendamento) REFERENCES Agendamentos (id_agendamento)
+);
+
+CREATE INDEX IF NOT EXISTS idx_ofertas_espera_status_expiracao ON Ofertas_Espera (status, expira_em);
+CREATE INDEX IF NOT EXISTS idx_ofertas_espera_espera ON Ofertas_Espera (id_espera, data_hora_inicio);
+
+-- ----------------------------------------------------------------
+-- NOTIFICAÇÕES (OUTBOX)
+-- ----------------------------------------------------------------
+
+-- Mensagens a enviar ao paciente, uma por contato (Contatos). São gravadas na mesma transação
+-- do agendamento, cancelamento ou remarcação e enviadas depois por um despachante em segundo plano.
+CREATE TABLE IF NOT EXISTS Notificacoes_Saida (
+    id_notificacao INTEGER PRIMARY KEY AUTOINCREMENT,
+    id_agendamento INTEGER, -- Nulo para mensagens sem agendamento (ex.: oferta da lista de espera).
+    id_paciente INTEGER NOT NULL,
+    tipo TEXT NOT NULL CHECK(tipo IN ('confirmacao', 'lembrete', 'cancelamento', 'remarcacao', 'oferta_espera')),
+    canal TEXT NOT NULL CHECK(canal IN ('email', 'telefone', 'whatsapp')),
+    destino TEXT NOT NULL,
+    payload TEXT NOT NULL, -- JSON com os dados da mensagem (nomes, datas), montado na gravação.
+    data_referencia INTEGER, -- Início do agendamento ou da oferta a que a mensagem se refere (segundos desde 1970).
+    status TEXT NOT NULL DEFAULT 'pendente' CHECK(status IN ('pendente', 'enviando', 'enviado', 'erro', 'descartado')),
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    proxima_tentativa DATETIME NOT NULL,
+    ultimo_erro TEXT,
+    data_criacao DATETIME DEFAULT CURRENT_TIMESTAMP,
+    data_envio DATETIME,
+    FOREIGN KEY (id_agendamento) REFERENCES Agendamentos (id_agendamento),
+    FOREIGN KEY (id_paciente) REFERENCES Pacientes (id_paciente) ON DELETE CASCADE
+);
+
+-- O despachante lê as mensagens vencidas em ordem de próxima tentativa
+CREATE INDEX IF NOT EXISTS idx_notificacoes_saida_status ON Notificacoes_Saida (status, proxima_tentativa);
+-- Um lembrete por agendamento, contato e data: a varredura periódica pode repetir o INSERT sem duplicar
+CREATE UNIQUE INDEX IF NOT EXISTS uq_notificacoes_saida_lembrete
+    ON Notificacoes_Saida (id_agendamento, canal, destino, data_referencia) WHERE tipo = 'lembrete';
+-- Agendamentos por status e data, para a varredura dos lembretes de véspera
+CREATE INDEX IF NOT EXISTS idx_agendamentos_status_data ON Agendamentos (status, data_hora_inicio);
+
+-- ----------------------------------------------------------------
+-- PROCESSAMENTO ASSÍNCRONO DE PDFs
+-- ----------------------------------------------------------------
+
+-- Jobs de leitura de PDF. Ficam no banco para sobreviver a reinícios do servidor.
+CREATE TABLE IF NOT EXISTS Pdf_Jobs (
+    id_job TEXT PRIMARY KEY,
+    nome_arquivo TEXT,
+    caminho_arquivo TEXT NOT NULL,
+    status TEXT NOT NULL CHECK(status IN ('pendente', 'extraindo_texto', 'extraindo_dados', 'agendando', 'concluido', 'erro')),
+    progresso INTEGER NOT NULL DEFAULT 0,
+    resultado TEXT, -- JSON com a resposta final do processamento
+    erro TEXT,
+    data_criacao DATETIME DEFAULT CURRENT_TIMESTAMP,
+    data_atualizacao DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_pdf_jobs_status ON Pdf_Jobs (status);
+
+-- Cache dos dados extraídos de PDFs já processados, pelo SHA-256 do arquivo ('bytes')
+-- ou do texto normalizado ('texto'). Reenvios do mesmo PDF pulam a extração e o Gemini.
+CREATE TABLE IF NOT EXISTS Pdf_Cache (
+    hash TEXT NOT NULL,
+    tipo_hash TEXT NOT NULL CHECK(tipo_hash IN ('bytes', 'texto')),
+    conversation_data TEXT NOT NULL, -- JSON extraído do PDF
+    data_criacao DATETIME DEFAULT CURRENT_TIMESTAMP,
+    expira_em DATETIME NOT NULL,
+    PRIMARY KEY (hash, tipo_hash)
+);
+
+CREATE INDEX IF NOT EXISTS idx_pdf_cache_expiracao ON Pdf_Cache (expira_em);
+
+-- ----------------------------------------------------------------
+-- EVENTOS DAS CONVERSAS (FUNIL DO CHATBOT)
+-- ----------------------------------------------------------------
+
+-- Log só de inserção com um evento por conversa iniciada, turno respondido e conversa
+-- abandonada (descartada por inatividade ou capacidade antes do fim). Gravado em lotes por
+-- src/services/conversation_events.py, que lê os eventos novos pela chave e mantém em
+-- memória só contadores e histogramas de latência por estado. Eventos mais antigos que
+-- conversation_event_retention_days são apagados.
+CREATE TABLE IF NOT EXISTS Eventos_Conversa (
+    id_evento INTEGER PRIMARY KEY,
+    momento INTEGER NOT NULL, -- Segundos desde 1970, horário local (src/database/codecs.py).
+    sessao TEXT NOT NULL,
+    versao_fluxo INTEGER NOT NULL,
+    tipo TEXT NOT NULL CHECK(tipo IN ('inicio', 'turno', 'abandono')),
+    estado TEXT NOT NULL, -- Estado do booking_flow.json em que o evento aconteceu.
+    proximo_estado TEXT, -- Estado depois do turno (igual ao anterior se a conversa não avançou).
+    resolucao TEXT CHECK(resolucao IN ('local', 'cache', 'llm', 'erro')), -- Como a resposta foi interpretada.
+    valido INTEGER, -- 1 se a resposta foi aceita, 0 se o usuário teve de responder de novo.
+    latencia_us INTEGER -- Duração do turno no FlowManager, em microssegundos.
+);
+
+CREATE INDEX IF NOT EXISTS idx_eventos_conversa_momento ON Eventos_Conversa (momento);
@@ -4,6 +4,7 @@ Initialize database with basic data for all tables.
 import asyncio
 import logging
 from src.database.connection import db_manager
+from src.database.codecs import cpf_to_int, to_epoch
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -152,7 +153,7 @@ async def initialize_basic_data():
         for name, cpf, birth_date, gender in patients:
             await conn.execute(
                 "INSERT OR IGNORE INTO Pacientes (nome, cpf, data_nascimento, sexo) VALUES (?, ?, ?, ?)",
-                (name, cpf, birth_date, gender)
+                (name, cpf_to_int(cpf), birth_date, gender)
             )
         
         # 8. Insert Contatos (Contacts) - For patients and doctors
@@ -231,6 +232,22 @@ async def initialize_basic_data():
                 (doctor_id, insurance_id)
             )
         
+        # 10.1 Insert Medico_Locais (weekly schedule: where each doctor works on each weekday)
+        logger.info("Inserting doctor-location schedules...")
+        for doctor_id in range(1, 11):  # 10 doctors
+            main_location = (doctor_id - 1) % 5 + 1
+            second_location = doctor_id % 5 + 1
+            for weekday in (0, 2, 4):  # Segunda, quarta e sexta no local principal
+                await conn.execute(
+                    "INSERT OR IGNORE INTO Medico_Locais (id_medico, id_local, dia_semana, hora_inicio, hora_fim) VALUES (?, ?, ?, ?, ?)",
+                    (doctor_id, main_location, weekday, "08:00", "18:00")
+                )
+            for weekday in (1, 3):  # Terça e quinta no segundo local
+                await conn.execute(
+                    "INSERT OR IGNORE INTO Medico_Locais (id_medico, id_local, dia_semana, hora_inicio, hora_fim) VALUES (?, ?, ?, ?, ?)",
+                    (doctor_id, second_location, weekday, "08:00", "18:00")
+                )
+        
         # 11. Insert Local_Exames (Location-Exam relationships)
         logger.info("Inserting location-exam relationships...")
         # All locations can perform basic exams
@@ -271,13 +288,13 @@ async def initialize_basic_data():
         ]
         
         logger.info("Inserting sample appointments...")
-        for appointment_data in sample_appointments:
+        for *appointment_data, start, end, status, notes in sample_appointments:
             await conn.execute(
                 """INSERT OR IGNORE INTO Agendamentos 
                    (id_paciente, id_local, id_convenio, id_tipo_consulta, id_exame, id_medico, 
                     data_hora_inicio, data_hora_fim, status, observacoes) 
                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                appointment_data
+                (*appointment_data, to_epoch(start), to_epoch(end), status, notes)
             )
         
         # Commit all changes
@@ -27,6 +27,24 @@ class StatusAgendamentoEnum(str, Enum):
     REALIZADO = "realizado"
     AUSENTE = "ausente"
 
+class CanalAgendamentoEnum(str, Enum):
+    API = "api"
+    CHAT = "chat"
+    PDF = "pdf"
+    LISTA_ESPERA = "lista_espera"
+
+class StatusEsperaEnum(str, Enum):
+    AGUARDANDO = "aguardando"
+    OFERTADO = "ofertado"
+    ATENDIDO = "atendido"
+    CANCELADO = "cancelado"
+
+class StatusOfertaEnum(str, Enum):
+    PENDENTE = "pendente"
+    ACEITA = "aceita"
+    RECUSADA = "recusada"
+    EXPIRADA = "expirada"
+
 # Base models
 class BaseResponse(BaseModel):
     """Base response model."""
@@ -36,7 +54,7 @@ class BaseResponse(BaseModel):
 # Paciente models
 class PacienteBase(BaseModel):
     nome: str = Field(..., min_length=2, max_length=100)
-    cpf: str = Field(..., min_length=11, max_length=11)
+    cpf: str = Field(..., min_length=11, max_length=11, pattern=r"^[0-9]{11}$", description="Somente os 11 dígitos")
     data_nascimento: str = Field(..., description="Data no formato YYYY-MM-DD")
     sexo: SexoEnum
 
@@ -45,7 +63,7 @@ class PacienteCreate(PacienteBase):
 
 class PacienteUpdate(BaseModel):
     nome: Optional[str] = Field(None, min_length=2, max_length=100)
-    cpf: Optional[str] = Field(None, min_length=11, max_length=11)
+    cpf: Optional[str] = Field(None, min_length=11, max_length=11, pattern=r"^[0-9]{11}$")
     data_nascimento: Optional[str] = None
     sexo: Optional[SexoEnum] = None
 
@@ -166,6 +184,7 @@ class AgendamentoBase(BaseModel):
     id_tipo_consulta: Optional[int] = None
     id_exame: Optional[int] = None
     id_medico: Optional[int] = None
+    id_especialidade: Optional[int] = Field(None, description="Especialidade da consulta; se omitida, a do médico quando ele tem só uma")
     data_hora_inicio: datetime
     data_hora_fim: datetime
     status: StatusAgendamentoEnum = StatusAgendamentoEnum.AGENDADO
@@ -185,11 +204,51 @@ class AgendamentoUpdate(BaseModel):
 
 class AgendamentoResponse(AgendamentoBase):
     id_agendamento: int
+    canal: CanalAgendamentoEnum = CanalAgendamentoEnum.API
     data_criacao: datetime
     
     class Config:
         from_attributes = True
 
+class CancelamentoRequest(BaseModel):
+    motivo: Optional[str] = Field(None, max_length=500)
+
+class ReagendamentoRequest(BaseModel):
+    data_hora_inicio: datetime
+    id_medico: Optional[int] = Field(None, description="Outro médico; se omitido, mantém o atual")
+
+# Lista de espera models
+class ListaEsperaBase(BaseModel):
+    id_paciente: int
+    id_especialidade: Optional[int] = None
+    id_exame: Optional[int] = None
+    id_convenio: Optional[int] = None
+    id_local: Optional[int] = None
+    id_agendamento: Optional[int] = Field(None, description="Agendamento atual que o paciente quer antecipar")
+    data_limite: Optional[datetime] = Field(None, description="Só aceita horários que comecem antes desta data")
+    prioridade: int = 0
+
+class ListaEsperaCreate(ListaEsperaBase):
+    pass
+
+class OfertaEsperaResponse(BaseModel):
+    id_oferta: int
+    id_espera: int
+    id_medico: Optional[int] = None
+    id_local: int
+    id_exame: Optional[int] = None
+    data_hora_inicio: datetime
+    data_hora_fim: datetime
+    expira_em: datetime
+    status: StatusOfertaEnum
+    id_agendamento: Optional[int] = None
+
+class ListaEsperaResponse(ListaEsperaBase):
+    id_espera: int
+    status: StatusEsperaEnum
+    data_criacao: datetime
+    oferta: Optional[OfertaEsperaResponse] = None
+
 # Response with data
 class PacientesListResponse(BaseResponse):
     data: List[PacienteResponse]
@@ -1,17 +1,33 @@
 # src/routes/ai_booking.py
 from fastapi import APIRouter, status, HTTPException, Depends, UploadFile, File
-from typing import Dict
+from fastapi.responses import StreamingResponse
+from typing import Dict, List, Optional
 import os
 from dotenv import load_dotenv
 import google.generativeai as genai
 from src.chatbot.flows.flow_manager import FlowManager
+from src.chatbot.flows.session_store import run_session_sweeper
+from src.chatbot.flows.session_locks import SessionSerializer
+from src.chatbot.flows.flow_registry import run_flow_watcher
+from src.config.settings import settings
 import logging
-from datetime import datetime, time
-from src.database.connection import get_db
-from src.database.models.schemas import PacienteCreate, AgendamentoCreate, SexoEnum, StatusAgendamentoEnum
-from src.services.patient_service import get_patient_by_cpf, create_patient
-from src.services.booking_service import create_appointment
+from src.database.codecs import from_epoch
+from src.database.connection import ensure_schema, get_db, db_manager
+from src.database.models.schemas import CanalAgendamentoEnum
+from src.services.booking_service import book_from_conversation, BookingValidationError, SlotUnavailableError
+from src.services.catalog_service import catalog_service
+from src.services.availability_service import availability_index, run_availability_pruner
+from src.services.doctor_assignment import doctor_assigner
+from src.services.waitlist_service import run_offer_sweeper, run_waitlist_matcher, waitlist_matcher
+from src.services.notification_service import outbox_dispatcher, run_outbox_dispatcher, run_reminder_scheduler
+from src.services import occupancy_service
+from src.services.archive_service import appointment_archiver, archive_reach, run_archiver
+from src.services.conversation_events import conversation_events, funnel_aggregator, run_event_log_writer
+from src.services.pdf_jobs import PdfJobManager, FINAL_STATUSES
+from src.services.pdf_service import PdfUploadTooLarge
+from src.services.pdf_bulk import PdfBulkIntake, BulkLimitExceeded, stage_uploads
 import aiosqlite
+import asyncio
 import json
 
 # Carregue as variáveis do arquivo .env
@@ -21,10 +37,238 @@ load_dotenv()
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 ai_model = genai.GenerativeModel('gemini-1.5-flash-latest')
 flow_manager = FlowManager(model=ai_model)
+session_serializer = SessionSerializer()
 
 router = APIRouter()
 
 
+@router.on_event("startup")
+async def load_catalog_snapshot():
+    """Carrega o catálogo de especialidades, exames e locais usado pelo chatbot."""
+    try:
+        await ensure_schema()
+        await catalog_service.refresh()
+    except Exception as e:
+        logging.error(f"Erro ao carregar catálogo na inicialização: {e}")
+
+
+@router.on_event("startup")
+async def load_availability():
+    """Carrega o índice de disponibilidade de médicos e salas de exame e inicia a poda dos dias passados."""
+    conn = await db_manager.get_connection()
+    try:
+        await availability_index.load(conn)
+    except Exception as e:
+        logging.error(f"Erro ao carregar o índice de disponibilidade: {e}")
+    finally:
+        await conn.close()
+    asyncio.create_task(run_availability_pruner(availability_index, settings.availability_prune_interval_seconds))
+
+
+@router.on_event("startup")
+async def backfill_occupancy_aggregates():
+    """Monta os agregados de ocupação e demanda de um banco que já tinha agendamentos antes deles."""
+    conn = await db_manager.get_connection()
+    try:
+        await occupancy_service.backfill_if_empty(conn)
+    except Exception as e:
+        logging.error(f"Erro ao montar os agregados de ocupação e demanda: {e}")
+    finally:
+        await conn.close()
+
+
+@router.on_event("startup")
+async def start_waitlist_matcher():
+    """Retoma as ofertas pendentes da lista de espera e inicia o matcher e a expiração das ofertas."""
+    conn = await db_manager.get_connection()
+    try:
+        await waitlist_matcher.restore(conn)
+    except Exception as e:
+        logging.error(f"Erro ao retomar as ofertas da lista de espera: {e}")
+    finally:
+        await conn.close()
+    asyncio.create_task(run_waitlist_matcher(waitlist_matcher))
+    asyncio.create_task(run_offer_sweeper(waitlist_matcher, settings.waitlist_sweep_interval_seconds))
+
+
+@router.on_event("startup")
+async def start_notification_dispatcher():
+    """Inicia o envio das notificações gravadas na outbox e o agendamento dos lembretes de véspera."""
+    asyncio.create_task(run_outbox_dispatcher(outbox_dispatcher))
+    asyncio.create_task(run_reminder_scheduler(outbox_dispatcher, settings.reminder_scan_interval_seconds))
+
+
+@router.on_event("startup")
+async def start_archiver():
+    """Inicia o arquivamento periódico dos agendamentos antigos."""
+    if settings.archive_interval_seconds > 0:
+        asyncio.create_task(run_archiver(appointment_archiver, settings.archive_interval_seconds))
+
+
+@router.on_event("startup")
+async def start_event_log_writer():
+    """Inicia a gravação em lotes dos eventos das conversas e a atualização do funil."""
+    asyncio.create_task(run_event_log_writer(conversation_events, funnel_aggregator,
+                                             settings.conversation_event_flush_seconds))
+
+
+@router.on_event("shutdown")
+async def flush_conversation_events():
+    """Grava os eventos das conversas que ainda estão no buffer."""
+    conn = await db_manager.get_connection()
+    try:
+        await conversation_events.flush(conn)
+    except Exception as e:
+        logging.error(f"Erro ao gravar os eventos das conversas: {e}")
+    finally:
+        await conn.close()
+
+
+@router.on_event("startup")
+async def start_session_sweeper():
+    """Inicia a varredura periódica das conversas ociosas."""
+    asyncio.create_task(run_session_sweeper(flow_manager.user_conversations, settings.session_sweep_interval_seconds))
+
+
+@router.on_event("startup")
+async def start_flow_watcher():
+    """Inicia o monitoramento de booking_flow.json para recarga a quente."""
+    if settings.flow_watch_interval_seconds > 0:
+        asyncio.create_task(run_flow_watcher(flow_manager, settings.flow_watch_interval_seconds))
+
+
+@router.get("/admin/flows")
+async def get_flow_versions():
+    """
+    Retorna a versão atual do fluxo de agendamento, as versões carregadas e quantas conversas usam cada uma.
+    """
+    sessions_per_version = {}
+    for session in flow_manager.user_conversations.snapshot():
+        sessions_per_version[session.flow_version] = sessions_per_version.get(session.flow_version, 0) + 1
+    return {
+        "success": True,
+        **flow_manager.flows.metrics(),
+        "sessions_per_version": sessions_per_version
+    }
+
+
+@router.post("/admin/flows/reload")
+async def reload_flow():
+    """
+    Recompila booking_flow.json e publica como nova versão sem reiniciar o servidor.
+    Conversas em andamento continuam na versão com que começaram.
+    """
+    try:
+        previous_version = flow_manager.flows.current_version
+        version = flow_manager.flows.reload()
+        discarded = flow_manager.collect_flow_versions()
+    except Exception as e:
+        logging.error(f"Erro ao recarregar fluxo: {e}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Fluxo inválido, versão atual mantida: {e}")
+
+    return {
+        "success": True,
+        "message": "Fluxo recarregado" if version != previous_version else "Fluxo sem alterações",
+        "current_version": version,
+        "discarded_versions": discarded
+    }
+
+
+@router.get("/metrics/sessions")
+async def get_session_metrics():
+    """
+    Retorna métricas das conversas mantidas em memória (sessões vivas, descartes e tamanho aproximado).
+    """
+    return {
+        "success": True,
+        "metrics": {
+            **flow_manager.user_conversations.metrics(),
+            **session_serializer.metrics()
+        }
+    }
+
+
+@router.get("/metrics/funnel")
+async def get_funnel_metrics(flow_version: Optional[int] = None):
+    """
+    Retorna o funil do chatbot por estado do fluxo (entradas, turnos, respostas inválidas,
+    abandonos, quantas respostas foram resolvidas localmente, pelo cache ou pelo Gemini e os
+    percentis de latência do turno), calculado a partir do log de eventos das conversas.
+    Sem `flow_version`, usa a versão atual do fluxo.
+    """
+    version = flow_version if flow_version is not None else flow_manager.flows.current_version
+    flow = flow_manager.flows.get(version)
+    return {
+        "success": True,
+        "metrics": {
+            **funnel_aggregator.funnel(version, list(flow.states) if flow else None),
+            "versions_seen": funnel_aggregator.versions(),
+            "event_log": {**conversation_events.metrics(), **funnel_aggregator.metrics()}
+        }
+    }
+
+
+@router.get("/metrics/archive")
+async def get_archive_metrics(db: aiosqlite.Connection = Depends(get_db)):
+    """
+    Retorna os contadores do arquivamento de agendamentos antigos (arquivados, lotes,
+    última execução) e até quando vai o arquivo: listagens de janelas que começam antes
+    disso também leem Agendamentos_Arquivo.
+    """
+    reach = await archive_reach(db)
+    return {
+        "success": True,
+        "metrics": {
+            **appointment_archiver.metrics(),
+            "archive_reaches": str(from_epoch(reach)) if reach is not None else None
+        }
+    }
+
+
+@router.get("/metrics/availability")
+async def get_availability_metrics():
+    """
+    Retorna o tamanho do índice de disponibilidade em memória, o tempo de carga e
+    quantos agendamentos a estratégia de distribuição atribuiu a cada médico e os
+    contadores da lista de espera.
+    """
+    return {
+        "success": True,
+        "metrics": {
+            **availability_index.metrics(),
+            "doctor_assignment": doctor_assigner.metrics(),
+            "waitlist": waitlist_matcher.metrics()
+        }
+    }
+
+
+@router.get("/metrics/notifications")
+async def get_notification_metrics(db: aiosqlite.Connection = Depends(get_db)):
+    """
+    Retorna os contadores do despachante de notificações (enviadas, reenviadas, com erro,
+    lembretes agendados), os backends por canal e quantas mensagens há em cada status.
+    """
+    return {
+        "success": True,
+        "metrics": {
+            **outbox_dispatcher.metrics(),
+            "outbox": await outbox_dispatcher.backlog(db)
+        }
+    }
+
+
+@router.get("/metrics/pdf")
+async def get_pdf_metrics():
+    """
+    Retorna a taxa de acerto dos templates locais de PDF, a latência economizada em relação ao
+    Gemini e a redução do texto enviado no prompt.
+    """
+    return {
+        "success": True,
+        "metrics": pdf_jobs.metrics()
+    }
+
+
 @router.get("/exames")
 async def get_available_exams(db: aiosqlite.Connection = Depends(get_db)):
     """
@@ -179,47 +423,131 @@ async def get_exams_for_location(local_id: int, db: aiosqlite.Connection = Depen
         raise HTTPException(status_code=500, detail="Erro interno ao buscar exames para o local")
 
 
-@router.post("/process-message")
-async def process_booking_message(
-        message_data: Dict[str, str],
-        user_id: str = "session_123",
-        db: aiosqlite.Connection = Depends(get_db)
-):
+@router.get("/especialidades/{especialidade_id}/locais")
+async def get_locations_for_specialty(especialidade_id: int, db: aiosqlite.Connection = Depends(get_db)):
     """
-    Processa a mensagem do usuário e retorna o estado completo da conversa.
+    Retorna os locais onde algum médico da especialidade atende (Medico_Locais).
     """
     try:
-        message = message_data.get("message", "").strip()
-        logging.info(f"Recebida requisição para user_id='{user_id}' com a mensagem: '{message}'")
+        query = """
+        SELECT l.id_local, l.nome, l.endereco, e.nome as especialidade_nome
+        FROM Especialidades e
+        JOIN Medico_Especialidades me ON me.id_especialidade = e.id_especialidade
+        JOIN Medico_Locais ml ON ml.id_medico = me.id_medico
+        JOIN Locais_Atendimento l ON l.id_local = ml.id_local
+        WHERE e.id_especialidade = ?
+        GROUP BY l.id_local
+        ORDER BY l.nome
+        """
+        
+        async with db.execute(query, (especialidade_id,)) as cursor:
+            results = await cursor.fetchall()
+            
+        if not results:
+            return {
+                "success": False,
+                "message": "Especialidade não encontrada ou sem médicos com local de atendimento",
+                "locais": []
+            }
+        
+        locations_list = []
+        especialidade_nome = results[0][3]  # Nome da especialidade do primeiro resultado
+        
+        for result in results:
+            locations_list.append({
+                "id": result[0],
+                "nome": result[1],
+                "endereco": result[2]
+            })
+            
+        return {
+            "success": True,
+            "especialidade_nome": especialidade_nome,
+            "especialidade_id": especialidade_id,
+            "locais": locations_list,
+            "total": len(locations_list)
+        }
+        
+    except Exception as e:
+        logging.error(f"Erro ao buscar locais para especialidade {especialidade_id}: {e}")
+        raise HTTPException(status_code=500, detail="Erro interno ao buscar locais para a especialidade")
 
-        if not message:
-            logging.warning("Mensagem recebida está vazia.")
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="A mensagem é obrigatória")
 
-        conversation_update = flow_manager.process_user_response(user_id, message)
+@router.get("/locais/{local_id}/medicos")
+async def get_doctors_for_location(local_id: int, db: aiosqlite.Connection = Depends(get_db)):
+    """
+    Retorna os médicos que atendem em um local, com os dias e horários de atendimento nele.
+    """
+    try:
+        query = """
+        SELECT m.id_medico, m.nome, ml.dia_semana, ml.hora_inicio, ml.hora_fim
+        FROM Medico_Locais ml
+        JOIN Medicos m ON m.id_medico = ml.id_medico
+        WHERE ml.id_local = ?
+        ORDER BY m.nome, ml.dia_semana
+        """
+        
+        async with db.execute(query, (local_id,)) as cursor:
+            results = await cursor.fetchall()
+            
+        if not results:
+            return {
+                "success": False,
+                "message": "Local não encontrado ou sem médicos cadastrados",
+                "medicos": []
+            }
+        
+        doctors = {}
+        for id_medico, nome, dia_semana, hora_inicio, hora_fim in results:
+            doctor = doctors.setdefault(id_medico, {"id": id_medico, "nome": nome, "horarios": []})
+            doctor["horarios"].append({
+                "dia_semana": dia_semana,
+                "hora_inicio": hora_inicio,
+                "hora_fim": hora_fim
+            })
+            
+        return {
+            "success": True,
+            "local_id": local_id,
+            "medicos": list(doctors.values()),
+            "total": len(doctors)
+        }
+        
+    except Exception as e:
+        logging.error(f"Erro ao buscar médicos para local {local_id}: {e}")
+        raise HTTPException(status_code=500, detail="Erro interno ao buscar médicos para o local")
 
-        # --- PONTO DE LOG CRÍTICO ---
-        logging.info(f"PACOTE DE DADOS A SER ENVIADO: {conversation_update}")
-        # -----------------------------
 
-        # Se o usuário chegou ao estado END após confirmar, cria automaticamente o agendamento
-        if conversation_update.get("current_state") == "END":
-            try:
-                # LOG CRÍTICO: Dados que serão enviados para criação
-                logging.info(f"🔍 DADOS CONVERSATION_DATA: {conversation_update.get('conversation_data')}")
-                
-                # Cria o agendamento automaticamente
-                appointment_result = await create_appointment_from_ai({
-                    "extracted_data": conversation_update.get("conversation_data")
-                }, db)
-                
-                # LOG CRÍTICO: Resultado da criação
-                logging.info(f"🔍 APPOINTMENT_RESULT: {appointment_result}")
-                
-                # Atualiza a mensagem para incluir os detalhes do agendamento
-                appointment_data = appointment_result['appointment_data']
-                logging.info(f"🔍 APPOINTMENT_DATA EXTRAÍDO: {appointment_data}")
-                success_message = f"""✅ {conversation_update.get("next_question")}
+async def _run_conversation_turn(user_id: str, message: str, db: aiosqlite.Connection) -> dict:
+    """
+    Executa um turno da conversa: avança o fluxo e, ao chegar em END, cria o agendamento.
+    """
+    # Atualiza o snapshot do catálogo (assíncrono) antes do turno; o FlowManager só lê da memória
+    await catalog_service.ensure_fresh(db)
+    conversation_update = await asyncio.to_thread(flow_manager.process_user_response, user_id, message)
+
+    # --- PONTO DE LOG CRÍTICO ---
+    logging.info(f"PACOTE DE DADOS A SER ENVIADO: {conversation_update}")
+    # -----------------------------
+
+    # Se o usuário chegou ao estado END após confirmar, cria automaticamente o agendamento
+    if conversation_update.get("current_state") == "END":
+        try:
+            # LOG CRÍTICO: Dados que serão enviados para criação
+            logging.info(f"🔍 DADOS CONVERSATION_DATA: {conversation_update.get('conversation_data')}")
+            
+            # Cria o agendamento automaticamente
+            appointment_result = await create_appointment_from_ai({
+                "extracted_data": conversation_update.get("conversation_data")
+            }, db)
+            
+            # LOG CRÍTICO: Resultado da criação
+            logging.info(f"🔍 APPOINTMENT_RESULT: {appointment_result}")
+            
+            # Atualiza a mensagem para incluir os detalhes do agendamento
+            appointment_data = appointment_result['appointment_data']
+            logging.info(f"🔍 APPOINTMENT_DATA EXTRAÍDO: {appointment_data}")
+            success_message = f"""✅ {conversation_update.get("next_question")}
 
 🎉 **Agendamento criado com sucesso!**
 
@@ -232,80 +560,103 @@ async def process_booking_message(
 • **Local:** {appointment_data['local']}
 • **Convênio:** {appointment_data['convenio']}"""
 
-                response = {
-                    "success": True,
-                    "next_question": success_message,
-                    "conversation_data": conversation_update.get("conversation_data"),
-                    "current_state": conversation_update.get("current_state"),
-                    "extracted_data": conversation_update.get("conversation_data"),
-                    "status": "appointment_created",
-                    "can_proceed": False,
-                    "validation": {"is_valid": True},
-                    "appointment_data": appointment_result['appointment_data']
-                }
-                
-                return response
-                
-            except Exception as e:
-                logging.error(f"Erro ao criar agendamento automaticamente: {e}")
-                response = {
-                    "success": True,
-                    "next_question": f"❌ Erro ao criar agendamento. {str(e)}",
-                    "conversation_data": conversation_update.get("conversation_data"),
-                    "current_state": "ERROR",
-                    "extracted_data": conversation_update.get("conversation_data"),
-                    "status": "error",
-                    "can_proceed": False,
-                    "validation": {"is_valid": False}
-                }
-                return response
-
-        # Calcula progresso baseado nos dados coletados
-        conversation_data = conversation_update.get("conversation_data", {})
-        total_fields = 11  # Total de campos necessários
-        collected_fields = 0
-        
-        # Conta campos do paciente
-        paciente = conversation_data.get("paciente", {})
-        collected_fields += sum(1 for v in [paciente.get("nome"), paciente.get("cpf"), 
-                                          paciente.get("data_nascimento"), paciente.get("sexo")] if v)
-        
-        # Conta campos do agendamento
-        agendamento = conversation_data.get("agendamento_info", {})
-        collected_fields += sum(1 for v in [agendamento.get("tipo"), 
-                                          agendamento.get("especialidade") or agendamento.get("nome_exame"),
-                                          agendamento.get("local"), agendamento.get("convenio")] if v)
-        
-        # Conta campos de contato
-        contato = conversation_data.get("contato", {})
-        collected_fields += sum(1 for v in [contato.get("telefone"), contato.get("email")] if v)
-        
-        # Conta campos de preferências
-        preferencias = conversation_data.get("preferencias", {})
-        collected_fields += sum(1 for v in [preferencias.get("data_preferencia"), 
-                                          preferencias.get("horario_preferencia")] if v)
-        
-        completion_percentage = (collected_fields / total_fields) * 100
-
-        response = {
-            "success": True,
-            "next_question": conversation_update.get("next_question"),
-            "conversation_data": conversation_update.get("conversation_data"),
-            "current_state": conversation_update.get("current_state"),
-            # Campos que o frontend espera:
-            "extracted_data": conversation_update.get("conversation_data"),
-            "status": "ready_to_book" if conversation_update.get(
-                "current_state") == "CONFIRMATION" else "need_more_info",
-            "can_proceed": conversation_update.get("current_state") == "CONFIRMATION",
-            "validation": {
-                "is_valid": True,
-                "completion_percentage": completion_percentage,
-                "collected_fields": collected_fields,
-                "total_fields": total_fields
+            response = {
+                "success": True,
+                "next_question": success_message,
+                "conversation_data": conversation_update.get("conversation_data"),
+                "current_state": conversation_update.get("current_state"),
+                "extracted_data": conversation_update.get("conversation_data"),
+                "status": "appointment_created",
+                "can_proceed": False,
+                "validation": {"is_valid": True},
+                "appointment_data": appointment_result['appointment_data']
+            }
+            
+            return response
+            
+        except Exception as e:
+            logging.error(f"Erro ao criar agendamento automaticamente: {e}")
+            response = {
+                "success": True,
+                "next_question": f"❌ Erro ao criar agendamento. {str(e)}",
+                "conversation_data": conversation_update.get("conversation_data"),
+                "current_state": "ERROR",
+                "extracted_data": conversation_update.get("conversation_data"),
+                "status": "error",
+                "can_proceed": False,
+                "validation": {"is_valid": False}
             }
+            return response
+
+    # Calcula progresso baseado nos dados coletados
+    conversation_data = conversation_update.get("conversation_data", {})
+    total_fields = 11  # Total de campos necessários
+    collected_fields = 0
+    
+    # Conta campos do paciente
+    paciente = conversation_data.get("paciente", {})
+    collected_fields += sum(1 for v in [paciente.get("nome"), paciente.get("cpf"), 
+                                      paciente.get("data_nascimento"), paciente.get("sexo")] if v)
+    
+    # Conta campos do agendamento
+    agendamento = conversation_data.get("agendamento_info", {})
+    collected_fields += sum(1 for v in [agendamento.get("tipo"), 
+                                      agendamento.get("especialidade") or agendamento.get("nome_exame"),
+                                      agendamento.get("local"), agendamento.get("convenio")] if v)
+    
+    # Conta campos de contato
+    contato = conversation_data.get("contato", {})
+    collected_fields += sum(1 for v in [contato.get("telefone"), contato.get("email")] if v)
+    
+    # Conta campos de preferências
+    preferencias = conversation_data.get("preferencias", {})
+    collected_fields += sum(1 for v in [preferencias.get("data_preferencia"), 
+                                      preferencias.get("horario_preferencia")] if v)
+    
+    completion_percentage = (collected_fields / total_fields) * 100
+
+    response = {
+        "success": True,
+        "next_question": conversation_update.get("next_question"),
+        "conversation_data": conversation_update.get("conversation_data"),
+        "current_state": conversation_update.get("current_state"),
+        # Campos que o frontend espera:
+        "extracted_data": conversation_update.get("conversation_data"),
+        "status": "ready_to_book" if conversation_update.get(
+            "current_state") == "CONFIRMATION" else "need_more_info",
+        "can_proceed": conversation_update.get("current_state") == "CONFIRMATION",
+        "validation": {
+            "is_valid": True,
+            "completion_percentage": completion_percentage,
+            "collected_fields": collected_fields,
+            "total_fields": total_fields
         }
+    }
+
+    return response
 
-        return response
+
+@router.post("/process-message")
+async def process_booking_message(
+        message_data: Dict[str, str],
+        user_id: str = "session_123",
+        db: aiosqlite.Connection = Depends(get_db)
+):
+    """
+    Processa a mensagem do usuário e retorna o estado completo da conversa.
+    """
+    try:
+        message = message_data.get("message", "").strip()
+        logging.info(f"Recebida requisição para user_id='{user_id}' com a mensagem: '{message}'")
+
+        if not message:
+            logging.warning("Mensagem recebida está vazia.")
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="A mensagem é obrigatória")
+
+        # Turnos da mesma sessão rodam em ordem; mensagens idênticas em andamento são deduplicadas
+        return await session_serializer.run(
+            user_id, message, lambda: _run_conversation_turn(user_id, message, db)
+        )
 
     except Exception as e:
         logging.error(f"ERRO CRÍTICO NA ROTA DA API: {e}", exc_info=True)
@@ -314,84 +665,21 @@ async def process_booking_message(
             detail=f"Erro ao processar a mensagem: {str(e)}"
         )
 
-@router.post("/process-pdf")
-async def process_pdf_file(pdf_file: UploadFile = File(...), db: aiosqlite.Connection = Depends(get_db)):
-   try:
-       content = await pdf_file.read()
-
-       from PyPDF2 import PdfReader
-       from io import BytesIO
-
-       reader = PdfReader(BytesIO(content))
-       full_text = "\n".join(page.extract_text() for page in reader.pages if page.extract_text())
-
-       if not full_text.strip():
-           raise HTTPException(status_code=400, detail="Não foi possível extrair texto do PDF.")
-
-       # Prompt estruturado para resposta em JSON
-       prompt = f"""
-Você receberá o conteúdo extraído de um PDF. Extraia todos os dados relevantes para agendamento de consulta médica.
-Se algum dado não estiver presente, coloque o valor como null.
-Responda SOMENTE com um JSON no seguinte formato:
-
-IMPORTANTE: 
-- Se não encontrar telefone, use "não informado"
-- Se não encontrar email, use "não informado" 
-- Se não encontrar horário de preferência, use "manhã"
-- Se não encontrar local, use "Hospital Geral"
-- Se não encontrar convênio, use "Particular"
-
-{{
- "paciente": {{
-   "nome": "...",
-   "cpf": "...",
-   "data_nascimento": "YYYY-MM-DD",
-   "sexo": "M" ou "F" ou "O"
- }},
- "contato": {{
-   "telefone": "... ou não informado",
-   "email": "... ou não informado"
- }},
- "agendamento_info": {{
-   "tipo": "consulta" ou "exame",
-   "especialidade": "... (se for consulta)",
-   "nome_exame": "... (se for exame)",
-   "local": "Hospital Geral",
-   "convenio": "Particular"
- }},
- "preferencias": {{
-   "data_preferencia": "YYYY-MM-DD",
-   "horario_preferencia": "manhã" ou "tarde" ou "noite" ou "HH:MM"
- }}
-}}
-
-Conteúdo do PDF:
-{full_text}
-"""
-
-       logging.info("🔎 Enviando texto para o Gemini...")
-       result = ai_model.generate_content(prompt, generation_config={"temperature": 0.3})
-       extracted_json = result.text.strip()
-
-       logging.info(f"📥 Resposta bruta do Gemini: {extracted_json[:300]}...")
-
-       # Limpeza para garantir que seja JSON válido
-       extracted_clean = extracted_json.replace("```json", "").replace("```", "").strip()
-       conversation_data = json.loads(extracted_clean)
-
-       # Validação básica do JSON
-       if "paciente" not in conversation_data or not conversation_data["paciente"].get("cpf"):
-           raise HTTPException(status_code=400, detail="Os dados extraídos estão incompletos ou inválidos.")
-
-       logging.info(f"🔍 Dados extraídos do PDF: {conversation_data}")
-
-       # Cria o agendamento automaticamente já que todos os dados estão disponíveis
-       try:
-           agendamento_result = await create_appointment_from_ai({"extracted_data": conversation_data}, db)
-           
-           # Retorna sucesso com dados do agendamento criado
-           appointment_data = agendamento_result['appointment_data']
-           success_message = f"""🎉 **Agendamento criado automaticamente via PDF!**
+
+async def _book_from_pdf(conversation_data: Dict) -> Dict:
+    """
+    Cria o agendamento a partir dos dados extraídos do PDF e monta a resposta final do job.
+    """
+    conn = await db_manager.get_connection()
+    try:
+        # Cria o agendamento automaticamente já que todos os dados estão disponíveis
+        agendamento_result = await create_appointment_from_ai(
+            {"extracted_data": conversation_data, "canal": CanalAgendamentoEnum.PDF.value}, conn
+        )
+        
+        # Retorna sucesso com dados do agendamento criado
+        appointment_data = agendamento_result['appointment_data']
+        success_message = f"""🎉 **Agendamento criado automaticamente via PDF!**
 
 📋 **Detalhes do Agendamento:**
 • **ID:** {appointment_data['id_agendamento']}
@@ -404,54 +692,148 @@ Conteúdo do PDF:
 
 ✅ **Seu agendamento foi confirmado!**"""
 
-           response = {
-               "success": True,
-               "message": "PDF processado e agendamento criado com sucesso!",
-               "next_question": success_message,
-               "conversation_data": conversation_data,
-               "current_state": "END",
-               "extracted_data": conversation_data,
-               "status": "appointment_created",
-               "can_proceed": False,
-               "validation": {
-                   "is_valid": True,
-                   "completion_percentage": 100,
-                   "collected_fields": 11,
-                   "total_fields": 11
-               },
-               "appointment_data": appointment_data
-           }
-
-           return response
-           
-       except Exception as e:
-           logging.error(f"Erro ao criar agendamento via PDF: {e}")
-           # Se falhar, retorna dados para criação manual
-           response = {
-               "success": True,
-               "message": "PDF processado com sucesso!",
-               "next_question": f"PDF processado com sucesso! Os dados foram extraídos. Erro ao criar agendamento automaticamente: {str(e)}. Você pode tentar criar manualmente.",
-               "conversation_data": conversation_data,
-               "current_state": "CONFIRMATION",
-               "extracted_data": conversation_data,
-               "status": "ready_to_book",
-               "can_proceed": True,
-               "validation": {
-                   "is_valid": True,
-                   "completion_percentage": 100,
-                   "collected_fields": 11,
-                   "total_fields": 11
-               }
-           }
-
-           return response
-
-   except json.JSONDecodeError as e:
-       logging.error(f"❌ Erro ao decodificar JSON: {e}")
-       raise HTTPException(status_code=500, detail="Erro ao interpretar a resposta da IA.")
-   except Exception as e:
-       logging.error(f"❌ Erro ao processar PDF: {e}", exc_info=True)
-       raise HTTPException(status_code=500, detail="Erro ao processar PDF.")
+        return {
+            "success": True,
+            "message": "PDF processado e agendamento criado com sucesso!",
+            "next_question": success_message,
+            "conversation_data": conversation_data,
+            "current_state": "END",
+            "extracted_data": conversation_data,
+            "status": "appointment_created",
+            "can_proceed": False,
+            "validation": {
+                "is_valid": True,
+                "completion_percentage": 100,
+                "collected_fields": 11,
+                "total_fields": 11
+            },
+            "appointment_data": appointment_data
+        }
+        
+    except Exception as e:
+        logging.error(f"Erro ao criar agendamento via PDF: {e}")
+        # Se falhar, retorna dados para criação manual
+        return {
+            "success": True,
+            "message": "PDF processado com sucesso!",
+            "next_question": f"PDF processado com sucesso! Os dados foram extraídos. Erro ao criar agendamento automaticamente: {str(e)}. Você pode tentar criar manualmente.",
+            "conversation_data": conversation_data,
+            "current_state": "CONFIRMATION",
+            "extracted_data": conversation_data,
+            "status": "ready_to_book",
+            "can_proceed": True,
+            "validation": {
+                "is_valid": True,
+                "completion_percentage": 100,
+                "collected_fields": 11,
+                "total_fields": 11
+            }
+        }
+    finally:
+        await conn.close()
+
+
+pdf_jobs = PdfJobManager(model=ai_model, book=_book_from_pdf)
+pdf_bulk = PdfBulkIntake(pdf_jobs)
+
+
+@router.on_event("startup")
+async def resume_pdf_jobs():
+    """Retoma os jobs de PDF interrompidos por um reinício."""
+    try:
+        await pdf_jobs.resume_pending()
+    except Exception as e:
+        logging.error(f"Erro ao retomar jobs de PDF: {e}")
+
+
+@router.on_event("shutdown")
+async def stop_pdf_workers():
+    pdf_jobs.shutdown()
+
+
+@router.post("/process-pdf", status_code=status.HTTP_202_ACCEPTED)
+async def process_pdf_file(pdf_file: UploadFile = File(...)):
+    """
+    Recebe o PDF e cria um job de processamento em segundo plano.
+    Retorna o id do job imediatamente; o andamento é consultado em /pdf-jobs/{job_id}.
+    """
+    try:
+        job = await pdf_jobs.submit(pdf_file)
+    except PdfUploadTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except Exception as e:
+        logging.error(f"❌ Erro ao registrar PDF: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Erro ao processar PDF.")
+
+    return {
+        "success": True,
+        "message": "PDF recebido. Processamento iniciado.",
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "status_url": f"/api/v1/ai-booking/pdf-jobs/{job['job_id']}",
+        "events_url": f"/api/v1/ai-booking/pdf-jobs/{job['job_id']}/events"
+    }
+
+
+@router.post("/process-pdf-bulk")
+async def process_pdf_bulk(files: List[UploadFile] = File(...)):
+    """
+    Recebe um lote de PDFs (vários arquivos e/ou arquivos ZIP) e cria os agendamentos.
+
+    A resposta é NDJSON: uma linha por arquivo assim que seu agendamento é gravado e,
+    no final, uma linha de resumo. Um arquivo com problema não interrompe o lote.
+    """
+    try:
+        items = await stage_uploads(files)
+    except PdfUploadTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except BulkLimitExceeded as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        logging.error(f"❌ Erro ao receber lote de PDFs: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Erro ao receber os arquivos.")
+
+    logging.info(f"📦 Lote de {len(items)} PDFs recebido")
+
+    async def ndjson():
+        async for line in pdf_bulk.run(items):
+            yield json.dumps(line, ensure_ascii=False, default=str) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
+@router.get("/pdf-jobs/{job_id}")
+async def get_pdf_job(job_id: str):
+    """
+    Retorna o status, o progresso e, quando concluído, o resultado de um job de PDF.
+    """
+    job = await pdf_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job não encontrado")
+    return {"success": True, **job}
+
+
+@router.get("/pdf-jobs/{job_id}/events")
+async def stream_pdf_job_events(job_id: str):
+    """
+    Transmite (Server-Sent Events) cada mudança de status do job até ele terminar.
+    """
+    if await pdf_jobs.get(job_id) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job não encontrado")
+
+    async def event_stream():
+        last_status = None
+        while True:
+            job = await pdf_jobs.get(job_id)
+            if job["status"] != last_status:
+                last_status = job["status"]
+                yield f"data: {json.dumps(job, default=str)}\n\n"
+            if job["status"] in FINAL_STATUSES:
+                break
+            if not await pdf_jobs.wait_for_change(timeout=15):
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
 
 
 @router.get("/sugestoes-inteligentes")
@@ -603,214 +985,39 @@ async def create_appointment_from_ai(
 ):
     """
     Cria um agendamento completo baseado nos dados coletados pelo chatbot.
+    O campo opcional "canal" ("chat" ou "pdf") registra a origem do agendamento.
     """
     # A PRIMEIRA LINHA DEVE SER ESTA:
     logging.info(f"PAYLOAD RECEBIDO PARA CRIAÇÃO: {conversation_data}")
 
     try:
-        logging.info(f"Recebendo dados do chatbot: {conversation_data}")
-
         # CORREÇÃO: Extrai dados da estrutura aninhada 'extracted_data'
-        extracted_data = conversation_data.get("extracted_data", {})
-        paciente_data = extracted_data.get("paciente", {})
-        contato_data = extracted_data.get("contato", {})
-        agendamento_data = extracted_data.get("agendamento_info", {})
-        preferencias_data = extracted_data.get("preferencias", {})
-
-        # Validação dos dados obrigatórios
-        required_patient_fields = ["nome", "cpf", "data_nascimento", "sexo"]
-        for field in required_patient_fields:
-            if not paciente_data.get(field):
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Campo obrigatório ausente: paciente.{field}"
-                )
-
-        # Validação dos dados de agendamento
-        if not preferencias_data.get("data_preferencia"):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Data de preferência é obrigatória"
-            )
-
-        # Converte sexo para enum
-        sexo_map = {"M": SexoEnum.MASCULINO, "F": SexoEnum.FEMININO, "O": SexoEnum.OUTRO}
-        sexo_enum = sexo_map.get(paciente_data["sexo"])
-        if not sexo_enum:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Sexo inválido: {paciente_data['sexo']}"
-            )
-
-        # Verifica se paciente já existe pelo CPF
-        existing_patient = await get_patient_by_cpf(db, paciente_data["cpf"])
-
-        if existing_patient:
-            logging.info(f"Paciente já existe com CPF {paciente_data['cpf']}: {existing_patient.id_paciente}")
-            patient_id = existing_patient.id_paciente
-        else:
-            # Cria novo paciente
-            patient_create = PacienteCreate(
-                nome=paciente_data["nome"],
-                cpf=paciente_data["cpf"],
-                data_nascimento=paciente_data["data_nascimento"],
-                sexo=sexo_enum
-            )
-
-            new_patient = await create_patient(db, patient_create)
-            patient_id = new_patient.id_paciente
-            logging.info(f"Novo paciente criado com ID: {patient_id}")
-
-        # Processa data e horário do agendamento
-        data_agendamento = preferencias_data["data_preferencia"]  # formato YYYY-MM-DD
-        horario_preferencia = preferencias_data.get("horario_preferencia") or "09:00"  # Default se for None
-
-        # Converte horário para time object
-        try:
-            if horario_preferencia and ":" in str(horario_preferencia):
-                hora, minuto = map(int, str(horario_preferencia).split(":"))
-            else:
-                # Se for texto como "manhã", "tarde", usa horários padrão
-                hora_map = {
-                    "manhã": 9, "manha": 9,
-                    "tarde": 14,
-                    "noite": 19
-                }
-                hora = hora_map.get(str(horario_preferencia).lower(), 9)
-                minuto = 0
-
-            hora_inicio = time(hora, minuto)
-            hora_fim = time(hora + 1 if hora < 23 else 23, minuto)  # 1 hora de duração
-
-        except (ValueError, TypeError):
-            # Horário padrão se houver erro
-            hora_inicio = time(9, 0)
-            hora_fim = time(10, 0)
-
-        # Combina data e hora
-        data_inicio = datetime.strptime(data_agendamento, "%Y-%m-%d").replace(
-            hour=hora_inicio.hour, minute=hora_inicio.minute
-        )
-        data_fim = datetime.strptime(data_agendamento, "%Y-%m-%d").replace(
-            hour=hora_fim.hour, minute=hora_fim.minute
-        )
-
-        # Para consultas: seleciona médico baseado na especialidade
-        # Para exames: busca o exame pelo nome
-        especialidade_solicitada = agendamento_data.get("especialidade", "")
-        nome_exame_solicitado = agendamento_data.get("nome_exame", "")
-        selected_doctor_id = None
-        selected_doctor_name = "Aguardando confirmação"
-        selected_exam_id = None
-        
-        if agendamento_data.get("tipo") == "consulta" and especialidade_solicitada:
-            try:
-                # Busca médicos que atendem a especialidade solicitada
-                query = """
-                SELECT m.id_medico, m.nome 
-                FROM Medicos m
-                JOIN Medico_Especialidades me ON m.id_medico = me.id_medico
-                JOIN Especialidades e ON me.id_especialidade = e.id_especialidade
-                WHERE e.nome = ?
-                LIMIT 1
-                """
-                
-                async with db.execute(query, (especialidade_solicitada,)) as cursor:
-                    doctor_row = await cursor.fetchone()
-                    if doctor_row:
-                        selected_doctor_id = doctor_row[0]
-                        selected_doctor_name = doctor_row[1]
-                        logging.info(f"Médico selecionado: {selected_doctor_name} (ID: {selected_doctor_id}) para especialidade: {especialidade_solicitada}")
-                    else:
-                        logging.warning(f"Nenhum médico encontrado para a especialidade: {especialidade_solicitada}")
-                        
-            except Exception as e:
-                logging.error(f"Erro ao buscar médico por especialidade: {e}")
-                
-        elif agendamento_data.get("tipo") == "exame" and nome_exame_solicitado:
-            try:
-                # Busca o exame pelo nome (busca mais flexível)
-                query = "SELECT id_exame, nome FROM Exames WHERE LOWER(nome) LIKE LOWER(?) LIMIT 1"
-                
-                async with db.execute(query, (f"%{nome_exame_solicitado}%",)) as cursor:
-                    exam_row = await cursor.fetchone()
-                    if exam_row:
-                        selected_exam_id = exam_row[0]
-                        logging.info(f"Exame selecionado: {exam_row[1]} (ID: {selected_exam_id})")
-                    else:
-                        # Tenta busca ainda mais flexível, palavra por palavra
-                        words = nome_exame_solicitado.lower().split()
-                        for word in words:
-                            if len(word) > 2:  # Ignora palavras muito pequenas
-                                query = "SELECT id_exame, nome FROM Exames WHERE LOWER(nome) LIKE LOWER(?) LIMIT 1"
-                                async with db.execute(query, (f"%{word}%",)) as cursor:
-                                    exam_row = await cursor.fetchone()
-                                    if exam_row:
-                                        selected_exam_id = exam_row[0]
-                                        logging.info(f"Exame encontrado por palavra-chave '{word}': {exam_row[1]} (ID: {selected_exam_id})")
-                                        break
-                        
-                        if not selected_exam_id:
-                            logging.warning(f"Nenhum exame encontrado com o nome: {nome_exame_solicitado}")
-                            # Se não encontrar, usa o primeiro exame disponível como fallback
-                            selected_exam_id = 1
-                        
-            except Exception as e:
-                logging.error(f"Erro ao buscar exame: {e}")
-                selected_exam_id = 1
-
-        # Cria o agendamento diretamente no banco sem usar o schema problemático
-        cursor = await db.execute(
-            """
-            INSERT INTO Agendamentos (id_paciente, id_local, id_convenio, id_tipo_consulta, id_exame, id_medico, 
-                                      data_hora_inicio, data_hora_fim, status, observacoes)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (patient_id, 1, None, 
-             1 if agendamento_data.get("tipo") == "consulta" else None,
-             selected_exam_id if agendamento_data.get("tipo") == "exame" else None, 
-             selected_doctor_id,
-             data_inicio, data_fim, StatusAgendamentoEnum.AGENDADO.value,
-             f"Agendamento criado via chatbot. Tipo: {agendamento_data.get('tipo', 'N/A')}, Especialidade/Exame: {agendamento_data.get('especialidade', '')}{agendamento_data.get('nome_exame', '')}, Contato: {contato_data.get('telefone', 'N/A')}")
-        )
-        await db.commit()
-        appointment_id = cursor.lastrowid
-
-        logging.info(f"Agendamento criado com sucesso - ID: {appointment_id}")
-
-        # Pega os dados que já foram coletados anteriormente no fluxo
-        data_agendamento_display = preferencias_data.get("data_preferencia")
-        horario_preferencia_display = preferencias_data.get("horario_preferencia") or "09:00"
-
-        # Monta a string de data e hora para exibição
-        data_hora_str = f"{data_agendamento_display} às {horario_preferencia_display}" if data_agendamento_display else "Não informado"
-
-        # Determina a especialidade ou exame e o nome do médico baseado no tipo
-        if agendamento_data.get("tipo") == "consulta":
-            especialidade_valor = agendamento_data.get("especialidade") or "Não informado"
-            medico_display = selected_doctor_name
-        else:  # exame
-            especialidade_valor = agendamento_data.get("nome_exame") or "Não informado"
-            medico_display = "Não aplicável (Exame)"
+        canal = conversation_data.get("canal")
+        if canal not in (CanalAgendamentoEnum.CHAT.value, CanalAgendamentoEnum.PDF.value):
+            canal = CanalAgendamentoEnum.CHAT.value
+        appointment_data = await book_from_conversation(db, conversation_data.get("extracted_data", {}), canal=canal)
 
         return {
             "success": True,
             "message": "Agendamento criado com sucesso!",
-            "appointment_data": {
-                "id_agendamento": appointment_id,
-                "nome_paciente": paciente_data.get("nome", "Não informado"),
-                "nome_medico": medico_display,
-                "especialidade": especialidade_valor,
-                "data_agendamento": data_hora_str,  # Enviando data e hora combinadas
-                "local": agendamento_data.get("local", "Não informado"),
-                "convenio": agendamento_data.get("convenio", "Particular"),
-                "observacoes": "Agendamento criado via chatbot"
-            }
+            "appointment_data": appointment_data
         }
 
-    except HTTPException:
-        # Re-raise HTTP exceptions as-is
-        raise
+    except SlotUnavailableError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
+    except aiosqlite.IntegrityError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Agendamento em conflito: {e}"
+        )
+    except BookingValidationError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except Exception as e:
         logging.error(f"Erro ao criar agendamento via chatbot: {e}", exc_info=True)
         raise HTTPException(
@@ -1,17 +1,29 @@
 """
 API routes for the booking process.
 """
-from fastapi import APIRouter, Depends, status
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional
+import json
+import time
 import aiosqlite
 
-from src.database.connection import get_db
+from src.config.settings import settings
+from src.database.connection import get_db, db_manager
 from src.database.models.schemas import (
     AgendamentoCreate, AgendamentoResponse,
     MedicoResponse, EspecialidadeResponse, LocalAtendimentoResponse,
-    TipoConsultaResponse, ExameResponse
+    TipoConsultaResponse, ExameResponse,
+    CancelamentoRequest, ReagendamentoRequest,
+    ListaEsperaCreate, ListaEsperaResponse, OfertaEsperaResponse, StatusAgendamentoEnum
 )
-from src.services import booking_service
+from src.services import booking_service, occupancy_service, waitlist_service
+from src.services.appointment_query import AppointmentQueryError, build_range_query, iter_appointments, list_appointments
+from src.services.availability_service import availability_index
+from src.services.catalog_service import catalog_service
+from src.services.slot_search import find_candidates, next_free_slots
+from src.services.waitlist_service import FreedSlot, waitlist_matcher
 
 router = APIRouter()
 
@@ -43,4 +55,225 @@ async def list_exams(db: aiosqlite.Connection = Depends(get_db)):
 @router.post("/appointments", status_code=status.HTTP_201_CREATED, response_model=AgendamentoResponse)
 async def create_new_appointment(appt: AgendamentoCreate, db: aiosqlite.Connection = Depends(get_db)):
     """Create a new appointment for a patient."""
-    return await booking_service.create_appointment(db, appt)
+    try:
+        return await booking_service.create_appointment(db, appt)
+    except booking_service.SlotUnavailableError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except aiosqlite.IntegrityError as e:
+        # Ex.: outro agendamento do médico com o mesmo início (uq_agendamentos_medico_inicio)
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Agendamento em conflito: {e}")
+    except booking_service.BookingValidationError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+def _listing_filters(doctor_id: Optional[int], location_id: Optional[int], patient_id: Optional[int],
+                     appointment_status: Optional[StatusAgendamentoEnum]) -> Dict[str, Any]:
+    return {
+        "id_medico": doctor_id,
+        "id_local": location_id,
+        "id_paciente": patient_id,
+        "status": appointment_status.value if appointment_status else None,
+    }
+
+def _fields(fields: Optional[str]) -> Optional[List[str]]:
+    return [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+
+@router.get("/appointments")
+async def list_appointments_in_window(
+    start: datetime,
+    end: datetime,
+    doctor_id: Optional[int] = None,
+    location_id: Optional[int] = None,
+    patient_id: Optional[int] = None,
+    appointment_status: Optional[StatusAgendamentoEnum] = Query(None, alias="status"),
+    fields: Optional[str] = Query(None, description="Colunas separadas por vírgula; todas se omitido"),
+    cursor: Optional[str] = None,
+    limit: int = Query(settings.appointment_list_default_limit, ge=1, le=settings.appointment_list_max_limit),
+    db: aiosqlite.Connection = Depends(get_db)
+):
+    """
+    Appointments of a doctor, location, patient and/or status starting in [start, end),
+    ordered by start. Pass `next_cursor` back as `cursor` for the next page.
+    """
+    try:
+        items, next_cursor = await list_appointments(
+            db, _listing_filters(doctor_id, location_id, patient_id, appointment_status),
+            start.replace(tzinfo=None), end.replace(tzinfo=None), _fields(fields), cursor, limit
+        )
+    except AppointmentQueryError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return {"items": items, "count": len(items), "next_cursor": next_cursor}
+
+@router.get("/appointments/export")
+async def export_appointments_in_window(
+    start: datetime,
+    end: datetime,
+    doctor_id: Optional[int] = None,
+    location_id: Optional[int] = None,
+    patient_id: Optional[int] = None,
+    appointment_status: Optional[StatusAgendamentoEnum] = Query(None, alias="status"),
+    fields: Optional[str] = Query(None, description="Colunas separadas por vírgula; todas se omitido")
+):
+    """Every appointment of the window as NDJSON (one object per line), streamed page by page."""
+    filters = _listing_filters(doctor_id, location_id, patient_id, appointment_status)
+    start, end, columns = start.replace(tzinfo=None), end.replace(tzinfo=None), _fields(fields)
+    try:
+        # Valida antes de começar a transmitir
+        build_range_query(filters, start, end, columns)
+    except AppointmentQueryError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    async def ndjson():
+        # Conexão própria: a do Depends é fechada antes do fim da transmissão
+        conn = await db_manager.get_connection()
+        try:
+            async for row in iter_appointments(conn, filters, start, end, columns, settings.appointment_export_batch):
+                yield json.dumps(row, ensure_ascii=False, default=str) + "\n"
+        finally:
+            await conn.close()
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+@router.post("/appointments/{appointment_id}/cancel", response_model=AgendamentoResponse)
+async def cancel_appointment(appointment_id: int, request: Optional[CancelamentoRequest] = None,
+                             db: aiosqlite.Connection = Depends(get_db)):
+    """Cancel an active appointment; its slot is offered to the waitlist."""
+    try:
+        appointment = await booking_service.cancel_appointment(db, appointment_id, request.motivo if request else None)
+    except booking_service.BookingValidationError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if appointment is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Agendamento não encontrado")
+    waitlist_matcher.notify(FreedSlot.of(appointment))
+    return appointment
+
+@router.post("/appointments/{appointment_id}/reschedule", response_model=AgendamentoResponse)
+async def reschedule_appointment(appointment_id: int, request: ReagendamentoRequest,
+                                 db: aiosqlite.Connection = Depends(get_db)):
+    """Move an active appointment to another start (and optionally doctor); the old slot is offered to the waitlist."""
+    try:
+        moved = await booking_service.reschedule_appointment(db, appointment_id, request.data_hora_inicio,
+                                                             request.id_medico)
+    except booking_service.SlotUnavailableError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except (booking_service.BookingValidationError, aiosqlite.IntegrityError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if moved is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Agendamento não encontrado")
+    previous, appointment = moved
+    waitlist_matcher.notify(FreedSlot.of(previous))
+    return appointment
+
+
+@router.post("/waitlist", status_code=status.HTTP_201_CREATED, response_model=ListaEsperaResponse)
+async def join_waitlist(entry: ListaEsperaCreate, db: aiosqlite.Connection = Depends(get_db)):
+    """Put a patient in the waitlist of a specialty or exam (optionally to bring an appointment forward)."""
+    try:
+        return await waitlist_service.add_to_waitlist(db, entry)
+    except (booking_service.BookingValidationError, aiosqlite.IntegrityError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.get("/waitlist/{entry_id}", response_model=ListaEsperaResponse)
+async def get_waitlist_entry(entry_id: int, db: aiosqlite.Connection = Depends(get_db)):
+    """A waitlist entry and its latest offer."""
+    entry = await waitlist_service.get_waitlist_entry(db, entry_id)
+    if entry is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Entrada da lista de espera não encontrada")
+    return entry
+
+@router.delete("/waitlist/{entry_id}", response_model=ListaEsperaResponse)
+async def leave_waitlist(entry_id: int, db: aiosqlite.Connection = Depends(get_db)):
+    """Leave the waitlist; a pending offer goes to the next patient."""
+    entry = await waitlist_matcher.cancel_entry(db, entry_id)
+    if entry is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Entrada da lista de espera não encontrada")
+    return entry
+
+@router.post("/waitlist/offers/{offer_id}/accept", response_model=AgendamentoResponse)
+async def accept_waitlist_offer(offer_id: int, db: aiosqlite.Connection = Depends(get_db)):
+    """Accept an offered slot: books it, or moves the appointment the patient wanted to bring forward."""
+    try:
+        appointment = await waitlist_matcher.accept(db, offer_id)
+    except booking_service.SlotUnavailableError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except booking_service.BookingValidationError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if appointment is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Oferta não encontrada")
+    return appointment
+
+@router.post("/waitlist/offers/{offer_id}/decline", response_model=OfertaEsperaResponse)
+async def decline_waitlist_offer(offer_id: int, db: aiosqlite.Connection = Depends(get_db)):
+    """Decline an offered slot; it is offered to the next compatible patient."""
+    try:
+        offer = await waitlist_matcher.decline(db, offer_id)
+    except booking_service.BookingValidationError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if offer is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Oferta não encontrada")
+    return offer
+
+
+@router.get("/availability/next-slots")
+async def next_available_slots(
+    specialty: Optional[str] = None,
+    exam: Optional[str] = None,
+    insurance: Optional[str] = None,
+    location_id: Optional[int] = None,
+    after: Optional[datetime] = None,
+    count: int = Query(5, ge=1),
+    distinct_times: bool = False
+):
+    """
+    Earliest free slots for a specialty (across its doctors that accept the insurance) or an
+    exam (across the locations that perform it), within working hours and the search horizon.
+    """
+    if bool(specialty) == bool(exam):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Informe uma especialidade ou um exame.")
+
+    snapshot = await catalog_service.ensure_fresh()
+    duration, candidates = find_candidates(snapshot, "exame" if exam else "consulta", exam or specialty,
+                                           insurance, location_id)
+    if not candidates:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="Nenhum médico ou local atende a solicitação com esse convênio.")
+
+    now = datetime.now()
+    after = max(after.replace(tzinfo=None), now) if after else now
+    started = time.perf_counter()
+    slots = next_free_slots(availability_index, candidates, duration, after,
+                            min(count, settings.slot_search_max_results), distinct_times=distinct_times)
+    return {
+        "duration_minutes": duration,
+        "candidates": len(candidates),
+        "slots": slots,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 3)
+    }
+
+
+@router.get("/dashboard/occupancy")
+async def occupancy_dashboard(
+    resource_type: str = Query(..., description="medico, local, especialidade ou exame"),
+    start: date = Query(...),
+    end: date = Query(...),
+    resource_id: Optional[int] = None,
+    db: aiosqlite.Connection = Depends(get_db)
+):
+    """
+    Daily occupancy in [start, end) per doctor, location, specialty or exam, read from the
+    aggregates the booking triggers keep, plus totals per resource over the window.
+    """
+    try:
+        days = await occupancy_service.get_occupancy(db, resource_type, start, end, resource_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    totals = occupancy_service.totals(days, "id_recurso", occupancy_service.STATUS_COLUMNS + ("minutos_ocupados",))
+    return {"resource_type": resource_type, "days": days, "totals": totals}
+
+@router.get("/dashboard/demand")
+async def demand_dashboard(start: date, end: date, db: aiosqlite.Connection = Depends(get_db)):
+    """Bookings made per day in [start, end) and channel (api, chat, pdf, lista_espera), plus totals per channel."""
+    try:
+        days = await occupancy_service.get_demand(db, start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return {"days": days, "totals": occupancy_service.totals(days, "canal", ("agendamentos", "cancelados"))}
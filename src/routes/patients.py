@@ -14,7 +14,11 @@ router = APIRouter()
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=PacienteResponse)
 async def create_patient(patient: PacienteCreate, db: aiosqlite.Connection = Depends(get_db)):
     """Create a new patient."""
-    return await patient_service.create_patient(db, patient)
+    try:
+        return await patient_service.create_patient(db, patient)
+    except ValueError as e:
+        # CPF que não pôde ser convertido (ver src/database/codecs.py)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
 @router.get("/{patient_id}", response_model=PacienteResponse)
 async def get_patient(patient_id: int, db: aiosqlite.Connection = Depends(get_db)):
@@ -33,7 +37,10 @@ async def list_patients(skip: int = 0, limit: int = 10, db: aiosqlite.Connection
 @router.put("/{patient_id}", response_model=PacienteResponse)
 async def update_patient(patient_id: int, patient: PacienteUpdate, db: aiosqlite.Connection = Depends(get_db)):
     """Update a patient's information."""
-    updated_patient = await patient_service.update_patient(db, patient_id, patient)
+    try:
+        updated_patient = await patient_service.update_patient(db, patient_id, patient)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     if updated_patient is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Patient not found")
     return updated_patient
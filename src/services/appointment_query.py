@@ -0,0 +1,143 @@
+"""
+Range queries over Agendamentos for doctor, location, patient and status calendars.
+
+Every listing is "appointments of one key starting in [inicio, fim)", answered by a range
+scan on the matching (key, data_hora_inicio) index. When several filters are given the
+most selective one leads (doctor, then patient, location, status) and the others are
+checked on the rows the scan returns; their columns are written as `+column` so SQLite
+never swaps to a less selective index.
+
+Pages are keyset-paginated on (data_hora_inicio, id_agendamento): the cursor is the last
+row returned, and the next page continues from it without OFFSET, so page 1000 costs
+the same as page 1. Cursor and bounds are epoch seconds, the storage format of the
+time columns (see src/database/codecs.py); rows come back with datetimes. Only the
+requested columns are read; a projection made only of index columns is answered from
+the index alone. `iter_appointments` walks the same pages for
+the streaming export.
+
+Windows that start before the newest archived appointment (see archive_service) also
+read `Agendamentos_Arquivo`, which has the same indexes: the page is a UNION ALL of the
+same range query on both tables, merged in key order without a sort.
+"""
+import json
+import base64
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+import aiosqlite
+
+from src.database.codecs import decode_appointment, to_epoch
+from src.services.archive_service import ARCHIVE_TABLE, archive_reach
+
+COLUMNS = (
+    "id_agendamento", "id_paciente", "id_local", "id_convenio", "id_tipo_consulta", "id_exame", "id_medico",
+    "id_especialidade", "canal", "data_hora_inicio", "data_hora_fim", "status", "observacoes", "data_criacao",
+)
+# Needed to build the next cursor, so always part of the projection
+KEY_COLUMNS = ("data_hora_inicio", "id_agendamento")
+
+# Filter column -> index that serves its range query, most selective first
+INDEXED_FILTERS = (
+    ("id_medico", "idx_agendamentos_medico_data"),
+    ("id_paciente", "idx_agendamentos_paciente_data"),
+    ("id_local", "idx_agendamentos_local_data"),
+    ("status", "idx_agendamentos_status_data"),
+)
+
+
+class AppointmentQueryError(ValueError):
+    """Raised for listing parameters that cannot be served (no key, bad window, fields or cursor)."""
+
+
+def encode_cursor(row) -> str:
+    value = json.dumps([to_epoch(row["data_hora_inicio"]), row["id_agendamento"]])
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[int, int]:
+    try:
+        start, appointment_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return to_epoch(start), int(appointment_id)
+    except (ValueError, TypeError) as e:
+        raise AppointmentQueryError(f"Cursor inválido: {cursor}") from e
+
+
+def projection(fields: Optional[Sequence[str]]) -> List[str]:
+    """Requested columns (all when empty) plus the keyset columns, in table order."""
+    if not fields:
+        return list(COLUMNS)
+    unknown = sorted(set(fields) - set(COLUMNS))
+    if unknown:
+        raise AppointmentQueryError(f"Campos desconhecidos: {', '.join(unknown)}")
+    wanted = set(fields) | set(KEY_COLUMNS)
+    return [column for column in COLUMNS if column in wanted]
+
+
+def build_range_query(filters: Dict[str, Any], start: datetime, end: datetime,
+                      fields: Optional[Sequence[str]] = None, after: Optional[Tuple[int, int]] = None,
+                      limit: Optional[int] = None, archived_before: Optional[int] = None) -> Tuple[str, tuple, str]:
+    """
+    SQL, parameters and expected index (on Agendamentos) of one page. `filters` maps
+    columns of INDEXED_FILTERS to values (None values are ignored); at least one is
+    required. The archive is read too when the range starts before `archived_before`
+    (see `archive_reach`).
+    """
+    given = [(column, index) for column, index in INDEXED_FILTERS if filters.get(column) is not None]
+    if not given:
+        raise AppointmentQueryError("Informe médico, local, paciente ou status")
+    if end <= start:
+        raise AppointmentQueryError("O fim da janela deve ser posterior ao início")
+
+    (lead, index), others = given[0], given[1:]
+    # After a cursor the range starts at it, so the index seek skips the pages already read
+    lower = max(to_epoch(start), after[0]) if after is not None else to_epoch(start)
+    conditions = [f"{lead} = ?", "data_hora_inicio >= ?", "data_hora_inicio < ?"]
+    params: List[Any] = [filters[lead], lower, to_epoch(end)]
+    for column, _ in others:
+        conditions.append(f"+{column} = ?")
+        params.append(filters[column])
+    if after is not None:
+        conditions.append("(data_hora_inicio, id_agendamento) > (?, ?)")
+        params.extend(after)
+
+    select = f"SELECT {', '.join(projection(fields))} FROM {{table}} WHERE {' AND '.join(conditions)}"
+    query = select.format(table="Agendamentos")
+    if archived_before is not None and lower < archived_before:
+        query += " UNION ALL " + select.format(table=ARCHIVE_TABLE)
+        params += params
+    query += " ORDER BY data_hora_inicio, id_agendamento"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    return query, tuple(params), index
+
+
+async def list_appointments(db: aiosqlite.Connection, filters: Dict[str, Any], start: datetime, end: datetime,
+                            fields: Optional[Sequence[str]] = None, cursor: Optional[str] = None,
+                            limit: int = 100) -> Tuple[List[dict], Optional[str]]:
+    """One page of the window and the cursor of the next one (None on the last page)."""
+    after = decode_cursor(cursor) if cursor else None
+    # One extra row tells whether there is a next page
+    query, params, _ = build_range_query(filters, start, end, fields, after, limit + 1, await archive_reach(db))
+    async with db.execute(query, params) as result:
+        rows = [decode_appointment(dict(row)) for row in await result.fetchall()]
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1])
+
+
+async def iter_appointments(db: aiosqlite.Connection, filters: Dict[str, Any], start: datetime, end: datetime,
+                            fields: Optional[Sequence[str]] = None, batch_size: int = 1000) -> AsyncIterator[dict]:
+    """Every appointment of the window, read page by page (no read transaction held across pages)."""
+    after = None
+    archived_before = await archive_reach(db)
+    while True:
+        query, params, _ = build_range_query(filters, start, end, fields, after, batch_size, archived_before)
+        async with db.execute(query, params) as result:
+            rows = await result.fetchall()
+        for row in rows:
+            yield decode_appointment(dict(row))
+        if len(rows) < batch_size:
+            return
+        after = (rows[-1]["data_hora_inicio"], rows[-1]["id_agendamento"])
@@ -0,0 +1,156 @@
+"""
+Archival of old appointments, to keep `Agendamentos` and its indexes sized to the
+appointments that are still worked on.
+
+Finished appointments (realizado, cancelado, ausente) that started more than
+`archive_horizon_days` ago are moved to `Agendamentos_Arquivo` with the same
+id_agendamento, `archive_batch_size` at a time: each batch is one short transaction
+(INSERT ... SELECT into the archive, DELETE from the hot table) followed by a pause, so
+bookings are never held behind a long write. Candidates are found on the (status,
+data_hora_inicio) index. Appointments still referenced by an open waitlist entry, a
+pending offer or a notification not yet sent stay in the hot table until those close.
+
+Closed rows of Lista_Espera, Ofertas_Espera and Notificacoes_Saida keep pointing at the
+archived id, which SQLite's foreign keys cannot follow across tables, so the archiver's
+connection runs without foreign key enforcement. The delete trigger of the occupancy
+aggregates skips archived rows, so dashboards keep their history.
+
+Listing and export read the archive through `archive_reach`: a window starting before
+the newest archived appointment is answered from both tables (see appointment_query).
+"""
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+import aiosqlite
+
+from src.config.settings import settings
+from src.database.codecs import to_epoch
+from src.database.connection import db_manager
+
+ARCHIVE_TABLE = "Agendamentos_Arquivo"
+ARCHIVED_STATUSES = ("realizado", "cancelado", "ausente")
+ARCHIVE_COLUMNS = (
+    "id_agendamento", "id_paciente", "id_local", "id_convenio", "id_tipo_consulta", "id_exame", "id_medico",
+    "id_especialidade", "canal", "data_hora_inicio", "data_hora_fim", "status", "observacoes", "data_criacao",
+)
+
+# Open references keep an appointment in the hot table; each subquery is evaluated once per batch
+SELECT_CANDIDATES_SQL = f"""
+    SELECT id_agendamento FROM Agendamentos
+    WHERE status IN ({', '.join('?' * len(ARCHIVED_STATUSES))}) AND data_hora_inicio < ?
+      AND id_agendamento NOT IN (SELECT id_agendamento FROM Lista_Espera
+                                 WHERE status IN ('aguardando', 'ofertado') AND id_agendamento IS NOT NULL)
+      AND id_agendamento NOT IN (SELECT id_agendamento FROM Ofertas_Espera
+                                 WHERE status = 'pendente' AND id_agendamento IS NOT NULL)
+      AND id_agendamento NOT IN (SELECT id_agendamento FROM Notificacoes_Saida
+                                 WHERE status IN ('pendente', 'enviando') AND id_agendamento IS NOT NULL)
+    LIMIT ?
+"""
+MOVE_SQL = f"""
+    INSERT INTO {ARCHIVE_TABLE} ({', '.join(ARCHIVE_COLUMNS)}, data_arquivamento)
+    SELECT {', '.join(ARCHIVE_COLUMNS)}, ? FROM Agendamentos
+    WHERE id_agendamento IN (SELECT value FROM json_each(?))
+"""
+DELETE_SQL = "DELETE FROM Agendamentos WHERE id_agendamento IN (SELECT value FROM json_each(?))"
+# Newest archived start: one seek per status on idx_agendamentos_arquivo_status_data
+ARCHIVE_REACH_SQL = "SELECT MAX(inicio) FROM (" + " UNION ALL ".join(
+    f"SELECT MAX(data_hora_inicio) AS inicio FROM {ARCHIVE_TABLE} WHERE status = '{status}'"
+    for status in ARCHIVED_STATUSES
+) + ")"
+
+
+async def archive_reach(db: aiosqlite.Connection) -> Optional[int]:
+    """Epoch just past the newest archived start (windows starting before it read the archive); None if empty."""
+    async with db.execute(ARCHIVE_REACH_SQL) as cursor:
+        newest = (await cursor.fetchone())[0]
+    return newest + 1 if newest is not None else None
+
+
+def archive_cutoff(now: Optional[datetime] = None) -> datetime:
+    """Appointments starting before this are old enough to be archived."""
+    return (now or datetime.now()) - timedelta(days=settings.archive_horizon_days)
+
+
+class AppointmentArchiver:
+    """Moves old finished appointments to the archive in small batches."""
+
+    def __init__(self):
+        self.counters = {"archived": 0, "batches": 0, "runs": 0}
+        self.last_run: Optional[dict] = None
+
+    async def archive_batch(self, db: aiosqlite.Connection, cutoff: datetime, batch_size: int) -> int:
+        """Moves up to `batch_size` appointments in one transaction. Returns how many were moved."""
+        # IMMEDIATE: the candidates cannot change between being chosen and being moved
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            async with db.execute(SELECT_CANDIDATES_SQL, (*ARCHIVED_STATUSES, to_epoch(cutoff), batch_size)) as cursor:
+                ids = [row[0] for row in await cursor.fetchall()]
+            if not ids:
+                await db.rollback()
+                return 0
+            id_list = "[" + ",".join(map(str, ids)) + "]"
+            await db.execute(MOVE_SQL, (datetime.now(), id_list))
+            await db.execute(DELETE_SQL, (id_list,))
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        self.counters["archived"] += len(ids)
+        self.counters["batches"] += 1
+        return len(ids)
+
+    async def run_once(self, db: aiosqlite.Connection, cutoff: Optional[datetime] = None,
+                       batch_size: Optional[int] = None, max_batches: Optional[int] = None) -> Dict[str, object]:
+        """
+        Archives every eligible appointment (or `max_batches` batches), pausing
+        `archive_batch_pause_seconds` between batches so writers get the database.
+        `db` must have foreign keys off (see `connect`).
+        """
+        cutoff = cutoff or archive_cutoff()
+        batch_size = batch_size or settings.archive_batch_size
+        started = time.perf_counter()
+        moved = batches = 0
+        while max_batches is None or batches < max_batches:
+            count = await self.archive_batch(db, cutoff, batch_size)
+            moved += count
+            batches += count > 0
+            if count < batch_size:
+                break
+            await asyncio.sleep(settings.archive_batch_pause_seconds)
+        self.counters["runs"] += 1
+        self.last_run = {"cutoff": cutoff.isoformat(sep=" "), "archived": moved, "batches": batches,
+                         "seconds": round(time.perf_counter() - started, 3)}
+        return self.last_run
+
+    @staticmethod
+    async def connect() -> aiosqlite.Connection:
+        """Connection for archiving: closed references may point at archived ids."""
+        conn = await db_manager.get_connection()
+        await conn.execute("PRAGMA foreign_keys = OFF")
+        return conn
+
+    def metrics(self) -> dict:
+        return {**self.counters, "horizon_days": settings.archive_horizon_days, "last_run": self.last_run}
+
+
+async def run_archiver(archiver: AppointmentArchiver, interval_seconds: int):
+    """Tarefa de fundo que arquiva periodicamente os agendamentos antigos."""
+    while True:
+        conn = await archiver.connect()
+        try:
+            result = await archiver.run_once(conn)
+            if result["archived"]:
+                logging.info(f"🗄️ {result['archived']} agendamentos anteriores a {result['cutoff']} arquivados "
+                             f"em {result['batches']} lotes ({result['seconds']}s)")
+        except Exception as e:
+            logging.error(f"Erro ao arquivar agendamentos antigos: {e}")
+        finally:
+            await conn.close()
+        await asyncio.sleep(interval_seconds)
+
+
+# Global archiver
+appointment_archiver = AppointmentArchiver()
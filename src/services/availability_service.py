@@ -0,0 +1,313 @@
+"""
+In-memory availability index for doctors and exam rooms.
+
+The schema leaves availability to the application. This index keeps, per resource
+and per day, a bitmap of 5-minute slots (a Python int, bit i = slot i) plus the
+sorted packed intervals that produced it, so cancelling an appointment can rebuild
+the bitmap exactly even when legacy data overlaps. "Is this interval free" is a mask
+test and "next free slot" is a handful of shifts per day, both well under a millisecond.
+
+Resources are doctors (`("medico", id_medico)`) and exam rooms (`("local", id_local,
+id_exame)`): a location runs many consultations at once, but each exam at a location is
+one room/machine. The index is loaded from `Agendamentos` at startup and updated
+incrementally after every committed insert or cancel; days before today are pruned
+periodically, so a long-running worker only keeps the days still bookable.
+"""
+import time
+import asyncio
+import logging
+import threading
+from array import array
+from bisect import bisect_left, insort
+from functools import lru_cache
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import aiosqlite
+
+from src.database.codecs import from_epoch, to_epoch
+
+SLOT_MINUTES = 5
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+
+ResourceKey = Tuple
+
+
+def _minutes(value: datetime) -> int:
+    return value.hour * 60 + value.minute
+
+
+def _mask(start_slot: int, end_slot: int) -> int:
+    return ((1 << (end_slot - start_slot)) - 1) << start_slot
+
+
+@lru_cache(maxsize=64)
+def _grid(first_slot: int, step_slots: int) -> int:
+    """Bits first_slot, first_slot + step_slots, ... up to the end of the day."""
+    bits = 0
+    for slot in range(first_slot, SLOTS_PER_DAY, step_slots):
+        bits |= 1 << slot
+    return bits
+
+
+def _parse(value) -> datetime:
+    """Datetime from a datetime, an ISO string or a stored epoch value."""
+    return from_epoch(value)
+
+
+def split_by_day(start: datetime, end: datetime) -> Iterator[Tuple[int, int, int]]:
+    """Yields (day ordinal, first slot, end slot) for each day the interval [start, end) touches."""
+    day = start.date()
+    last_day = end.date()
+    while day <= last_day:
+        first = _minutes(start) // SLOT_MINUTES if day == start.date() else 0
+        if day == last_day:
+            end_minutes = _minutes(end) + (1 if end.second or end.microsecond else 0)
+            stop = -(-end_minutes // SLOT_MINUTES)
+        else:
+            stop = SLOTS_PER_DAY
+        if stop > first:
+            yield day.toordinal(), first, stop
+        day += timedelta(days=1)
+
+
+class DaySchedule:
+    """Bitmap of busy slots of one resource on one day, and the intervals behind it."""
+    __slots__ = ("bits", "intervals")
+
+    def __init__(self):
+        self.bits = 0
+        # start_slot << 16 | end_slot, sorted
+        self.intervals = array("I")
+
+    def add(self, first: int, stop: int):
+        insort(self.intervals, first << 16 | stop)
+        self.bits |= _mask(first, stop)
+
+    def remove(self, first: int, stop: int) -> bool:
+        packed = first << 16 | stop
+        position = bisect_left(self.intervals, packed)
+        if position == len(self.intervals) or self.intervals[position] != packed:
+            return False
+        del self.intervals[position]
+        bits = 0
+        for interval in self.intervals:
+            bits |= _mask(interval >> 16, interval & 0xFFFF)
+        self.bits = bits
+        return True
+
+
+class AvailabilityIndex:
+    """Busy-slot bitmaps per resource and day."""
+
+    def __init__(self):
+        self._resources: Dict[ResourceKey, Dict[int, DaySchedule]] = {}
+        # Active appointments held by each resource
+        self._counts: Dict[ResourceKey, int] = {}
+        self._lock = threading.Lock()
+        self.loaded_appointments = 0
+        self.load_seconds = 0.0
+
+    @staticmethod
+    def resources_for(id_medico: Optional[int], id_local: Optional[int], id_exame: Optional[int]) -> List[ResourceKey]:
+        """Resources an appointment occupies."""
+        keys: List[ResourceKey] = []
+        if id_medico is not None:
+            keys.append(("medico", id_medico))
+        if id_exame is not None and id_local is not None:
+            keys.append(("local", id_local, id_exame))
+        return keys
+
+    def add(self, keys: Iterable[ResourceKey], start, end):
+        with self._lock:
+            self._add(keys, _parse(start), _parse(end))
+
+    def _add(self, keys: Iterable[ResourceKey], start: datetime, end: datetime):
+        spans = list(split_by_day(start, end))
+        for key in keys:
+            self._counts[key] = self._counts.get(key, 0) + 1
+            days = self._resources.get(key)
+            if days is None:
+                days = self._resources[key] = {}
+            for day, first, stop in spans:
+                schedule = days.get(day)
+                if schedule is None:
+                    schedule = days[day] = DaySchedule()
+                schedule.add(first, stop)
+
+    def remove(self, keys: Iterable[ResourceKey], start, end):
+        start, end = _parse(start), _parse(end)
+        with self._lock:
+            for key in keys:
+                days = self._resources.get(key, {})
+                removed = False
+                for day, first, stop in split_by_day(start, end):
+                    schedule = days.get(day)
+                    if schedule is not None and schedule.remove(first, stop):
+                        removed = True
+                        if not schedule.intervals:
+                            del days[day]
+                if removed:
+                    self._counts[key] -= 1
+
+    def prune(self, before: Optional[date] = None) -> int:
+        """
+        Drops the days before `before` (today by default), as `load` never loads them.
+        Returns how many resource days were dropped.
+        """
+        cutoff = (before or date.today()).toordinal()
+        dropped = 0
+        with self._lock:
+            for key, days in self._resources.items():
+                past = sorted(day for day in days if day < cutoff)
+                for day in past:
+                    schedule = days.pop(day)
+                    following = days.get(day + 1)
+                    # An interval running to midnight and continued the next day is one appointment,
+                    # counted when its last day goes
+                    finished = sum(
+                        1 for interval in schedule.intervals
+                        if interval & 0xFFFF < SLOTS_PER_DAY or following is None or not following.intervals
+                        or following.intervals[0] >> 16 != 0
+                    )
+                    self._counts[key] = max(0, self._counts.get(key, 0) - finished)
+                dropped += len(past)
+        return dropped
+
+    def _busy(self, keys: Sequence[ResourceKey], day: int) -> int:
+        bits = 0
+        for key in keys:
+            schedule = self._resources.get(key, {}).get(day)
+            if schedule is not None:
+                bits |= schedule.bits
+        return bits
+
+    def appointment_count(self, key: ResourceKey) -> int:
+        """Active appointments of the resource known to the index."""
+        return self._counts.get(key, 0)
+
+    def busy_slots(self, keys: Sequence[ResourceKey], day: date) -> int:
+        """How many 5-minute slots of `day` are taken on any of the resources."""
+        return self._busy(keys, day.toordinal()).bit_count()
+
+    def is_free(self, keys: Sequence[ResourceKey], start, end) -> bool:
+        """True when every resource is free during [start, end)."""
+        start, end = _parse(start), _parse(end)
+        return all(not self._busy(keys, day) & _mask(first, stop) for day, first, stop in split_by_day(start, end))
+
+    def free_starts(self, keys: Sequence[ResourceKey], day: date, duration_minutes: int,
+                    window: Tuple[int, int], not_before: Optional[datetime] = None) -> int:
+        """
+        Bitmap of the slots of `day` where an appointment of `duration_minutes` fits
+        entirely inside `window` (start, end minute of the day) with all resources free.
+        """
+        length = max(1, -(-duration_minutes // SLOT_MINUTES))
+        first = -(-window[0] // SLOT_MINUTES)
+        stop = window[1] // SLOT_MINUTES
+        if not_before is not None and not_before.date() == day:
+            first = max(first, -(-(_minutes(not_before) + (1 if not_before.second else 0)) // SLOT_MINUTES))
+        if stop - first < length:
+            return 0
+        runs = _mask(first, stop) & ~self._busy(keys, day.toordinal())
+        # After this loop, bit p is set only if slots p .. p+length-1 are all free
+        covered = 1
+        while covered < length:
+            step = min(covered, length - covered)
+            runs &= runs >> step
+            covered += step
+        return runs
+
+    def next_free(self, keys: Sequence[ResourceKey], after: datetime, duration_minutes: int,
+                  window: Tuple[int, int], horizon_days: int) -> Optional[datetime]:
+        """Earliest start at or after `after` where all resources are free for `duration_minutes`."""
+        day = after.date()
+        for _ in range(horizon_days):
+            runs = self.free_starts(keys, day, duration_minutes, window, not_before=after)
+            if runs:
+                slot = (runs & -runs).bit_length() - 1
+                return datetime.combine(day, datetime.min.time()) + timedelta(minutes=slot * SLOT_MINUTES)
+            day += timedelta(days=1)
+        return None
+
+    def iter_free_starts(self, keys: Sequence[ResourceKey], after: datetime, duration_minutes: int,
+                         hours: Callable[[date], Optional[Tuple[int, int]]], horizon_days: int,
+                         step_minutes: int = SLOT_MINUTES) -> Iterator[datetime]:
+        """
+        Yields, in chronological order, every start from `after` on (for `horizon_days`
+        days) where all resources are free for `duration_minutes` inside the window
+        returned by `hours(day)` (None for days without service). Starts are aligned to
+        `step_minutes` from the opening of the window. Days are computed lazily.
+        """
+        step = max(1, step_minutes // SLOT_MINUTES)
+        day = after.date()
+        for _ in range(horizon_days):
+            window = hours(day)
+            if window is not None:
+                runs = self.free_starts(keys, day, duration_minutes, window, not_before=after)
+                if runs and step > 1:
+                    runs &= _grid(-(-window[0] // SLOT_MINUTES), step)
+                midnight = datetime.combine(day, datetime.min.time())
+                while runs:
+                    lowest = runs & -runs
+                    yield midnight + timedelta(minutes=(lowest.bit_length() - 1) * SLOT_MINUTES)
+                    runs ^= lowest
+            day += timedelta(days=1)
+
+    async def load(self, db: aiosqlite.Connection, appointment_ids: Optional[Sequence[int]] = None,
+                   batch_size: int = 10000) -> int:
+        """
+        Loads active appointments from today on (or only the given ids) into the index.
+        Returns how many were loaded.
+        """
+        started = time.perf_counter()
+        query = """
+            SELECT id_medico, id_local, id_exame, data_hora_inicio, data_hora_fim
+            FROM Agendamentos
+            WHERE status = 'agendado'
+        """
+        if appointment_ids is not None:
+            if not appointment_ids:
+                return 0
+            query += f" AND id_agendamento IN ({','.join('?' * len(appointment_ids))})"
+            params = tuple(appointment_ids)
+        else:
+            query += " AND data_hora_fim >= ?"
+            params = (to_epoch(datetime.combine(date.today(), datetime.min.time())),)
+
+        loaded = 0
+        async with db.execute(query, params) as cursor:
+            while rows := await cursor.fetchmany(batch_size):
+                with self._lock:
+                    for id_medico, id_local, id_exame, inicio, fim in rows:
+                        self._add(self.resources_for(id_medico, id_local, id_exame), _parse(inicio), _parse(fim))
+                loaded += len(rows)
+
+        if appointment_ids is None:
+            self.loaded_appointments = loaded
+            self.load_seconds = time.perf_counter() - started
+            logging.info(f"Availability index loaded with {loaded} appointments in {self.load_seconds:.2f}s")
+        return loaded
+
+    def metrics(self) -> dict:
+        return {
+            "resources": len(self._resources),
+            "resource_days": sum(len(days) for days in self._resources.values()),
+            "loaded_appointments": self.loaded_appointments,
+            "load_seconds": round(self.load_seconds, 3),
+        }
+
+
+async def run_availability_pruner(index: AvailabilityIndex, interval_seconds: int):
+    """Tarefa de fundo que descarta do índice os dias que já passaram."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            dropped = index.prune()
+            if dropped:
+                logging.info(f"🧹 {dropped} dias passados removidos do índice de disponibilidade")
+        except Exception as e:
+            logging.error(f"Erro ao podar o índice de disponibilidade: {e}")
+
+
+# Global availability index
+availability_index = AvailabilityIndex()
@@ -1,9 +1,58 @@
 """
 Service layer for the booking process.
 """
+import logging
 import aiosqlite
-from typing import List
+from datetime import datetime, time, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from src.config.settings import settings
+from src.database.codecs import cpf_digits, decode_appointment, to_epoch
 from src.database.models.schemas import AgendamentoCreate, AgendamentoResponse, MedicoResponse, EspecialidadeResponse, LocalAtendimentoResponse, TipoConsultaResponse, ExameResponse
+from src.database.models.schemas import CanalAgendamentoEnum, PacienteCreate, SexoEnum, StatusAgendamentoEnum
+from src.services.patient_service import upsert_patient, add_patient_contacts
+from src.services.availability_service import availability_index
+from src.services.catalog_service import catalog_service
+from src.services.doctor_assignment import doctor_assigner
+from src.services.notification_service import enqueue_appointment_message, outbox_dispatcher
+from src.services.slot_search import DEFAULT_CONSULTATION_TYPE, find_candidates, find_exam, find_location
+
+
+class BookingValidationError(ValueError):
+    """Raised when the collected booking data is incomplete or invalid."""
+
+
+class SlotUnavailableError(BookingValidationError):
+    """Raised when the requested interval overlaps an active appointment of the same doctor or exam room."""
+
+
+# Overlap checks. The lower bound on data_hora_inicio (start minus the longest accepted
+# appointment) keeps them bounded range scans on the (resource, data_hora_inicio) indexes
+# instead of reading every earlier appointment of the resource. The last parameter is an
+# appointment to ignore (the one being rescheduled; 0 for new bookings). Times are bound as
+# epoch seconds, the storage format of the Agendamentos columns (see src/database/codecs.py).
+# `+status` keeps the patient and exam-room checks off the (status, data_hora_inicio)
+# index; the doctor check keeps the plain term so the partial unique index applies.
+DOCTOR_OVERLAP_SQL = """
+    SELECT id_agendamento FROM Agendamentos
+    WHERE id_medico = ? AND status = 'agendado'
+      AND data_hora_inicio > ? AND data_hora_inicio < ? AND data_hora_fim > ?
+      AND id_agendamento != ?
+    LIMIT 1
+"""
+PATIENT_OVERLAP_SQL = """
+    SELECT id_agendamento FROM Agendamentos
+    WHERE id_paciente = ? AND +status = 'agendado'
+      AND data_hora_inicio > ? AND data_hora_inicio < ? AND data_hora_fim > ?
+      AND id_agendamento != ?
+    LIMIT 1
+"""
+EXAM_ROOM_OVERLAP_SQL = """
+    SELECT id_agendamento FROM Agendamentos
+    WHERE id_local = ? AND id_exame = ? AND +status = 'agendado'
+      AND data_hora_inicio > ? AND data_hora_inicio < ? AND data_hora_fim > ?
+      AND id_agendamento != ?
+    LIMIT 1
+"""
 
 # Since these are fixed, we can query them once and potentially cache them.
 
@@ -32,21 +81,631 @@ async def get_all_exams(db: aiosqlite.Connection) -> List[ExameResponse]:
     rows = await cursor.fetchall()
     return [ExameResponse(**dict(row)) for row in rows]
 
-async def create_appointment(db: aiosqlite.Connection, appt: AgendamentoCreate) -> AgendamentoResponse:
-    """Creates a new appointment in the database."""
-    cursor = await db.execute(
+async def get_duration_minutes(db: aiosqlite.Connection, id_tipo_consulta: Optional[int], id_exame: Optional[int]) -> int:
+    """Default duration of the consultation type or exam, falling back to `appointment_default_minutes`."""
+    if id_exame is not None:
+        query, key = "SELECT duracao_padrao_minutos FROM Exames WHERE id_exame = ?", id_exame
+    elif id_tipo_consulta is not None:
+        query, key = "SELECT duracao_padrao_minutos FROM Tipos_Consulta WHERE id_tipo_consulta = ?", id_tipo_consulta
+    else:
+        return settings.appointment_default_minutes
+    async with db.execute(query, (key,)) as cursor:
+        row = await cursor.fetchone()
+    return row[0] if row and row[0] else settings.appointment_default_minutes
+
+
+def _overlap_bounds(start: datetime, end: datetime) -> Tuple[int, int, int]:
+    """Parameters of the overlap queries: lowest start that can still overlap, end, start."""
+    lower = start - timedelta(minutes=settings.appointment_max_minutes)
+    return to_epoch(lower), to_epoch(end), to_epoch(start)
+
+
+def _appointment(row) -> AgendamentoResponse:
+    return AgendamentoResponse(**decode_appointment(dict(row)))
+
+
+async def find_overlap(db: aiosqlite.Connection, id_medico: Optional[int], id_local: Optional[int],
+                       id_exame: Optional[int], start: datetime, end: datetime, exclude_id: int = 0) -> Optional[int]:
+    """Id of an active appointment (other than `exclude_id`) overlapping [start, end) on the same doctor or exam room."""
+    interval = _overlap_bounds(start, end)
+    checks = []
+    if id_medico is not None:
+        checks.append((DOCTOR_OVERLAP_SQL, (id_medico, *interval, exclude_id)))
+    if id_exame is not None and id_local is not None:
+        checks.append((EXAM_ROOM_OVERLAP_SQL, (id_local, id_exame, *interval, exclude_id)))
+    for query, params in checks:
+        async with db.execute(query, params) as cursor:
+            row = await cursor.fetchone()
+        if row:
+            return row[0]
+    return None
+
+
+async def find_patient_overlap(db: aiosqlite.Connection, patient_id: int, start: datetime, end: datetime,
+                               exclude_id: int = 0) -> Optional[int]:
+    """Id of an active appointment of the patient (other than `exclude_id`) overlapping [start, end), if any."""
+    async with db.execute(PATIENT_OVERLAP_SQL, (patient_id, *_overlap_bounds(start, end), exclude_id)) as cursor:
+        row = await cursor.fetchone()
+    return row[0] if row else None
+
+
+def check_interval(start: datetime, end: datetime):
+    """Rejects empty intervals and appointments longer than the overlap checks can see."""
+    if end <= start:
+        raise BookingValidationError("O horário de término deve ser posterior ao de início")
+    if end - start > timedelta(minutes=settings.appointment_max_minutes):
+        raise BookingValidationError(
+            f"A duração máxima de um agendamento é de {settings.appointment_max_minutes} minutos"
+        )
+
+
+async def begin_booking(db: aiosqlite.Connection):
+    """
+    Opens the booking transaction with the write lock taken (BEGIN IMMEDIATE, as pdf_bulk
+    does), so no other connection can write an overlapping appointment between the overlap
+    checks and the INSERT. A transaction the caller already opened is kept.
+    """
+    if not db.in_transaction:
+        await db.execute("BEGIN IMMEDIATE")
+
+
+async def ensure_slot_free(db: aiosqlite.Connection, id_medico: Optional[int], id_local: Optional[int],
+                           id_exame: Optional[int], start: datetime, end: datetime, exclude_id: int = 0):
+    """
+    Raises SlotUnavailableError when the interval is taken. The in-memory index answers
+    first; the SQL check covers appointments written by other processes.
+    """
+    check_interval(start, end)
+    resources = availability_index.resources_for(id_medico, id_local, id_exame)
+    if not availability_index.is_free(resources, start, end) \
+            or await find_overlap(db, id_medico, id_local, id_exame, start, end, exclude_id) is not None:
+        raise SlotUnavailableError(f"Horário indisponível: {start:%d/%m/%Y %H:%M} já está ocupado")
+
+
+async def create_appointment(db: aiosqlite.Connection, appt: AgendamentoCreate, commit: bool = True,
+                             canal: str = CanalAgendamentoEnum.API.value,
+                             reservations: Optional[list] = None) -> AgendamentoResponse:
+    """
+    Creates a new appointment in the database. Raises BookingValidationError for invalid or taken slots.
+    A consultation without `id_especialidade` gets the doctor's specialty when the doctor has only one.
+    With commit=False the slot added to the availability index is appended to
+    `reservations`, as in book_from_conversation.
+    """
+    await begin_booking(db)
+    try:
+        await ensure_slot_free(db, appt.id_medico, appt.id_local, appt.id_exame, appt.data_hora_inicio,
+                               appt.data_hora_fim)
+        if await find_patient_overlap(db, appt.id_paciente, appt.data_hora_inicio, appt.data_hora_fim) is not None:
+            raise SlotUnavailableError(f"O paciente já tem um agendamento em {appt.data_hora_inicio:%d/%m/%Y %H:%M}")
+        cursor = await db.execute(
+            """
+            INSERT INTO Agendamentos (id_paciente, id_local, id_convenio, id_tipo_consulta, id_exame, id_medico,
+                                      id_especialidade, canal, data_hora_inicio, data_hora_fim, status, observacoes)
+            VALUES (?, ?, ?, ?, ?, ?,
+                    COALESCE(?, (SELECT MIN(id_especialidade) FROM Medico_Especialidades WHERE id_medico = ? HAVING COUNT(*) = 1)),
+                    ?, ?, ?, ?, ?)
+            RETURNING *
+            """,
+            (appt.id_paciente, appt.id_local, appt.id_convenio, appt.id_tipo_consulta, appt.id_exame, appt.id_medico,
+             appt.id_especialidade, appt.id_medico if appt.id_tipo_consulta is not None else None, canal,
+             to_epoch(appt.data_hora_inicio), to_epoch(appt.data_hora_fim), appt.status.value, appt.observacoes)
+        )
+        # RETURNING gives back the full row (defaults included) without a second query
+        new_appt_row = await cursor.fetchone()
+        await enqueue_appointment_message(db, new_appt_row["id_agendamento"], "confirmacao")
+        if commit:
+            await db.commit()
+            outbox_dispatcher.wake()
+    except Exception:
+        if commit:
+            await db.rollback()
+        raise
+
+    resources = availability_index.resources_for(appt.id_medico, appt.id_local, appt.id_exame)
+    availability_index.add(resources, appt.data_hora_inicio, appt.data_hora_fim)
+    if reservations is not None:
+        reservations.append((resources, appt.data_hora_inicio, appt.data_hora_fim))
+    return _appointment(new_appt_row)
+
+
+async def get_appointment(db: aiosqlite.Connection, appointment_id: int) -> Optional[AgendamentoResponse]:
+    async with db.execute("SELECT * FROM Agendamentos WHERE id_agendamento = ?", (appointment_id,)) as cursor:
+        row = await cursor.fetchone()
+    return _appointment(row) if row else None
+
+
+def _inactive_error(appointment: AgendamentoResponse) -> BookingValidationError:
+    """Error for acting on an appointment that is no longer active."""
+    return BookingValidationError(
+        f"O agendamento {appointment.id_agendamento} não está ativo (status: {appointment.status.value})"
+    )
+
+
+async def cancel_appointment(db: aiosqlite.Connection, appointment_id: int, motivo: Optional[str] = None,
+                             commit: bool = True) -> Optional[AgendamentoResponse]:
+    """
+    Cancels an active appointment, and the waitlist requests to bring it forward, in one
+    transaction, then frees its slot in the availability index. Returns None when the
+    appointment does not exist; raises BookingValidationError when it is not active.
+    """
+    try:
+        cursor = await db.execute(
+            """
+            UPDATE Agendamentos
+            SET status = ?, observacoes = COALESCE(observacoes || ' | ', '') || ?
+            WHERE id_agendamento = ? AND status = ?
+            RETURNING *
+            """,
+            (StatusAgendamentoEnum.CANCELADO.value, f"Cancelado: {motivo or 'motivo não informado'}",
+             appointment_id, StatusAgendamentoEnum.AGENDADO.value)
+        )
+        row = await cursor.fetchone()
+        if row is None:
+            appointment = await get_appointment(db, appointment_id)
+            if appointment is None:
+                return None
+            raise _inactive_error(appointment)
+        await db.execute(
+            "UPDATE Lista_Espera SET status = 'cancelado' WHERE id_agendamento = ? AND status IN ('aguardando', 'ofertado')",
+            (appointment_id,)
+        )
+        await enqueue_appointment_message(db, appointment_id, "cancelamento", {"motivo": motivo})
+        if commit:
+            await db.commit()
+            outbox_dispatcher.wake()
+    except Exception:
+        if commit:
+            await db.rollback()
+        raise
+
+    appointment = _appointment(row)
+    availability_index.remove(
+        availability_index.resources_for(appointment.id_medico, appointment.id_local, appointment.id_exame),
+        appointment.data_hora_inicio, appointment.data_hora_fim
+    )
+    return appointment
+
+
+async def ensure_doctor_eligible(db: aiosqlite.Connection, id_medico: int, appointment: AgendamentoResponse,
+                                 start: datetime, end: datetime):
+    """
+    Raises BookingValidationError unless `id_medico` exists, practices the appointment's
+    specialty (for a consultation without one, a specialty of its current doctor), accepts
+    its insurance plan and works at its location at that weekday and time (Medico_Locais;
+    a doctor without rows works anywhere, as in slot_search).
+    """
+    async with db.execute("SELECT 1 FROM Medicos WHERE id_medico = ?", (id_medico,)) as cursor:
+        if await cursor.fetchone() is None:
+            raise BookingValidationError(f"Médico {id_medico} não encontrado")
+    if appointment.id_especialidade is not None:
+        specialty_sql = "SELECT 1 FROM Medico_Especialidades WHERE id_medico = ? AND id_especialidade = ?"
+        specialty_params = (id_medico, appointment.id_especialidade)
+    else:
+        # Consultation booked without specialty: one of the current doctor's
+        specialty_sql = """
+            SELECT 1 FROM Medico_Especialidades n
+            JOIN Medico_Especialidades o ON o.id_especialidade = n.id_especialidade AND o.id_medico = ?
+            WHERE n.id_medico = ?
+        """
+        specialty_params = (appointment.id_medico, id_medico)
+    if appointment.id_tipo_consulta is not None or appointment.id_especialidade is not None:
+        async with db.execute(specialty_sql, specialty_params) as cursor:
+            if await cursor.fetchone() is None:
+                raise BookingValidationError(f"O médico {id_medico} não atende a especialidade do agendamento")
+    if appointment.id_convenio is not None:
+        async with db.execute(
+            """
+            SELECT 1 FROM Convenios c
+            WHERE c.id_convenio = ? AND (lower(c.nome) = 'particular' OR EXISTS (
+                SELECT 1 FROM Medico_Convenios mc WHERE mc.id_medico = ? AND mc.id_convenio = c.id_convenio))
+            """,
+            (appointment.id_convenio, id_medico)
+        ) as cursor:
+            if await cursor.fetchone() is None:
+                raise BookingValidationError(f"O médico {id_medico} não atende o convênio do agendamento")
+    async with db.execute(
         """
-        INSERT INTO Agendamentos (id_paciente, id_local, id_convenio, id_tipo_consulta, id_exame, id_medico, 
-                                  data_hora_inicio, data_hora_fim, status, observacoes)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        SELECT NOT EXISTS (SELECT 1 FROM Medico_Locais WHERE id_medico = ?)
+            OR EXISTS (SELECT 1 FROM Medico_Locais
+                       WHERE id_medico = ? AND id_local = ? AND dia_semana = ? AND hora_inicio <= ? AND hora_fim >= ?)
         """,
-        (appt.id_paciente, appt.id_local, appt.id_convenio, appt.id_tipo_consulta, appt.id_exame, appt.id_medico,
-         appt.data_hora_inicio, appt.data_hora_fim, appt.status.value, appt.observacoes)
+        (id_medico, id_medico, appointment.id_local, start.weekday(), f"{start:%H:%M}", f"{end:%H:%M}")
+    ) as cursor:
+        if not (await cursor.fetchone())[0]:
+            raise BookingValidationError(
+                f"O médico {id_medico} não atende no local {appointment.id_local} em {start:%d/%m/%Y %H:%M}"
+            )
+
+
+async def reschedule_appointment(db: aiosqlite.Connection, appointment_id: int, new_start: datetime,
+                                 id_medico: Optional[int] = None, commit: bool = True,
+                                 reservations: Optional[list] = None, releases: Optional[list] = None
+                                 ) -> Optional[Tuple[AgendamentoResponse, AgendamentoResponse]]:
+    """
+    Moves an active appointment to `new_start`, keeping its duration (and, unless `id_medico`
+    is given, its doctor), in one transaction. Returns (previous, updated), or None when the
+    appointment does not exist. Raises SlotUnavailableError when the new slot is taken and
+    BookingValidationError when the new doctor cannot take the appointment.
+
+    With commit=False the new interval added to the availability index is appended to
+    `reservations` and the old one removed from it to `releases`, so a caller whose
+    transaction is rolled back can put the index back.
+    """
+    new_start = new_start.replace(tzinfo=None)
+    # The appointment is read and the index changed only with the write lock held
+    await begin_booking(db)
+    released = None
+    try:
+        previous = await get_appointment(db, appointment_id)
+        if previous is None:
+            if commit:
+                await db.rollback()
+            return None
+        if previous.status != StatusAgendamentoEnum.AGENDADO:
+            raise _inactive_error(previous)
+
+        new_end = new_start + (previous.data_hora_fim - previous.data_hora_inicio)
+        doctor_id = id_medico if id_medico is not None else previous.id_medico
+        if doctor_id != previous.id_medico:
+            await ensure_doctor_eligible(db, doctor_id, previous, new_start, new_end)
+        old_resources = availability_index.resources_for(previous.id_medico, previous.id_local, previous.id_exame)
+        new_resources = availability_index.resources_for(doctor_id, previous.id_local, previous.id_exame)
+
+        # The appointment must not conflict with itself: its interval leaves the index during the checks
+        released = (old_resources, previous.data_hora_inicio, previous.data_hora_fim)
+        availability_index.remove(*released)
+        await ensure_slot_free(db, doctor_id, previous.id_local, previous.id_exame, new_start, new_end,
+                               exclude_id=appointment_id)
+        if await find_patient_overlap(db, previous.id_paciente, new_start, new_end, exclude_id=appointment_id) is not None:
+            raise SlotUnavailableError(f"O paciente já tem um agendamento em {new_start:%d/%m/%Y %H:%M}")
+        # A consultation without specialty takes the new doctor's when it has only one, as in create_appointment
+        cursor = await db.execute(
+            """
+            UPDATE Agendamentos
+            SET id_medico = ?, data_hora_inicio = ?, data_hora_fim = ?,
+                id_especialidade = COALESCE(id_especialidade, (SELECT MIN(id_especialidade) FROM Medico_Especialidades
+                                                               WHERE id_medico = ? HAVING COUNT(*) = 1)),
+                observacoes = COALESCE(observacoes || ' | ', '') || ?
+            WHERE id_agendamento = ?
+            RETURNING *
+            """,
+            (doctor_id, to_epoch(new_start), to_epoch(new_end),
+             doctor_id if previous.id_tipo_consulta is not None else None,
+             f"Remarcado de {previous.data_hora_inicio:%d/%m/%Y %H:%M}", appointment_id)
+        )
+        row = await cursor.fetchone()
+        await enqueue_appointment_message(db, appointment_id, "remarcacao", {"anterior": previous.data_hora_inicio})
+        if commit:
+            await db.commit()
+            outbox_dispatcher.wake()
+    except Exception:
+        if commit:
+            await db.rollback()
+        if released is not None:
+            availability_index.add(*released)
+        raise
+
+    availability_index.add(new_resources, new_start, new_end)
+    if reservations is not None:
+        reservations.append((new_resources, new_start, new_end))
+    if releases is not None:
+        releases.append(released)
+    return previous, _appointment(row)
+
+
+# Período de preferência -> (hora padrão de início, fim do período em minutos)
+PERIODS = {
+    "manhã": (9, 12 * 60), "manha": (9, 12 * 60),
+    "tarde": (14, 18 * 60),
+    "noite": (19, 22 * 60),
+}
+
+
+def preferred_window(start: datetime, horario_preferencia: Optional[str], duration_minutes: int) -> Tuple[int, int]:
+    """
+    Window (start, end minute of the day) the appointment may take: the rest of the period
+    for "manhã"/"tarde"/"noite", or exactly the requested interval otherwise.
+    """
+    first = start.hour * 60 + start.minute
+    period = PERIODS.get(str(horario_preferencia or "").lower())
+    if period is not None:
+        return first, max(period[1], first + duration_minutes)
+    return first, first + duration_minutes
+
+
+def preferred_start(data_preferencia: str, horario_preferencia: Optional[str]) -> datetime:
+    """
+    Start of the appointment from the collected preferences: the date (YYYY-MM-DD) plus an
+    exact "HH:MM" or a period ("manhã", "tarde", "noite"); 09:00 when the time is missing or invalid.
+    """
+    horario_preferencia = horario_preferencia or "09:00"  # Default se for None
+
+    # Converte horário para time object
+    try:
+        if ":" in str(horario_preferencia):
+            hora, minuto = map(int, str(horario_preferencia).split(":"))
+        else:
+            # Se for texto como "manhã", "tarde", usa horários padrão
+            hora = PERIODS.get(str(horario_preferencia).lower(), (9, None))[0]
+            minuto = 0
+
+        hora_inicio = time(hora, minuto)
+
+    except (ValueError, TypeError):
+        # Horário padrão se houver erro
+        hora_inicio = time(9, 0)
+
+    return datetime.strptime(data_preferencia, "%Y-%m-%d").replace(hour=hora_inicio.hour, minute=hora_inicio.minute)
+
+
+async def book_from_conversation(db: aiosqlite.Connection, extracted_data: Dict[str, Any], commit: bool = True,
+                                 reservations: Optional[list] = None,
+                                 canal: str = CanalAgendamentoEnum.CHAT.value,
+                                 assignments: Optional[list] = None) -> Dict[str, Any]:
+    """
+    Creates the patient (if new) and the appointment described by the chatbot/PDF
+    `conversation_data` structure. Returns the appointment summary shown to the user.
+
+    With commit=False nothing is committed, so callers can group many bookings in one
+    transaction. The availability index is still updated right away; the (resources,
+    start, end) added are appended to `reservations` so the caller can remove them if
+    its transaction is rolled back, and the doctor picked by `doctor_assigner` to
+    `assignments`, for the caller to confirm once it commits. Raises
+    BookingValidationError when required data is missing or the slot is taken. `canal`
+    records where the booking came from.
+    """
+    paciente_data = extracted_data.get("paciente", {})
+    contato_data = extracted_data.get("contato", {})
+    agendamento_data = extracted_data.get("agendamento_info", {})
+    preferencias_data = extracted_data.get("preferencias", {})
+
+    # Validação dos dados obrigatórios
+    required_patient_fields = ["nome", "cpf", "data_nascimento", "sexo"]
+    for field in required_patient_fields:
+        if not paciente_data.get(field):
+            raise BookingValidationError(f"Campo obrigatório ausente: paciente.{field}")
+
+    # Validação dos dados de agendamento
+    if not preferencias_data.get("data_preferencia"):
+        raise BookingValidationError("Data de preferência é obrigatória")
+
+    # Converte sexo para enum
+    sexo_map = {"M": SexoEnum.MASCULINO, "F": SexoEnum.FEMININO, "O": SexoEnum.OUTRO}
+    sexo_enum = sexo_map.get(paciente_data["sexo"])
+    if not sexo_enum:
+        raise BookingValidationError(f"Sexo inválido: {paciente_data['sexo']}")
+
+    # Aceita o CPF com ou sem máscara; o banco guarda os 11 dígitos como inteiro
+    try:
+        cpf = cpf_digits(paciente_data["cpf"])
+    except ValueError:
+        raise BookingValidationError(f"CPF inválido: {paciente_data['cpf']}")
+
+    patient_create = PacienteCreate(
+        nome=paciente_data["nome"],
+        cpf=cpf,
+        data_nascimento=paciente_data["data_nascimento"],
+        sexo=sexo_enum
     )
-    await db.commit()
-    appt_id = cursor.lastrowid
-    
-    # Fetch the created record to return the full object
-    cursor = await db.execute("SELECT * FROM Agendamentos WHERE id_agendamento = ?", (appt_id,))
-    new_appt_row = await cursor.fetchone()
-    return AgendamentoResponse(**dict(new_appt_row))
+
+    # Processa data e horário do agendamento; o término depende da duração do tipo de consulta ou exame
+    data_inicio = preferred_start(preferencias_data["data_preferencia"], preferencias_data.get("horario_preferencia"))
+
+    # Para consultas: seleciona médico baseado na especialidade
+    # Para exames: busca o exame pelo nome
+    especialidade_solicitada = agendamento_data.get("especialidade", "")
+    nome_exame_solicitado = agendamento_data.get("nome_exame", "")
+    selected_doctor_id = None
+    selected_doctor_name = "Aguardando confirmação"
+    # Médico escolhido por doctor_assigner, contado só depois do commit
+    assigned_doctor_id = None
+    selected_exam_id = None
+    selected_location_id = None
+    duracao_minutos = None
+    snapshot = catalog_service.snapshot
+
+    # Convênio e local informados pelo paciente, resolvidos pelos nomes normalizados do catálogo
+    # (id_convenio fica nulo para atendimento particular, como no schema)
+    convenio = agendamento_data.get("convenio")
+    id_convenio = None if snapshot.eligibility.is_private(convenio) else snapshot.eligibility.resolve(convenio)
+    if id_convenio is None and not snapshot.eligibility.is_private(convenio):
+        # Sem isso o filtro de elegibilidade recusaria todos os médicos ("não atende o convênio")
+        logging.warning(f"Convênio não cadastrado: {convenio}")
+        raise BookingValidationError(
+            f"Convênio não reconhecido: {convenio}. Convênios aceitos: {', '.join(snapshot.options['insurances'])}"
+        )
+    requested_location_id = find_location(snapshot, agendamento_data.get("local"))
+
+    if agendamento_data.get("tipo") == "consulta" and especialidade_solicitada \
+            and especialidade_solicitada.lower() in snapshot.specialty_doctors:
+        # Médico escolhido pela estratégia de distribuição, só entre os que atendem o convênio no local pedido
+        duracao_minutos = await get_duration_minutes(db, DEFAULT_CONSULTATION_TYPE, None)
+        _, candidates = find_candidates(snapshot, "consulta", especialidade_solicitada, convenio, requested_location_id)
+        if not candidates and requested_location_id is not None:
+            # Local pedido sem médico da especialidade (ex.: local impresso na guia): usa os demais locais
+            logging.warning(f"Nenhum médico de {especialidade_solicitada} atende em {agendamento_data.get('local')}; "
+                            f"buscando em todos os locais")
+            _, candidates = find_candidates(snapshot, "consulta", especialidade_solicitada, convenio)
+        if not candidates:
+            raise BookingValidationError(
+                f"Nenhum médico de {especialidade_solicitada} atende o convênio {convenio}"
+            )
+        # O médico escolhido entre os horários alternativos do chatbot tem prioridade
+        chosen = [c for c in candidates if c.id_medico == agendamento_data.get("id_medico")]
+        assigned = doctor_assigner.assign(
+            especialidade_solicitada.lower(), chosen or candidates, data_inicio.date(),
+            preferred_window(data_inicio, preferencias_data.get("horario_preferencia"), duracao_minutos),
+            duracao_minutos
+        )
+        if assigned is None:
+            raise SlotUnavailableError(
+                f"Horário indisponível: nenhum médico de {especialidade_solicitada} livre em {data_inicio:%d/%m/%Y %H:%M}"
+            )
+        candidate, data_inicio = assigned
+        selected_doctor_id, selected_doctor_name = candidate.id_medico, candidate.nome_medico
+        assigned_doctor_id = selected_doctor_id
+        # Local onde o médico atende nesse dia da semana (Medico_Locais)
+        selected_location_id = candidate.id_local
+        logging.info(f"Médico atribuído ({doctor_assigner.strategy}): {selected_doctor_name} (ID: {selected_doctor_id}) "
+                     f"para {especialidade_solicitada} em {data_inicio:%d/%m/%Y %H:%M}")
+
+    elif agendamento_data.get("tipo") == "consulta" and especialidade_solicitada:
+        # Especialidade fora do catálogo em memória: busca direta no banco
+        try:
+            # Busca médicos que atendem a especialidade solicitada; o médico escolhido
+            # entre os horários alternativos do chatbot (agendamento_info.id_medico) vem primeiro
+            query = """
+            SELECT m.id_medico, m.nome 
+            FROM Medicos m
+            JOIN Medico_Especialidades me ON m.id_medico = me.id_medico
+            JOIN Especialidades e ON me.id_especialidade = e.id_especialidade
+            WHERE e.nome = ?
+            ORDER BY m.id_medico = ? DESC, m.id_medico
+            LIMIT 1
+            """
+
+            async with db.execute(query, (especialidade_solicitada, agendamento_data.get("id_medico"))) as cursor:
+                doctor_row = await cursor.fetchone()
+                if doctor_row:
+                    selected_doctor_id = doctor_row[0]
+                    selected_doctor_name = doctor_row[1]
+                    logging.info(f"Médico selecionado: {selected_doctor_name} (ID: {selected_doctor_id}) para especialidade: {especialidade_solicitada}")
+                else:
+                    logging.warning(f"Nenhum médico encontrado para a especialidade: {especialidade_solicitada}")
+
+        except Exception as e:
+            logging.error(f"Erro ao buscar médico por especialidade: {e}")
+
+    elif agendamento_data.get("tipo") == "exame" and nome_exame_solicitado:
+        try:
+            # Busca o exame pelo nome (busca mais flexível)
+            query = "SELECT id_exame, nome FROM Exames WHERE LOWER(nome) LIKE LOWER(?) LIMIT 1"
+
+            async with db.execute(query, (f"%{nome_exame_solicitado}%",)) as cursor:
+                exam_row = await cursor.fetchone()
+                if exam_row:
+                    selected_exam_id = exam_row[0]
+                    logging.info(f"Exame selecionado: {exam_row[1]} (ID: {selected_exam_id})")
+                else:
+                    # Tenta busca ainda mais flexível, palavra por palavra
+                    words = nome_exame_solicitado.lower().split()
+                    for word in words:
+                        if len(word) > 2:  # Ignora palavras muito pequenas
+                            query = "SELECT id_exame, nome FROM Exames WHERE LOWER(nome) LIKE LOWER(?) LIMIT 1"
+                            async with db.execute(query, (f"%{word}%",)) as cursor:
+                                exam_row = await cursor.fetchone()
+                                if exam_row:
+                                    selected_exam_id = exam_row[0]
+                                    logging.info(f"Exame encontrado por palavra-chave '{word}': {exam_row[1]} (ID: {selected_exam_id})")
+                                    break
+
+                    if not selected_exam_id:
+                        logging.warning(f"Nenhum exame encontrado com o nome: {nome_exame_solicitado}")
+
+        except Exception as e:
+            logging.error(f"Erro ao buscar exame: {e}")
+        if not selected_exam_id:
+            raise BookingValidationError(f"Exame não encontrado: {nome_exame_solicitado}")
+
+        # Sala do exame: no local pedido ou, sem local, no primeiro que realiza o exame e está livre
+        exam = find_exam(snapshot, nome_exame_solicitado)
+        if exam is not None and exam["id"] == selected_exam_id:
+            duracao_minutos, rooms = find_candidates(snapshot, "exame", exam["nome"], id_local=requested_location_id)
+            if not rooms:
+                logging.warning(f"O exame {exam['nome']} não é realizado em {agendamento_data.get('local')}; "
+                                f"buscando em todos os locais")
+                duracao_minutos, rooms = find_candidates(snapshot, "exame", exam["nome"])
+            if not rooms:
+                raise BookingValidationError(f"Nenhum local realiza o exame {exam['nome']}")
+            data_fim = data_inicio + timedelta(minutes=duracao_minutos)
+            room = next((r for r in rooms if availability_index.is_free(r.keys, data_inicio, data_fim)), rooms[0])
+            selected_location_id = room.id_local
+        else:
+            selected_location_id = requested_location_id
+
+    id_tipo_consulta = 1 if agendamento_data.get("tipo") == "consulta" else None
+    id_exame = selected_exam_id if agendamento_data.get("tipo") == "exame" else None
+    if agendamento_data.get("tipo") == "exame" and id_exame is None:
+        raise BookingValidationError("Exame não informado")
+    id_local = selected_location_id or requested_location_id
+    if id_local is None:
+        raise BookingValidationError(f"Local de atendimento não encontrado: {agendamento_data.get('local') or 'não informado'}")
+    if duracao_minutos is None:
+        duracao_minutos = await get_duration_minutes(db, id_tipo_consulta, id_exame)
+    data_fim = data_inicio + timedelta(minutes=duracao_minutos)
+    resources = availability_index.resources_for(selected_doctor_id, id_local, id_exame)
+
+    # Paciente, contatos e agendamento são gravados em uma única transação
+    try:
+        await begin_booking(db)
+        await ensure_slot_free(db, selected_doctor_id, id_local, id_exame, data_inicio, data_fim)
+        patient = await upsert_patient(db, patient_create, commit=False)
+        patient_id = patient.id_paciente
+        logging.info(f"Paciente {patient_id} (CPF {paciente_data['cpf']}) vinculado ao agendamento")
+        # Com vários médicos por especialidade, o mesmo pedido repetido iria para outro médico
+        if await find_patient_overlap(db, patient_id, data_inicio, data_fim) is not None:
+            raise SlotUnavailableError(f"O paciente já tem um agendamento em {data_inicio:%d/%m/%Y %H:%M}")
+
+        await add_patient_contacts(db, patient_id, contato_data)
+
+        # Cria o agendamento diretamente no banco sem usar o schema problemático
+        cursor = await db.execute(
+            """
+            INSERT INTO Agendamentos (id_paciente, id_local, id_convenio, id_tipo_consulta, id_exame, id_medico, 
+                                      id_especialidade, canal, data_hora_inicio, data_hora_fim, status, observacoes)
+            VALUES (?, ?, ?, ?, ?, ?, (SELECT id_especialidade FROM Especialidades WHERE nome = ? COLLATE NOCASE),
+                    ?, ?, ?, ?, ?)
+            RETURNING id_agendamento
+            """,
+            (patient_id, id_local, id_convenio, 
+             id_tipo_consulta,
+             id_exame, 
+             selected_doctor_id,
+             especialidade_solicitada if id_tipo_consulta is not None else None, canal,
+             to_epoch(data_inicio), to_epoch(data_fim), StatusAgendamentoEnum.AGENDADO.value,
+             f"Agendamento criado via chatbot. Tipo: {agendamento_data.get('tipo', 'N/A')}, Especialidade/Exame: {agendamento_data.get('especialidade', '')}{agendamento_data.get('nome_exame', '')}, Contato: {contato_data.get('telefone', 'N/A')}")
+        )
+        appointment_id = (await cursor.fetchone())[0]
+        # Confirmação por SMS/e-mail prometida na mensagem final; enviada em segundo plano
+        await enqueue_appointment_message(db, appointment_id, "confirmacao")
+        if commit:
+            await db.commit()
+            outbox_dispatcher.wake()
+            if assigned_doctor_id is not None:
+                doctor_assigner.confirm(assigned_doctor_id)
+        elif assignments is not None and assigned_doctor_id is not None:
+            assignments.append(assigned_doctor_id)
+        # Com commit=False o índice já é atualizado para que os próximos agendamentos da mesma
+        # transação vejam o horário ocupado; quem controla a transação desfaz via `reservations`
+        availability_index.add(resources, data_inicio, data_fim)
+        if reservations is not None:
+            reservations.append((resources, data_inicio, data_fim))
+    except Exception:
+        if commit:
+            await db.rollback()
+        raise
+
+    logging.info(f"Agendamento criado com sucesso - ID: {appointment_id}")
+
+    # Data e hora efetivas (o médico atribuído pode ter um horário livre mais tarde dentro do período pedido)
+    data_hora_str = f"{data_inicio:%Y-%m-%d} às {data_inicio:%H:%M}"
+
+    # Determina a especialidade ou exame e o nome do médico baseado no tipo
+    if agendamento_data.get("tipo") == "consulta":
+        especialidade_valor = agendamento_data.get("especialidade") or "Não informado"
+        medico_display = selected_doctor_name
+    else:  # exame
+        especialidade_valor = agendamento_data.get("nome_exame") or "Não informado"
+        medico_display = "Não aplicável (Exame)"
+
+    return {
+        "id_agendamento": appointment_id,
+        "nome_paciente": paciente_data.get("nome", "Não informado"),
+        "nome_medico": medico_display,
+        "especialidade": especialidade_valor,
+        "data_agendamento": data_hora_str,  # Enviando data e hora combinadas
+        "duracao_minutos": duracao_minutos,
+        "local": snapshot.locations_by_id.get(id_local, {}).get("nome") or agendamento_data.get("local", "Não informado"),
+        "convenio": agendamento_data.get("convenio", "Particular"),
+        "observacoes": "Agendamento criado via chatbot"
+    }
@@ -0,0 +1,190 @@
+"""
+In-memory, read-only snapshot of the booking catalog (specialties, exams, locations,
+which doctors and rooms can serve each of them, the plans each doctor accepts, and
+where and when each doctor works).
+
+The chatbot reads option lists on every turn; keeping them in a snapshot loaded through
+the async database layer removes all synchronous SQLite access from the chat hot path.
+"""
+import time
+import asyncio
+import logging
+import aiosqlite
+from typing import Dict, List, Optional, Tuple
+
+from src.config.settings import settings
+from src.database.connection import db_manager
+from src.services.eligibility import EligibilityIndex
+
+
+class CatalogSnapshot:
+    """Immutable view of the catalog at a given version."""
+
+    def __init__(self, version: int = 0, specialties: Optional[List[str]] = None,
+                 exams: Optional[List[str]] = None, locations: Optional[List[dict]] = None,
+                 exam_locations: Optional[Dict[str, List[int]]] = None,
+                 specialty_doctors: Optional[Dict[str, List[dict]]] = None,
+                 doctor_insurances: Optional[Dict[int, List[int]]] = None,
+                 exam_details: Optional[Dict[str, dict]] = None,
+                 consultation_durations: Optional[Dict[int, int]] = None,
+                 specialty_locations: Optional[Dict[str, List[int]]] = None,
+                 doctor_schedules: Optional[Dict[int, Dict[int, Dict[int, Tuple[int, int]]]]] = None,
+                 insurances: Optional[Dict[int, str]] = None):
+        self.version = version
+        self.specialties = specialties or []
+        self.exams = exams or []
+        self.locations = locations or []
+        # Lowercase exam name -> ids of the locations that perform it
+        self.exam_locations = exam_locations or {}
+        # Lowercase specialty name -> doctors ({"id", "nome"}) that practice it
+        self.specialty_doctors = specialty_doctors or {}
+        # Doctor id -> ids of the insurance plans it accepts
+        self.doctor_insurances = doctor_insurances or {}
+        # Lowercase exam name -> {"id", "nome", "duracao"}
+        self.exam_details = exam_details or {}
+        # Tipos_Consulta id -> default duration in minutes
+        self.consultation_durations = consultation_durations or {}
+        # Lowercase specialty name -> ids of the locations where one of its doctors works
+        self.specialty_locations = specialty_locations or {}
+        # Doctor id -> location id -> weekday (0 = Monday) -> (start, end minute of the day)
+        self.doctor_schedules = doctor_schedules or {}
+        # Convenios id -> name
+        self.insurances = insurances or {}
+        self.eligibility = EligibilityIndex(
+            self.insurances, self.doctor_insurances, self.specialty_doctors,
+            {doctor_id: schedule.keys() for doctor_id, schedule in self.doctor_schedules.items()}
+        )
+        self.locations_by_id = {loc["id"]: loc for loc in self.locations}
+        self.options = {
+            "specialties": self.specialties,
+            "exams": self.exams,
+            "locations": [loc["nome"] for loc in self.locations],
+            "insurances": sorted(self.insurances.values()),
+        }
+
+    def content(self) -> tuple:
+        return (self.specialties, self.exams, self.locations, self.exam_locations, self.specialty_doctors,
+                self.doctor_insurances, self.exam_details, self.consultation_durations, self.specialty_locations,
+                self.doctor_schedules, self.insurances)
+
+
+def minutes_of_day(value: str) -> int:
+    """'HH:MM' -> minutes since midnight."""
+    hours, minutes = value.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+async def load_catalog(db: aiosqlite.Connection, version: int) -> CatalogSnapshot:
+    """Reads the whole catalog in a handful of queries."""
+    async with db.execute("SELECT nome FROM Especialidades ORDER BY nome") as cursor:
+        specialties = [row[0] for row in await cursor.fetchall()]
+    async with db.execute("SELECT nome FROM Exames ORDER BY nome") as cursor:
+        exams = [row[0] for row in await cursor.fetchall()]
+    async with db.execute("SELECT id_local, nome, endereco FROM Locais_Atendimento ORDER BY nome") as cursor:
+        locations = [{"id": row[0], "nome": row[1], "endereco": row[2]} for row in await cursor.fetchall()]
+
+    exam_locations: Dict[str, List[int]] = {}
+    async with db.execute(
+        """
+        SELECT e.nome, le.id_local
+        FROM Local_Exames le
+        JOIN Exames e ON le.id_exame = e.id_exame
+        """
+    ) as cursor:
+        for exam_name, location_id in await cursor.fetchall():
+            exam_locations.setdefault(exam_name.lower(), []).append(location_id)
+
+    specialty_doctors: Dict[str, List[dict]] = {}
+    async with db.execute(
+        """
+        SELECT e.nome, m.id_medico, m.nome
+        FROM Medico_Especialidades me
+        JOIN Medicos m ON me.id_medico = m.id_medico
+        JOIN Especialidades e ON me.id_especialidade = e.id_especialidade
+        ORDER BY m.id_medico
+        """
+    ) as cursor:
+        for specialty, doctor_id, doctor_name in await cursor.fetchall():
+            specialty_doctors.setdefault(specialty.lower(), []).append({"id": doctor_id, "nome": doctor_name})
+
+    async with db.execute("SELECT id_convenio, nome FROM Convenios") as cursor:
+        insurances = {row[0]: row[1] for row in await cursor.fetchall()}
+    doctor_insurances: Dict[int, List[int]] = {}
+    async with db.execute("SELECT id_medico, id_convenio FROM Medico_Convenios ORDER BY id_medico, id_convenio") as cursor:
+        for doctor_id, insurance_id in await cursor.fetchall():
+            doctor_insurances.setdefault(doctor_id, []).append(insurance_id)
+
+    async with db.execute("SELECT id_exame, nome, duracao_padrao_minutos FROM Exames") as cursor:
+        exam_details = {row[1].lower(): {"id": row[0], "nome": row[1], "duracao": row[2]}
+                        for row in await cursor.fetchall()}
+    async with db.execute("SELECT id_tipo_consulta, duracao_padrao_minutos FROM Tipos_Consulta") as cursor:
+        consultation_durations = {row[0]: row[1] for row in await cursor.fetchall()}
+
+    # Served by idx_medico_especialidades_especialidade and the Medico_Locais primary key
+    specialty_locations: Dict[str, List[int]] = {}
+    async with db.execute(
+        """
+        SELECT DISTINCT e.nome, ml.id_local
+        FROM Especialidades e
+        JOIN Medico_Especialidades me ON me.id_especialidade = e.id_especialidade
+        JOIN Medico_Locais ml ON ml.id_medico = me.id_medico
+        ORDER BY e.nome, ml.id_local
+        """
+    ) as cursor:
+        for specialty, location_id in await cursor.fetchall():
+            specialty_locations.setdefault(specialty.lower(), []).append(location_id)
+
+    doctor_schedules: Dict[int, Dict[int, Dict[int, Tuple[int, int]]]] = {}
+    async with db.execute(
+        "SELECT id_medico, id_local, dia_semana, hora_inicio, hora_fim FROM Medico_Locais ORDER BY id_medico, id_local"
+    ) as cursor:
+        for doctor_id, location_id, weekday, start, end in await cursor.fetchall():
+            doctor_schedules.setdefault(doctor_id, {}).setdefault(location_id, {})[weekday] = (
+                minutes_of_day(start), minutes_of_day(end)
+            )
+
+    return CatalogSnapshot(version, specialties, exams, locations, exam_locations, specialty_doctors,
+                           doctor_insurances, exam_details, consultation_durations, specialty_locations,
+                           doctor_schedules, insurances)
+
+
+class CatalogService:
+    """Holds the current snapshot and refreshes it periodically."""
+
+    def __init__(self):
+        self.snapshot = CatalogSnapshot()
+        self._loaded_at = 0.0
+        self._refresh_lock = asyncio.Lock()
+
+    @property
+    def version(self) -> int:
+        return self.snapshot.version
+
+    async def refresh(self, db: Optional[aiosqlite.Connection] = None) -> CatalogSnapshot:
+        """Reloads the catalog; the version only changes when the content changed."""
+        async with self._refresh_lock:
+            conn = db or await db_manager.get_connection()
+            try:
+                snapshot = await load_catalog(conn, self.snapshot.version + 1)
+            finally:
+                if db is None:
+                    await conn.close()
+            if snapshot.content() != self.snapshot.content():
+                self.snapshot = snapshot
+                logging.info(f"Catalog snapshot loaded (version {snapshot.version})")
+            self._loaded_at = time.monotonic()
+            return self.snapshot
+
+    async def ensure_fresh(self, db: Optional[aiosqlite.Connection] = None) -> CatalogSnapshot:
+        """Refreshes the snapshot if it is older than `catalog_refresh_seconds`."""
+        if time.monotonic() - self._loaded_at > settings.catalog_refresh_seconds:
+            try:
+                await self.refresh(db)
+            except Exception as e:
+                logging.error(f"Error refreshing catalog snapshot, keeping version {self.version}: {e}")
+                self._loaded_at = time.monotonic()
+        return self.snapshot
+
+
+# Global catalog instance
+catalog_service = CatalogService()
@@ -0,0 +1,276 @@
+"""
+Event log of chatbot conversations and the funnel computed from it.
+
+`FlowManager` records one event per conversation started, per turn answered (state
+before and after, whether the answer was resolved locally, from the extractor's cache or
+by the LLM, whether it was accepted, and how long the turn took) and per conversation
+abandoned (evicted by idleness or capacity before reaching a terminal state). Recording
+only appends a tuple to an in-memory buffer under a lock, since turns run in worker
+threads; a background task writes the buffer to the append-only `Eventos_Conversa`
+table in one transaction every `conversation_event_flush_seconds`.
+
+`FunnelAggregator` tails that table by primary key, page by page, and folds each event
+into per-state counters (entries, turns, invalid answers, resolutions, abandons) and a
+`LatencySketch` of the turn latency. No raw events are kept in memory: the aggregator's
+size depends on the number of flow states, not of turns. On startup it replays the
+retained log, so the funnel survives restarts.
+"""
+import math
+import time
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import aiosqlite
+
+from src.config.settings import settings
+from src.database.codecs import to_epoch
+from src.database.connection import db_manager
+
+RESOLUTIONS = ("local", "cache", "llm", "erro")
+QUANTILES = (0.5, 0.9, 0.99)
+# Old events are purged at most this often
+PURGE_INTERVAL_SECONDS = 3600
+
+INSERT_EVENT_SQL = """
+    INSERT INTO Eventos_Conversa (momento, sessao, versao_fluxo, tipo, estado, proximo_estado, resolucao, valido, latencia_us)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+READ_EVENTS_SQL = """
+    SELECT id_evento, versao_fluxo, tipo, estado, proximo_estado, resolucao, valido, latencia_us
+    FROM Eventos_Conversa WHERE id_evento > ? ORDER BY id_evento LIMIT ?
+"""
+
+
+class LatencySketch:
+    """
+    Streaming quantiles with bounded relative error (DDSketch bucketing). A value v is
+    counted in bucket ceil(log(v) / log(gamma)), gamma = (1 + a) / (1 - a), and a
+    quantile is answered with the midpoint of its bucket, within a relative error `a`
+    of the exact value. Memory is one counter per bucket in use: about 600 buckets
+    cover 1 µs to 1 hour at 1%, however many values are added.
+    """
+
+    # Smaller values (in ms) share the lowest bucket
+    MIN_VALUE = 0.001
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, value: float):
+        key = math.ceil(math.log(max(value, self.MIN_VALUE)) / self._log_gamma)
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return self.max
+
+    def summary(self) -> dict:
+        values = {f"p{round(q * 100)}": self.quantile(q) for q in QUANTILES}
+        return {
+            "count": self.count,
+            **{name: round(value, 3) if value is not None else None for name, value in values.items()},
+            "max": round(self.max, 3),
+        }
+
+
+class ConversationEventLog:
+    """Thread-safe buffer of conversation events, written to Eventos_Conversa in batches."""
+
+    def __init__(self, max_buffered: Optional[int] = None):
+        self.max_buffered = max_buffered or settings.conversation_event_buffer_max
+        self._buffer: List[tuple] = []
+        self._lock = threading.Lock()
+        self.counters = {"recorded": 0, "written": 0, "dropped": 0}
+
+    def record(self, tipo: str, sessao: str, versao_fluxo: int, estado: str, proximo_estado: Optional[str] = None,
+               resolucao: Optional[str] = None, valido: Optional[bool] = None, latencia_us: Optional[int] = None):
+        event = (to_epoch(datetime.now()), sessao, versao_fluxo, tipo, estado, proximo_estado, resolucao,
+                 None if valido is None else int(valido), latencia_us)
+        with self._lock:
+            if len(self._buffer) >= self.max_buffered:
+                # O banco não está acompanhando: descarta em vez de crescer sem limite
+                self.counters["dropped"] += 1
+                return
+            self._buffer.append(event)
+            self.counters["recorded"] += 1
+
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    async def flush(self, db: aiosqlite.Connection) -> int:
+        """Writes every buffered event in one transaction. Returns how many were written."""
+        with self._lock:
+            events, self._buffer = self._buffer, []
+        if not events:
+            return 0
+        try:
+            await db.executemany(INSERT_EVENT_SQL, events)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            with self._lock:
+                # Back to the front of the buffer, in order, for the next flush
+                merged = events + self._buffer
+                self.counters["dropped"] += max(0, len(merged) - self.max_buffered)
+                self._buffer = merged[-self.max_buffered:]
+            raise
+        self.counters["written"] += len(events)
+        return len(events)
+
+    async def purge(self, db: aiosqlite.Connection, now: Optional[datetime] = None) -> int:
+        """Deletes the events older than the retention period."""
+        cutoff = (now or datetime.now()) - timedelta(days=settings.conversation_event_retention_days)
+        cursor = await db.execute("DELETE FROM Eventos_Conversa WHERE momento < ?", (to_epoch(cutoff),))
+        await db.commit()
+        return max(0, cursor.rowcount)
+
+    def metrics(self) -> dict:
+        return {**self.counters, "buffered": self.pending()}
+
+
+class StateStats:
+    """Counters and turn latency of one state of one flow version."""
+    __slots__ = ("entries", "turns", "invalid", "abandoned", "resolutions", "latency")
+
+    def __init__(self):
+        self.entries = 0
+        self.turns = 0
+        self.invalid = 0
+        self.abandoned = 0
+        self.resolutions = dict.fromkeys(RESOLUTIONS, 0)
+        self.latency = LatencySketch(settings.funnel_latency_relative_accuracy)
+
+    def summary(self) -> dict:
+        turns = self.turns or None
+        return {
+            "entries": self.entries,
+            "turns": self.turns,
+            "invalid": self.invalid,
+            "invalid_rate": round(self.invalid / turns, 4) if turns else None,
+            "abandoned": self.abandoned,
+            "abandon_rate": round(self.abandoned / self.entries, 4) if self.entries else None,
+            "resolutions": dict(self.resolutions),
+            "llm_rate": round(self.resolutions["llm"] / turns, 4) if turns else None,
+            "latency_ms": self.latency.summary(),
+        }
+
+
+class FunnelAggregator:
+    """Per-state funnel counters and latency sketches, fed by tailing Eventos_Conversa."""
+
+    def __init__(self):
+        self._states: Dict[Tuple[int, str], StateStats] = {}
+        self.sessions_started: Dict[int, int] = {}
+        self.last_event_id = 0
+        self.events_read = 0
+
+    def _stats(self, versao_fluxo: int, estado: str) -> StateStats:
+        stats = self._states.get((versao_fluxo, estado))
+        if stats is None:
+            stats = self._states[(versao_fluxo, estado)] = StateStats()
+        return stats
+
+    def apply(self, event) -> None:
+        versao, tipo, estado = event["versao_fluxo"], event["tipo"], event["estado"]
+        stats = self._stats(versao, estado)
+        if tipo == "inicio":
+            stats.entries += 1
+            self.sessions_started[versao] = self.sessions_started.get(versao, 0) + 1
+        elif tipo == "abandono":
+            stats.abandoned += 1
+        else:
+            stats.turns += 1
+            stats.invalid += event["valido"] == 0
+            if event["resolucao"] in stats.resolutions:
+                stats.resolutions[event["resolucao"]] += 1
+            if event["latencia_us"] is not None:
+                stats.latency.add(event["latencia_us"] / 1000)
+            if event["proximo_estado"] and event["proximo_estado"] != estado:
+                self._stats(versao, event["proximo_estado"]).entries += 1
+
+    async def catch_up(self, db: aiosqlite.Connection, batch_size: Optional[int] = None) -> int:
+        """Reads and applies every event after the last one seen. Returns how many were read."""
+        batch_size = batch_size or settings.conversation_event_read_batch
+        read = 0
+        while True:
+            async with db.execute(READ_EVENTS_SQL, (self.last_event_id, batch_size)) as cursor:
+                rows = await cursor.fetchall()
+            for row in rows:
+                self.apply(row)
+            if rows:
+                self.last_event_id = rows[-1]["id_evento"]
+                read += len(rows)
+            if len(rows) < batch_size:
+                break
+        self.events_read += read
+        return read
+
+    def versions(self) -> List[int]:
+        return sorted({versao for versao, _ in self._states})
+
+    def funnel(self, versao_fluxo: int, state_order: Optional[List[str]] = None) -> dict:
+        """
+        Funnel of one flow version: the states in `state_order` (the flow's own order)
+        first, then any other state seen in the events.
+        """
+        seen = [estado for versao, estado in self._states if versao == versao_fluxo]
+        order = [estado for estado in (state_order or []) if estado in seen]
+        order += sorted(set(seen) - set(order))
+        started = self.sessions_started.get(versao_fluxo, 0)
+        states = []
+        for estado in order:
+            stats = self._states[(versao_fluxo, estado)]
+            states.append({
+                "state": estado,
+                **stats.summary(),
+                "reached_rate": round(stats.entries / started, 4) if started else None,
+            })
+        return {"flow_version": versao_fluxo, "sessions_started": started, "states": states}
+
+    def metrics(self) -> dict:
+        return {"events_read": self.events_read, "last_event_id": self.last_event_id,
+                "tracked_states": len(self._states)}
+
+
+async def run_event_log_writer(log: ConversationEventLog, aggregator: FunnelAggregator, interval_seconds: int):
+    """
+    Tarefa de fundo que grava os eventos das conversas em lotes e atualiza o funil com
+    os eventos novos do log (na primeira rodada, com todo o log retido).
+    """
+    last_purge = 0.0
+    while True:
+        conn = await db_manager.get_connection()
+        try:
+            await log.flush(conn)
+            await aggregator.catch_up(conn)
+            if time.monotonic() - last_purge >= PURGE_INTERVAL_SECONDS:
+                purged = await log.purge(conn)
+                last_purge = time.monotonic()
+                if purged:
+                    logging.info(f"🧹 {purged} eventos de conversa antigos removidos")
+        except Exception as e:
+            logging.error(f"Erro ao gravar os eventos das conversas: {e}")
+        finally:
+            await conn.close()
+        await asyncio.sleep(interval_seconds)
+
+
+# Global event log and funnel
+conversation_events = ConversationEventLog()
+funnel_aggregator = FunnelAggregator()
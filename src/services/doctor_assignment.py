@@ -0,0 +1,107 @@
+"""
+Doctor assignment for bookings that name a specialty but not a doctor.
+
+Strategies only read in-memory state: the candidates come from the catalog snapshot,
+already filtered by specialty, insurance and location and carrying the doctor's weekly
+hours there (see `slot_search.find_candidates`), and free starts, daily load and
+appointment counts come from the availability index, which is updated on every booking
+and cancellation. No query over Agendamentos runs per booking.
+
+- earliest_free: the doctor who can start earliest in the requested window;
+- least_loaded: the doctor with the fewest taken slots that day (then the fewest active
+  appointments) among those free in the window;
+- round_robin: per specialty, the next free doctor in id order after the last one assigned.
+"""
+import threading
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+from src.config.settings import settings
+from src.services.availability_service import AvailabilityIndex, availability_index
+from src.services.slot_search import SlotCandidate
+
+STRATEGIES = ("earliest_free", "least_loaded", "round_robin")
+
+# (position in the candidate list, candidate, first free start in the window)
+Option = Tuple[int, SlotCandidate, datetime]
+
+
+class DoctorAssigner:
+    """Picks the doctor (and start) for a booking with the configured strategy."""
+
+    def __init__(self, index: AvailabilityIndex, strategy: Optional[str] = None):
+        self.index = index
+        self.strategy = strategy or settings.doctor_assignment_strategy
+        if self.strategy not in STRATEGIES:
+            raise ValueError(f"Unknown doctor assignment strategy '{self.strategy}', expected one of {STRATEGIES}")
+        self._last_assigned: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.assignments: Dict[int, int] = {}
+
+    @staticmethod
+    def _window(candidate: SlotCandidate, day: date, window: Tuple[int, int]) -> Optional[Tuple[int, int]]:
+        """The requested window clipped to the candidate's own hours on `day`."""
+        if candidate.hours is None:
+            return window
+        own = candidate.hours(day)
+        if own is None:
+            return None
+        start, end = max(window[0], own[0]), min(window[1], own[1])
+        return (start, end) if start < end else None
+
+    def _options(self, candidates: List[SlotCandidate], day: date, window: Tuple[int, int],
+                 duration_minutes: int) -> List[Option]:
+        midnight = datetime.combine(day, datetime.min.time())
+        options = []
+        for position, candidate in enumerate(candidates):
+            clipped = self._window(candidate, day, window)
+            if clipped is None:
+                continue
+            starts = self.index.iter_free_starts(candidate.keys, midnight, duration_minutes,
+                                                 lambda _day, clipped=clipped: clipped, 1,
+                                                 settings.slot_search_step_minutes)
+            start = next(starts, None)
+            if start is not None:
+                options.append((position, candidate, start))
+        return options
+
+    def _load(self, candidate: SlotCandidate, day: date) -> Tuple[int, int]:
+        return (self.index.busy_slots(candidate.keys, day),
+                sum(self.index.appointment_count(key) for key in candidate.keys))
+
+    def assign(self, group: str, candidates: List[SlotCandidate], day: date, window: Tuple[int, int],
+               duration_minutes: int) -> Optional[Tuple[SlotCandidate, datetime]]:
+        """
+        Chooses among the candidates free for `duration_minutes` inside `window` (start, end
+        minute of `day`). `group` scopes the round-robin rotation (the specialty). Returns
+        the candidate and its start, or None when nobody is free.
+        """
+        options = self._options(candidates, day, window, duration_minutes)
+        if not options:
+            return None
+
+        if self.strategy == "earliest_free":
+            _, candidate, start = min(options, key=lambda o: (o[2], self._load(o[1], day), o[0]))
+        elif self.strategy == "least_loaded":
+            _, candidate, start = min(options, key=lambda o: (self._load(o[1], day), o[2], o[0]))
+        else:
+            with self._lock:
+                last = self._last_assigned.get(group)
+                # Options come one per schedule location, not in id order: the smallest id
+                # after the last one assigned, wrapping around to the smallest
+                after = [o for o in options if last is not None and o[1].id_medico > last]
+                _, candidate, start = min(after or options, key=lambda o: (o[1].id_medico, o[0]))
+                self._last_assigned[group] = candidate.id_medico
+        return candidate, start
+
+    def confirm(self, doctor_id: int):
+        """Counts an assignment once its booking is committed (an assigned booking can still fail)."""
+        with self._lock:
+            self.assignments[doctor_id] = self.assignments.get(doctor_id, 0) + 1
+
+    def metrics(self) -> dict:
+        return {"strategy": self.strategy, "assignments_by_doctor": dict(self.assignments)}
+
+
+# Global doctor assigner
+doctor_assigner = DoctorAssigner(availability_index)
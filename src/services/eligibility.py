@@ -0,0 +1,125 @@
+"""
+Insurance eligibility of doctors and locations, precomputed per convenio as bitsets.
+
+Each doctor id is a bit position: per convenio there is the set of doctors that accept it
+(Medico_Convenios), per specialty the set of doctors that practice it and per location
+the set of doctors that work there (Medico_Locais). "Does doctor X take plan Y" is a
+shift and a mask, and "which locations have a cardiologist taking Unimed" is one AND per
+location. Patient-typed plan names are resolved to a Convenios id through an index of
+normalized names (no case, accents or punctuation), with a small cache of past lookups.
+
+An empty or private ("particular") plan restricts nothing: `doctors()` returns None.
+"""
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Optional
+
+PRIVATE = "particular"
+
+# Past resolutions (normalized input -> id) kept per index; cleared when it grows past this
+_RESOLVE_CACHE_SIZE = 1024
+
+
+def normalize_name(value: Optional[str]) -> str:
+    """Lowercase, without accents and with punctuation collapsed to single spaces."""
+    decomposed = unicodedata.normalize("NFKD", value or "")
+    folded = "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", folded).split())
+
+
+def bits(ids: Iterable[int]) -> int:
+    value = 0
+    for item in ids:
+        value |= 1 << item
+    return value
+
+
+def has(bitset: Optional[int], item: int) -> bool:
+    """Membership test; a None bitset means "no restriction"."""
+    return bitset is None or bool(bitset >> item & 1)
+
+
+class EligibilityIndex:
+    """Doctor and location bitsets per convenio, specialty and location."""
+
+    def __init__(self, insurances: Dict[int, str], doctor_insurance_ids: Dict[int, List[int]],
+                 specialty_doctors: Dict[str, List[dict]], doctor_locations: Dict[int, Iterable[int]]):
+        self.names = dict(insurances)
+        self.ids_by_name = {normalize_name(name): insurance_id for insurance_id, name in insurances.items()}
+        self.private_id = self.ids_by_name.get(PRIVATE)
+
+        self.doctors_by_insurance: Dict[int, int] = {}
+        for doctor_id, insurance_ids in doctor_insurance_ids.items():
+            for insurance_id in insurance_ids:
+                self.doctors_by_insurance[insurance_id] = self.doctors_by_insurance.get(insurance_id, 0) | 1 << doctor_id
+        self.doctors_by_specialty = {name: bits(doctor["id"] for doctor in doctors)
+                                     for name, doctors in specialty_doctors.items()}
+        self.doctors_by_location: Dict[int, int] = {}
+        for doctor_id, location_ids in doctor_locations.items():
+            for location_id in location_ids:
+                self.doctors_by_location[location_id] = self.doctors_by_location.get(location_id, 0) | 1 << doctor_id
+        self._resolved: Dict[str, Optional[int]] = {}
+
+    def resolve(self, convenio: Optional[str]) -> Optional[int]:
+        """
+        Convenios id of a plan name: exact normalized match, else the longest plan name
+        contained in the input (or containing it, e.g. "Sul America" / "SulAmérica Saúde").
+        An empty name resolves to "Particular"; unknown names to None.
+        """
+        wanted = normalize_name(convenio)
+        if not wanted:
+            return self.private_id
+        if wanted in self._resolved:
+            return self._resolved[wanted]
+
+        insurance_id = self.ids_by_name.get(wanted)
+        if insurance_id is None and len(wanted) >= 3:
+            compact = wanted.replace(" ", "")
+            matches = [(len(name), insurance_id) for name, insurance_id in self.ids_by_name.items()
+                       if name.replace(" ", "") in compact or compact in name.replace(" ", "")]
+            insurance_id = max(matches)[1] if matches else None
+
+        if len(self._resolved) >= _RESOLVE_CACHE_SIZE:
+            self._resolved.clear()
+        self._resolved[wanted] = insurance_id
+        return insurance_id
+
+    def is_private(self, convenio: Optional[str]) -> bool:
+        wanted = normalize_name(convenio)
+        if not wanted or wanted == PRIVATE:
+            return True
+        return self.private_id is not None and self.resolve(convenio) == self.private_id
+
+    def doctors(self, convenio: Optional[str]) -> Optional[int]:
+        """Bitset of the doctors that accept the plan; None for private or unstated plans."""
+        if self.is_private(convenio):
+            return None
+        insurance_id = self.resolve(convenio)
+        if insurance_id is None:
+            return 0
+        return self.doctors_by_insurance.get(insurance_id, 0)
+
+    def accepts(self, insurance_id: Optional[int], doctor_id: int) -> bool:
+        """Whether the doctor takes the plan with this Convenios id (None or private: always)."""
+        if insurance_id is None or insurance_id == self.private_id:
+            return True
+        return has(self.doctors_by_insurance.get(insurance_id, 0), doctor_id)
+
+    def specialty_doctors(self, specialty: str, convenio: Optional[str] = None) -> int:
+        """Bitset of the doctors of the specialty that accept the plan."""
+        doctors = self.doctors_by_specialty.get(specialty.lower().strip(), 0)
+        eligible = self.doctors(convenio)
+        return doctors if eligible is None else doctors & eligible
+
+    def locations(self, specialty: str, convenio: Optional[str] = None) -> List[int]:
+        """Ids of the locations where a doctor of the specialty that accepts the plan works."""
+        doctors = self.specialty_doctors(specialty, convenio)
+        return sorted(location_id for location_id, working in self.doctors_by_location.items() if working & doctors)
+
+    def insurances(self, specialty: str, location_id: Optional[int] = None) -> List[str]:
+        """Names of the plans accepted by some doctor of the specialty (at the location, if given)."""
+        doctors = self.doctors_by_specialty.get(specialty.lower().strip(), 0)
+        if location_id is not None:
+            doctors &= self.doctors_by_location.get(location_id, 0)
+        return sorted(self.names[insurance_id] for insurance_id, accepting in self.doctors_by_insurance.items()
+                      if accepting & doctors and insurance_id in self.names)
@@ -0,0 +1,121 @@
+"""
+Delivery backends for patient notifications.
+
+A sender takes one rendered `OutboundMessage` and either returns (delivered) or raises
+(the dispatcher retries with backoff). Backends are chosen per channel in settings:
+e-mail uses `notification_email_backend`, phone and WhatsApp `notification_sms_backend`.
+
+- sink: local stand-in for SMTP/SMS gateways. Logs the message, keeps the last ones in
+  memory and, with `notification_sink_path`, appends them to a JSONL file. Used in
+  development and tests, so nothing leaves the machine.
+- smtp: plain SMTP (stdlib smtplib) run in a worker thread.
+
+New backends register with `register_backend(name, factory)`.
+"""
+import json
+import asyncio
+import logging
+import smtplib
+import threading
+from collections import deque
+from datetime import datetime
+from email.message import EmailMessage
+from pathlib import Path
+from typing import Callable, Deque, Dict, Optional
+
+from src.config.settings import settings
+
+
+class OutboundMessage:
+    """A notification ready to be delivered to one contact."""
+    __slots__ = ("id_notificacao", "canal", "destino", "assunto", "corpo")
+
+    def __init__(self, id_notificacao: int, canal: str, destino: str, assunto: str, corpo: str):
+        self.id_notificacao = id_notificacao
+        self.canal = canal
+        self.destino = destino
+        self.assunto = assunto
+        self.corpo = corpo
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class NotificationSender:
+    """Base class of the delivery backends."""
+
+    name = "base"
+
+    async def send(self, message: OutboundMessage):
+        raise NotImplementedError
+
+
+class SinkSender(NotificationSender):
+    """Accepts every message without sending it anywhere (see module docstring)."""
+
+    name = "sink"
+
+    def __init__(self, path: Optional[str] = None, keep: int = 1000):
+        self.path = Path(path) if path else None
+        self.sent: Deque[dict] = deque(maxlen=keep)
+        self._lock = threading.Lock()
+
+    async def send(self, message: OutboundMessage):
+        record = {**message.to_dict(), "enviado_em": datetime.now().isoformat(timespec="seconds")}
+        self.sent.append(record)
+        logging.info(f"📨 [{message.canal}] {message.destino}: {message.assunto}")
+        if self.path is not None:
+            await asyncio.to_thread(self._append, record)
+
+    def _append(self, record: dict):
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", encoding="utf-8") as sink:
+                sink.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+class SmtpSender(NotificationSender):
+    """E-mail over SMTP with the `smtp_*` settings."""
+
+    name = "smtp"
+
+    async def send(self, message: OutboundMessage):
+        if message.canal != "email":
+            raise ValueError(f"O backend SMTP não envia mensagens por {message.canal}")
+        email = EmailMessage()
+        email["From"] = settings.smtp_sender
+        email["To"] = message.destino
+        email["Subject"] = message.assunto
+        email.set_content(message.corpo)
+        await asyncio.to_thread(self._deliver, email)
+
+    @staticmethod
+    def _deliver(email: EmailMessage):
+        with smtplib.SMTP(settings.smtp_host, settings.smtp_port, timeout=30) as smtp:
+            if settings.smtp_starttls:
+                smtp.starttls()
+            if settings.smtp_username:
+                smtp.login(settings.smtp_username, settings.smtp_password)
+            smtp.send_message(email)
+
+
+_BACKENDS: Dict[str, Callable[[], NotificationSender]] = {
+    "sink": lambda: SinkSender(settings.notification_sink_path),
+    "smtp": SmtpSender,
+}
+
+
+def register_backend(name: str, factory: Callable[[], NotificationSender]):
+    """Makes a delivery backend available to the `notification_*_backend` settings."""
+    _BACKENDS[name] = factory
+
+
+def build_senders() -> Dict[str, NotificationSender]:
+    """Sender per channel (email, telefone, whatsapp) from the settings."""
+    built: Dict[str, NotificationSender] = {}
+    for backend in {settings.notification_email_backend, settings.notification_sms_backend}:
+        if backend not in _BACKENDS:
+            raise ValueError(f"Unknown notification backend '{backend}', expected one of {sorted(_BACKENDS)}")
+        built[backend] = _BACKENDS[backend]()
+    sms = built[settings.notification_sms_backend]
+    return {"email": built[settings.notification_email_backend], "telefone": sms, "whatsapp": sms}
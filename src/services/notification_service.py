@@ -0,0 +1,361 @@
+"""
+Transactional outbox for patient notifications (confirmations, reminders, changes).
+
+Bookings, cancellations, reschedules and waitlist offers write their messages to
+`Notificacoes_Saida` in the same transaction as the change itself: one INSERT ... SELECT
+that joins the patient's `Contatos` and stores the names and dates the message needs as
+JSON. A message exists if and only if the change was committed, and the request never
+waits for an SMTP server or SMS gateway.
+
+`OutboxDispatcher` drains the table in the background. Each round claims a batch of due
+messages with one UPDATE ... RETURNING (status 'enviando'), delivers them with bounded
+concurrency through the senders of `notification_senders`, marks them sent, and on
+failure schedules a retry with exponential backoff until `notification_max_attempts`.
+Messages left 'enviando' by a crash are put back on startup (at-least-once delivery).
+
+D-1 reminders are queued by a periodic scan of tomorrow's active appointments on the
+(status, data_hora_inicio) index; a unique index per appointment, contact and date makes
+the scan idempotent. Reminders of appointments cancelled or moved afterwards are
+discarded instead of sent.
+"""
+import json
+import time
+import random
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import aiosqlite
+
+from src.config.settings import settings
+from src.database.codecs import to_epoch
+from src.database.connection import db_manager
+from src.services.notification_senders import NotificationSender, OutboundMessage, build_senders
+
+MESSAGE_COLUMNS = """
+    INSERT {conflict} INTO Notificacoes_Saida (id_agendamento, id_paciente, tipo, canal, destino, payload,
+                                               data_referencia, proxima_tentativa)
+"""
+
+# Uma linha por contato do paciente; parâmetros: tipo, JSON extra, próxima tentativa, filtros do WHERE.
+# As datas de Agendamentos e Ofertas_Espera são inteiros (src/database/codecs.py): no JSON vão
+# como texto, e data_referencia guarda o valor da coluna para comparar com ela ao descartar lembretes.
+APPOINTMENT_MESSAGE_SELECT = """
+    SELECT a.id_agendamento, a.id_paciente, ?, c.tipo, c.valor,
+           json_patch(json_object(
+               'paciente', p.nome, 'medico', m.nome, 'exame', ex.nome,
+               'local', l.nome, 'endereco', l.endereco,
+               'inicio', datetime(a.data_hora_inicio, 'unixepoch'),
+               'fim', datetime(a.data_hora_fim, 'unixepoch')
+           ), ?),
+           a.data_hora_inicio, ?
+    FROM Agendamentos a
+    JOIN Pacientes p ON p.id_paciente = a.id_paciente
+    JOIN Contatos c ON c.entidade_id = a.id_paciente AND c.entidade_tipo = 'paciente'
+    JOIN Locais_Atendimento l ON l.id_local = a.id_local
+    LEFT JOIN Medicos m ON m.id_medico = a.id_medico
+    LEFT JOIN Exames ex ON ex.id_exame = a.id_exame
+"""
+ENQUEUE_APPOINTMENT_SQL = (MESSAGE_COLUMNS.format(conflict="") + APPOINTMENT_MESSAGE_SELECT
+                           + " WHERE a.id_agendamento = ?")
+QUEUE_REMINDERS_SQL = (MESSAGE_COLUMNS.format(conflict="OR IGNORE") + APPOINTMENT_MESSAGE_SELECT
+                       + " WHERE a.status = 'agendado' AND a.data_hora_inicio >= ? AND a.data_hora_inicio < ?")
+
+ENQUEUE_OFFER_SQL = MESSAGE_COLUMNS.format(conflict="") + """
+    SELECT NULL, e.id_paciente, 'oferta_espera', c.tipo, c.valor,
+           json_object(
+               'paciente', p.nome, 'medico', m.nome, 'exame', ex.nome,
+               'local', l.nome, 'endereco', l.endereco,
+               'inicio', datetime(o.data_hora_inicio, 'unixepoch'),
+               'fim', datetime(o.data_hora_fim, 'unixepoch'),
+               'id_oferta', o.id_oferta, 'expira_em', datetime(o.expira_em, 'unixepoch')
+           ),
+           o.data_hora_inicio, ?
+    FROM Ofertas_Espera o
+    JOIN Lista_Espera e ON e.id_espera = o.id_espera
+    JOIN Pacientes p ON p.id_paciente = e.id_paciente
+    JOIN Contatos c ON c.entidade_id = e.id_paciente AND c.entidade_tipo = 'paciente'
+    JOIN Locais_Atendimento l ON l.id_local = o.id_local
+    LEFT JOIN Medicos m ON m.id_medico = o.id_medico
+    LEFT JOIN Exames ex ON ex.id_exame = o.id_exame
+    WHERE o.id_oferta = ?
+"""
+
+CLAIM_SQL = """
+    UPDATE Notificacoes_Saida
+    SET status = 'enviando', tentativas = tentativas + 1
+    WHERE id_notificacao IN (
+        SELECT id_notificacao FROM Notificacoes_Saida
+        WHERE status = 'pendente' AND proxima_tentativa <= ?
+        ORDER BY proxima_tentativa
+        LIMIT ?
+    )
+    RETURNING *
+"""
+# Lembretes cujo agendamento foi cancelado ou remarcado depois de gravados
+DISCARD_STALE_REMINDERS_SQL = """
+    UPDATE Notificacoes_Saida
+    SET status = 'descartado'
+    WHERE status = 'pendente' AND proxima_tentativa <= ? AND tipo = 'lembrete'
+      AND NOT EXISTS (
+          SELECT 1 FROM Agendamentos a
+          WHERE a.id_agendamento = Notificacoes_Saida.id_agendamento
+            AND a.status = 'agendado' AND a.data_hora_inicio = Notificacoes_Saida.data_referencia
+      )
+"""
+
+# tipo -> (assunto, corpo)
+TEMPLATES = {
+    "confirmacao": (
+        "Agendamento confirmado",
+        "Olá, {paciente}! Seu agendamento de {servico} está confirmado para {quando}, em {local} ({endereco})."
+    ),
+    "lembrete": (
+        "Lembrete: {servico} amanhã",
+        "Olá, {paciente}! Lembramos do seu agendamento de {servico} amanhã, {quando}, em {local} ({endereco})."
+    ),
+    "cancelamento": (
+        "Agendamento cancelado",
+        "Olá, {paciente}! Seu agendamento de {servico} em {quando} foi cancelado."
+    ),
+    "remarcacao": (
+        "Agendamento remarcado",
+        "Olá, {paciente}! Seu agendamento de {servico} foi remarcado de {anterior} para {quando}, em {local} ({endereco})."
+    ),
+    "oferta_espera": (
+        "Horário disponível: {servico}",
+        "Olá, {paciente}! Abriu um horário de {servico} em {quando}, em {local} ({endereco}). "
+        "Ele fica reservado para você até {expira}; responda para aceitar (oferta {id_oferta})."
+    ),
+}
+
+
+def _when(value: Any) -> str:
+    if not value:
+        return ""
+    moment = value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+    return f"{moment:%d/%m/%Y} às {moment:%H:%M}"
+
+
+def render(row) -> OutboundMessage:
+    """Subject and body of a queued message, from its type and JSON payload."""
+    data = json.loads(row["payload"])
+    if data.get("exame"):
+        servico = f"exame {data['exame']}"
+    elif data.get("medico"):
+        servico = f"consulta com {data['medico']}"
+    else:
+        servico = "consulta"
+    values = {
+        **data,
+        "servico": servico,
+        "quando": _when(data.get("inicio")),
+        "anterior": _when(data.get("anterior")),
+        "expira": _when(data.get("expira_em")),
+    }
+    assunto, corpo = TEMPLATES[row["tipo"]]
+    return OutboundMessage(row["id_notificacao"], row["canal"], row["destino"],
+                           assunto.format(**values), corpo.format(**values))
+
+
+async def enqueue_appointment_message(db: aiosqlite.Connection, appointment_id: int, tipo: str,
+                                      extra: Optional[Dict[str, Any]] = None) -> int:
+    """
+    Queues a message about the appointment to every contact of its patient. Does not
+    commit: it belongs to the caller's transaction. Returns how many were queued.
+    """
+    cursor = await db.execute(
+        ENQUEUE_APPOINTMENT_SQL,
+        (tipo, json.dumps(extra or {}, default=str), datetime.now(), appointment_id)
+    )
+    return cursor.rowcount
+
+
+async def enqueue_offer_message(db: aiosqlite.Connection, offer_id: int) -> int:
+    """Queues the waitlist offer to every contact of the patient. Does not commit."""
+    cursor = await db.execute(ENQUEUE_OFFER_SQL, (datetime.now(), offer_id))
+    return cursor.rowcount
+
+
+def retry_delay(attempts: int) -> float:
+    """Seconds before retry number `attempts` (exponential, capped, with ±20% jitter)."""
+    delay = min(settings.notification_retry_base_seconds * 2 ** max(0, attempts - 1),
+                settings.notification_retry_max_seconds)
+    return delay * random.uniform(0.8, 1.2)
+
+
+class OutboxDispatcher:
+    """Delivers the messages of the outbox in batches."""
+
+    def __init__(self, senders: Optional[Dict[str, NotificationSender]] = None):
+        self._senders = senders
+        self._wake: Optional[asyncio.Event] = None
+        self.counters = {"sent": 0, "retried": 0, "failed": 0, "discarded": 0, "reminders_queued": 0}
+        self.delivery_seconds = 0.0
+
+    @property
+    def senders(self) -> Dict[str, NotificationSender]:
+        if self._senders is None:
+            self._senders = build_senders()
+        return self._senders
+
+    @property
+    def wake_event(self) -> asyncio.Event:
+        if self._wake is None:
+            self._wake = asyncio.Event()
+        return self._wake
+
+    def wake(self):
+        """Asks for a round right away (after a commit that queued messages)."""
+        self.wake_event.set()
+
+    async def wait(self, timeout: float):
+        try:
+            await asyncio.wait_for(self.wake_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.wake_event.clear()
+
+    async def recover(self, db: aiosqlite.Connection) -> int:
+        """Puts back the messages a previous process claimed but never finished."""
+        cursor = await db.execute("UPDATE Notificacoes_Saida SET status = 'pendente' WHERE status = 'enviando'")
+        await db.commit()
+        return cursor.rowcount
+
+    async def _claim(self, db: aiosqlite.Connection, now: datetime) -> List[aiosqlite.Row]:
+        try:
+            discarded = await db.execute(DISCARD_STALE_REMINDERS_SQL, (now,))
+            self.counters["discarded"] += max(0, discarded.rowcount)
+            cursor = await db.execute(CLAIM_SQL, (now, settings.notification_batch_size))
+            rows = await cursor.fetchall()
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        return rows
+
+    async def _deliver(self, row, semaphore: asyncio.Semaphore) -> Optional[str]:
+        """Sends one message; returns the error, or None when delivered."""
+        async with semaphore:
+            try:
+                sender = self.senders.get(row["canal"])
+                if sender is None:
+                    raise ValueError(f"Nenhum backend configurado para o canal {row['canal']}")
+                await asyncio.wait_for(sender.send(render(row)), settings.notification_send_timeout_seconds)
+            except Exception as e:
+                return f"{type(e).__name__}: {e}"
+        return None
+
+    async def dispatch_once(self, db: aiosqlite.Connection) -> int:
+        """Claims and delivers one batch of due messages. Returns how many were claimed."""
+        rows = await self._claim(db, datetime.now())
+        if not rows:
+            return 0
+
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(settings.notification_concurrency)
+        errors = await asyncio.gather(*(self._deliver(row, semaphore) for row in rows))
+        self.delivery_seconds += time.perf_counter() - started
+
+        now = datetime.now()
+        sent, retries, failures = [], [], []
+        for row, error in zip(rows, errors):
+            if error is None:
+                sent.append((now, row["id_notificacao"]))
+            elif row["tentativas"] >= settings.notification_max_attempts:
+                failures.append((error, row["id_notificacao"]))
+                logging.error(f"Notificação {row['id_notificacao']} ({row['tipo']}, {row['canal']}) "
+                              f"descartada após {row['tentativas']} tentativas: {error}")
+            else:
+                retries.append((now + timedelta(seconds=retry_delay(row["tentativas"])), error, row["id_notificacao"]))
+        await db.executemany(
+            "UPDATE Notificacoes_Saida SET status = 'enviado', data_envio = ?, ultimo_erro = NULL WHERE id_notificacao = ?",
+            sent
+        )
+        await db.executemany(
+            "UPDATE Notificacoes_Saida SET status = 'pendente', proxima_tentativa = ?, ultimo_erro = ? WHERE id_notificacao = ?",
+            retries
+        )
+        await db.executemany(
+            "UPDATE Notificacoes_Saida SET status = 'erro', ultimo_erro = ? WHERE id_notificacao = ?",
+            failures
+        )
+        await db.commit()
+        self.counters["sent"] += len(sent)
+        self.counters["retried"] += len(retries)
+        self.counters["failed"] += len(failures)
+        return len(rows)
+
+    async def queue_reminders(self, db: aiosqlite.Connection, now: Optional[datetime] = None) -> int:
+        """
+        From `reminder_hour` on, queues the D-1 reminder of each active appointment of
+        tomorrow (once per contact). Returns how many new reminders were queued.
+        """
+        now = now or datetime.now()
+        if now.hour < settings.reminder_hour:
+            return 0
+        tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        window = (to_epoch(tomorrow), to_epoch(tomorrow + timedelta(days=1)))
+        cursor = await db.execute(QUEUE_REMINDERS_SQL, ("lembrete", "{}", now, *window))
+        await db.commit()
+        queued = max(0, cursor.rowcount)
+        self.counters["reminders_queued"] += queued
+        return queued
+
+    async def backlog(self, db: aiosqlite.Connection) -> Dict[str, int]:
+        async with db.execute("SELECT status, COUNT(*) FROM Notificacoes_Saida GROUP BY status") as cursor:
+            return {status: count for status, count in await cursor.fetchall()}
+
+    def metrics(self) -> dict:
+        delivered = self.counters["sent"] + self.counters["retried"] + self.counters["failed"]
+        return {
+            **self.counters,
+            "backends": {channel: sender.name for channel, sender in self.senders.items()},
+            "avg_batch_delivery_ms": round(self.delivery_seconds / delivered * 1000, 3) if delivered else 0.0,
+        }
+
+
+async def run_outbox_dispatcher(dispatcher: OutboxDispatcher):
+    """Tarefa de fundo que envia as notificações pendentes em lotes."""
+    conn = await db_manager.get_connection()
+    try:
+        recovered = await dispatcher.recover(conn)
+        if recovered:
+            logging.info(f"📨 {recovered} notificações interrompidas voltaram para a fila")
+    except Exception as e:
+        logging.error(f"Erro ao recuperar notificações interrompidas: {e}")
+    finally:
+        await conn.close()
+
+    while True:
+        conn = await db_manager.get_connection()
+        try:
+            # Lotes cheios indicam que há mais mensagens vencidas
+            while await dispatcher.dispatch_once(conn) >= settings.notification_batch_size:
+                pass
+        except Exception as e:
+            logging.error(f"Erro ao enviar notificações: {e}")
+        finally:
+            await conn.close()
+        await dispatcher.wait(settings.notification_poll_interval_seconds)
+
+
+async def run_reminder_scheduler(dispatcher: OutboxDispatcher, interval_seconds: int):
+    """Tarefa de fundo que agenda os lembretes de véspera."""
+    while True:
+        conn = await db_manager.get_connection()
+        try:
+            queued = await dispatcher.queue_reminders(conn)
+            if queued:
+                logging.info(f"⏰ {queued} lembretes de véspera na fila de envio")
+                dispatcher.wake()
+        except Exception as e:
+            logging.error(f"Erro ao agendar lembretes: {e}")
+        finally:
+            await conn.close()
+        await asyncio.sleep(interval_seconds)
+
+
+# Global outbox dispatcher
+outbox_dispatcher = OutboxDispatcher()
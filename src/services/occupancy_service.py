@@ -0,0 +1,225 @@
+"""
+Daily occupancy and demand dashboards.
+
+`Ocupacao_Diaria` (per resource and day) and `Demanda_Diaria` (per creation day and
+channel) are kept up to date by triggers on Agendamentos, in the same transaction as
+every booking, cancellation, status change or reschedule (see database.sql). A dashboard
+reads only the aggregate rows of the requested days, so its cost does not depend on how
+many appointments exist, and it never scans Agendamentos while writers wait.
+
+`rebuild_aggregates` recomputes both tables from Agendamentos and Agendamentos_Arquivo
+(archived appointments keep counting), for the first backfill of an existing database
+and for repairs (scripts/rebuild_aggregates.py). Occupancy is rebuilt one range of days
+per transaction, so writers are held for one chunk at a time.
+"""
+import time
+import logging
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiosqlite
+
+from src.config.settings import settings
+from src.database.codecs import from_epoch, to_epoch
+
+# tipo_recurso -> (table, key column) holding the resource name
+RESOURCE_TYPES = {
+    "medico": ("Medicos", "id_medico"),
+    "local": ("Locais_Atendimento", "id_local"),
+    "especialidade": ("Especialidades", "id_especialidade"),
+    "exame": ("Exames", "id_exame"),
+}
+STATUS_COLUMNS = ("agendados", "realizados", "ausentes", "cancelados")
+ALL_STATUSES = "('agendado', 'cancelado', 'realizado', 'ausente')"
+
+# Minutes a doctor works per weekday (Medico_Locais, 0 = Monday); SQLite's %w has 0 = Sunday
+DOCTOR_CAPACITY_SQL = """
+    LEFT JOIN (
+        SELECT id_medico, dia_semana,
+               SUM((strftime('%s', '2000-01-01 ' || hora_fim) - strftime('%s', '2000-01-01 ' || hora_inicio)) / 60) AS minutos
+        FROM Medico_Locais
+        GROUP BY id_medico, dia_semana
+    ) c ON c.id_medico = o.id_recurso AND c.dia_semana = (CAST(strftime('%w', o.dia) AS INTEGER) + 6) % 7
+"""
+
+# Hot and archived appointments (see archive_service)
+APPOINTMENT_TABLES = ("Agendamentos", "Agendamentos_Arquivo")
+
+# Same per-row contribution as the triggers, grouped; parameters: first and end of the range
+# (epoch), once per table
+_RANGE_SELECT = f"""
+        SELECT id_medico, id_local, id_especialidade, id_exame, status, data_hora_inicio, data_hora_fim
+        FROM {{table}}
+        WHERE status IN {ALL_STATUSES} AND data_hora_inicio >= ? AND data_hora_inicio < ?"""
+REBUILD_OCCUPANCY_SQL = f"""
+    WITH a AS ({" UNION ALL ".join(_RANGE_SELECT.format(table=table) for table in APPOINTMENT_TABLES)}
+    )
+    INSERT INTO Ocupacao_Diaria (tipo_recurso, dia, id_recurso, agendados, realizados, ausentes, cancelados, minutos_ocupados)
+    SELECT tipo, date(data_hora_inicio, 'unixepoch'), id,
+           SUM(status = 'agendado'), SUM(status = 'realizado'), SUM(status = 'ausente'), SUM(status = 'cancelado'),
+           SUM((status != 'cancelado') * ((data_hora_fim - data_hora_inicio) / 60))
+    FROM (
+        SELECT 'medico' AS tipo, id_medico AS id, status, data_hora_inicio, data_hora_fim FROM a
+        UNION ALL SELECT 'local', id_local, status, data_hora_inicio, data_hora_fim FROM a
+        UNION ALL SELECT 'especialidade', id_especialidade, status, data_hora_inicio, data_hora_fim FROM a
+        UNION ALL SELECT 'exame', id_exame, status, data_hora_inicio, data_hora_fim FROM a
+    )
+    WHERE id IS NOT NULL
+    GROUP BY tipo, date(data_hora_inicio, 'unixepoch'), id
+"""
+DEMAND_DAY_SQL = "COALESCE(date(data_criacao, 'localtime'), date(data_hora_inicio, 'unixepoch'))"
+
+
+def _day(value: date) -> str:
+    return value.isoformat()
+
+
+def _check_window(start: date, end: date):
+    if end <= start:
+        raise ValueError("O fim da janela deve ser posterior ao início")
+    if (end - start).days > settings.dashboard_max_days:
+        raise ValueError(f"A janela dos painéis é de no máximo {settings.dashboard_max_days} dias")
+
+
+async def get_occupancy(db: aiosqlite.Connection, tipo_recurso: str, start: date, end: date,
+                        id_recurso: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Occupancy per day in [start, end) of every doctor, location, specialty or exam (or
+    only `id_recurso`). Doctor rows also carry the minutes of their weekly schedule for
+    that weekday and the occupied share of it.
+    """
+    if tipo_recurso not in RESOURCE_TYPES:
+        raise ValueError(f"Tipo de recurso inválido: {tipo_recurso} (use {', '.join(RESOURCE_TYPES)})")
+    _check_window(start, end)
+    table, key = RESOURCE_TYPES[tipo_recurso]
+    doctor = tipo_recurso == "medico"
+    query = f"""
+        SELECT o.dia, o.id_recurso, n.nome, {', '.join(f'o.{column}' for column in STATUS_COLUMNS)},
+               o.minutos_ocupados, {'c.minutos' if doctor else 'NULL'} AS capacidade_minutos
+        FROM Ocupacao_Diaria o
+        LEFT JOIN {table} n ON n.{key} = o.id_recurso
+        {DOCTOR_CAPACITY_SQL if doctor else ''}
+        WHERE o.tipo_recurso = ? AND o.dia >= ? AND o.dia < ?
+    """
+    params: List[Any] = [tipo_recurso, _day(start), _day(end)]
+    if id_recurso is not None:
+        query += " AND o.id_recurso = ?"
+        params.append(id_recurso)
+    query += " ORDER BY o.dia, o.id_recurso"
+    async with db.execute(query, params) as cursor:
+        rows = [dict(row) for row in await cursor.fetchall()]
+    for row in rows:
+        capacity = row["capacidade_minutos"]
+        row["taxa_ocupacao"] = round(row["minutos_ocupados"] / capacity, 4) if capacity else None
+    return rows
+
+
+async def get_demand(db: aiosqlite.Connection, start: date, end: date) -> List[Dict[str, Any]]:
+    """Bookings made per day in [start, end) and channel, and how many of them are cancelled."""
+    _check_window(start, end)
+    async with db.execute(
+        "SELECT dia, canal, agendamentos, cancelados FROM Demanda_Diaria WHERE dia >= ? AND dia < ? ORDER BY dia, canal",
+        (_day(start), _day(end))
+    ) as cursor:
+        return [dict(row) for row in await cursor.fetchall()]
+
+
+def totals(rows: List[Dict[str, Any]], key: str, columns: Tuple[str, ...]) -> List[Dict[str, Any]]:
+    """Sums of `columns` over the days of each `key` value, in order of first appearance."""
+    summed: Dict[Any, Dict[str, Any]] = {}
+    for row in rows:
+        total = summed.setdefault(row[key], {key: row[key], **({"nome": row["nome"]} if "nome" in row else {}),
+                                             **{column: 0 for column in columns}})
+        for column in columns:
+            total[column] += row[column] or 0
+    return list(summed.values())
+
+
+async def _appointment_days(db: aiosqlite.Connection) -> Optional[Tuple[date, date]]:
+    async with db.execute(
+        "SELECT MIN(first), MAX(last) FROM ("
+        + " UNION ALL ".join(f"SELECT MIN(data_hora_inicio) AS first, MAX(data_hora_inicio) AS last FROM {table}"
+                             for table in APPOINTMENT_TABLES)
+        + ")"
+    ) as cursor:
+        first, last = await cursor.fetchone()
+    if first is None:
+        return None
+    return from_epoch(first).date(), from_epoch(last).date() + timedelta(days=1)
+
+
+async def rebuild_aggregates(db: aiosqlite.Connection, start: Optional[date] = None, end: Optional[date] = None,
+                             chunk_days: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Recomputes the aggregates of the days in [start, end) (every day when omitted) from
+    the hot and archived appointments. Occupancy uses the appointment's day and is
+    rebuilt `chunk_days` at a time, one transaction each; demand uses the creation day
+    and is rebuilt in one transaction (a full read of both tables, as creation time has
+    no index).
+    """
+    started = time.perf_counter()
+    chunk_days = chunk_days or settings.aggregate_rebuild_chunk_days
+    # Without a range, demand is rebuilt for every creation day too
+    whole = start is None or end is None
+    if whole:
+        days = await _appointment_days(db)
+        start, end = (start or days[0], end or days[1]) if days else (start, end)
+    chunks = 0
+    if start is not None and end is not None:
+        day = start
+        while day < end:
+            until = min(day + timedelta(days=chunk_days), end)
+            try:
+                await db.execute(
+                    f"DELETE FROM Ocupacao_Diaria WHERE tipo_recurso IN ({', '.join('?' * len(RESOURCE_TYPES))}) "
+                    "AND dia >= ? AND dia < ?",
+                    (*RESOURCE_TYPES, _day(day), _day(until))
+                )
+                bounds = (to_epoch(datetime.combine(day, datetime.min.time())),
+                          to_epoch(datetime.combine(until, datetime.min.time())))
+                await db.execute(REBUILD_OCCUPANCY_SQL, bounds * len(APPOINTMENT_TABLES))
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+            chunks += 1
+            day = until
+
+    # Bookings created in the range, whatever the day they are for
+    delete_sql, source_filter, demand_params = "DELETE FROM Demanda_Diaria", "", ()
+    if not whole:
+        delete_sql += " WHERE dia >= ? AND dia < ?"
+        source_filter = f"WHERE {DEMAND_DAY_SQL} >= ? AND {DEMAND_DAY_SQL} < ?"
+        demand_params = (_day(start), _day(end))
+    try:
+        await db.execute(delete_sql, demand_params)
+        await db.execute(
+            f"""
+            INSERT INTO Demanda_Diaria (dia, canal, agendamentos, cancelados)
+            SELECT {DEMAND_DAY_SQL}, canal, COUNT(*), SUM(status = 'cancelado')
+            FROM ({" UNION ALL ".join(f"SELECT data_criacao, data_hora_inicio, canal, status FROM {table}"
+                                      for table in APPOINTMENT_TABLES)})
+            {source_filter}
+            GROUP BY 1, canal
+            """,
+            demand_params
+        )
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+
+    elapsed = time.perf_counter() - started
+    logging.info(f"Agregados de ocupação e demanda recalculados ({start} a {end}, {chunks} blocos) em {elapsed:.2f}s")
+    return {"inicio": start, "fim": end, "blocos": chunks, "segundos": round(elapsed, 3)}
+
+
+async def backfill_if_empty(db: aiosqlite.Connection) -> bool:
+    """Builds the aggregates of a database that had appointments before they existed."""
+    async with db.execute(
+        "SELECT EXISTS (SELECT 1 FROM Agendamentos) AND NOT EXISTS (SELECT 1 FROM Ocupacao_Diaria)"
+    ) as cursor:
+        missing = (await cursor.fetchone())[0]
+    if missing:
+        await rebuild_aggregates(db)
+    return bool(missing)
@@ -2,8 +2,18 @@
 Service layer for patient-related operations.
 """
 import aiosqlite
-from typing import List, Optional
-from src.database.models.schemas import PacienteCreate, PacienteUpdate, PacienteResponse
+from typing import Any, Dict, List, Optional
+from src.database.codecs import cpf_digits, cpf_to_int
+from src.database.models.schemas import PacienteCreate, PacienteUpdate, PacienteResponse, TipoContatoEnum
+
+# Values the chatbot/PDF extraction uses when a contact was not provided
+NO_CONTACT_VALUES = {"", "não informado", "nao informado", "none", "null", "n/a"}
+
+def _patient(row) -> PacienteResponse:
+    """The CPF is stored as an integer (see src/database/codecs.py); the API uses the 11 digits."""
+    data = dict(row)
+    data["cpf"] = cpf_digits(data["cpf"])
+    return PacienteResponse(**data)
 
 async def create_patient(db: aiosqlite.Connection, patient: PacienteCreate) -> PacienteResponse:
     """Creates a new patient in the database."""
@@ -12,30 +22,81 @@ async def create_patient(db: aiosqlite.Connection, patient: PacienteCreate) -> P
         INSERT INTO Pacientes (nome, cpf, data_nascimento, sexo)
         VALUES (?, ?, ?, ?)
         """,
-        (patient.nome, patient.cpf, patient.data_nascimento, patient.sexo.value)
+        (patient.nome, cpf_to_int(patient.cpf), patient.data_nascimento, patient.sexo.value)
     )
     await db.commit()
     patient_id = cursor.lastrowid
-    return PacienteResponse(id_paciente=patient_id, **patient.model_dump())
+    return PacienteResponse(id_paciente=patient_id, **{**patient.model_dump(), "cpf": cpf_digits(patient.cpf)})
+
+async def upsert_patient(db: aiosqlite.Connection, patient: PacienteCreate, commit: bool = True) -> PacienteResponse:
+    """
+    Returns the patient with this CPF, creating it if needed, in a single statement.
+    An existing record is kept as is; the no-op update only makes RETURNING yield its row.
+    """
+    cursor = await db.execute(
+        """
+        INSERT INTO Pacientes (nome, cpf, data_nascimento, sexo)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(cpf) DO UPDATE SET cpf = excluded.cpf
+        RETURNING *
+        """,
+        (patient.nome, cpf_to_int(patient.cpf), patient.data_nascimento, patient.sexo.value)
+    )
+    row = await cursor.fetchone()
+    if commit:
+        await db.commit()
+    return _patient(row)
+
+async def add_patient_contacts(db: aiosqlite.Connection, patient_id: int, contato: Dict[str, Any]):
+    """Stores the patient's phone and e-mail in Contatos, skipping placeholders and values already on file. Does not commit."""
+    contacts = [
+        (patient_id, tipo, str(valor).strip())
+        for tipo, valor in ((TipoContatoEnum.TELEFONE.value, contato.get("telefone")),
+                            (TipoContatoEnum.EMAIL.value, contato.get("email")))
+        if valor and str(valor).strip().lower() not in NO_CONTACT_VALUES
+    ]
+    if not contacts:
+        return
+    await db.executemany(
+        """
+        INSERT INTO Contatos (entidade_id, entidade_tipo, tipo, valor)
+        SELECT ?1, 'paciente', ?2, ?3
+        WHERE NOT EXISTS (
+            SELECT 1 FROM Contatos
+            WHERE entidade_id = ?1 AND entidade_tipo = 'paciente' AND tipo = ?2 AND valor = ?3
+        )
+        """,
+        contacts
+    )
+
+async def get_patient_by_cpf(db: aiosqlite.Connection, patient_cpf: str) -> Optional[PacienteResponse]:
+    """Retrieves a patient by their cpf (digits, with or without the mask)."""
+    cursor = await db.execute("SELECT * FROM Pacientes WHERE cpf = ?", (cpf_to_int(patient_cpf),))
+    row = await cursor.fetchone()
+    if row:
+        return _patient(row)
+    return None
 
-async def get_patient_by_cpf(db: aiosqlite.Connection, patient_cpf: int) -> Optional[PacienteResponse]:
-    """Retrieves a patient by their cpf."""
-    cursor = await db.execute("SELECT * FROM Pacientes WHERE cpf = ?", (patient_cpf,))
+async def get_patient_by_id(db: aiosqlite.Connection, patient_id: int) -> Optional[PacienteResponse]:
+    """Retrieves a patient by their id."""
+    cursor = await db.execute("SELECT * FROM Pacientes WHERE id_paciente = ?", (patient_id,))
     row = await cursor.fetchone()
     if row:
-        return PacienteResponse(**dict(row))
+        return _patient(row)
     return None
 
 async def get_all_patients(db: aiosqlite.Connection, skip: int = 0, limit: int = 100) -> List[dict]:
     cursor = await db.execute("SELECT * FROM Pacientes LIMIT ? OFFSET ?", (limit, skip))
     rows = await cursor.fetchall()
-    return [PacienteResponse(**dict(row)) for row in rows]
+    return [_patient(row) for row in rows]
 
 async def update_patient(db: aiosqlite.Connection, patient_id: int, patient: PacienteUpdate) -> Optional[PacienteResponse]:
     """Updates a patient's information."""
     update_data = patient.model_dump(exclude_unset=True)
     if not update_data:
-        return await get_patient_by_cpf(db, patient_id)
+        return await get_patient_by_id(db, patient_id)
+    if update_data.get("cpf") is not None:
+        update_data["cpf"] = cpf_to_int(update_data["cpf"])
 
     fields = ", ".join([f"{key} = ?" for key in update_data.keys()])
     values = list(update_data.values())
@@ -45,7 +106,7 @@ async def update_patient(db: aiosqlite.Connection, patient_id: int, patient: Pac
     await db.commit()
 
     if cursor.rowcount > 0:
-        return await get_patient_by_cpf(db, patient_id)
+        return await get_patient_by_id(db, patient_id)
     return None
 
 async def delete_patient(db: aiosqlite.Connection, patient_id: int) -> bool:
@@ -0,0 +1,221 @@
+"""
+Bulk PDF intake: a ZIP archive or many PDFs in a single request.
+
+Every file is staged to disk before processing starts. Extraction then runs with
+bounded concurrency through the same path as single uploads
+(`PdfJobManager.extract_file`: content-hash cache, templates, Gemini), and a single
+writer books the results in batched transactions with one savepoint per file, so a
+bad file only rolls back itself. Results are yielded as each batch is committed.
+"""
+import time
+import uuid
+import asyncio
+import logging
+import zipfile
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi import UploadFile
+
+from src.config.settings import settings, PDF_JOBS_DIR
+from src.database.connection import db_manager
+from src.database.models.schemas import CanalAgendamentoEnum
+from src.services.availability_service import availability_index
+from src.services.booking_service import book_from_conversation
+from src.services.catalog_service import catalog_service
+from src.services.doctor_assignment import doctor_assigner
+from src.services.pdf_cache import copy_and_hash
+from src.services.pdf_jobs import PdfJobManager
+from src.services.pdf_service import PdfExtractionError, receive_upload
+
+
+class BulkLimitExceeded(PdfExtractionError):
+    """Raised when a bulk request holds more files than `pdf_bulk_max_files`."""
+
+
+class BulkItem:
+    """One PDF of a bulk request and what happened to it."""
+    __slots__ = ("name", "path", "file_hash", "conversation_data", "origin", "error")
+
+    def __init__(self, name: str, path: Optional[Path] = None, file_hash: Optional[str] = None,
+                 error: Optional[str] = None):
+        self.name = name
+        self.path = path
+        self.file_hash = file_hash
+        self.conversation_data: Optional[Dict[str, Any]] = None
+        self.origin: Dict[str, str] = {}
+        self.error = error
+
+    def discard_file(self):
+        if self.path is not None:
+            self.path.unlink(missing_ok=True)
+            self.path = None
+
+
+def _stage_pdf(source, name: str) -> BulkItem:
+    path = PDF_JOBS_DIR / f"bulk_{uuid.uuid4().hex}.pdf"
+    with open(path, "wb") as f:
+        file_hash = copy_and_hash(source, f)
+    return BulkItem(name, path, file_hash)
+
+
+def _stage_zip(spooled, archive_name: str) -> List[BulkItem]:
+    """Unpacks the PDFs of an archive to the jobs directory, one item per member."""
+    items: List[BulkItem] = []
+    try:
+        with zipfile.ZipFile(spooled) as archive:
+            for info in archive.infolist():
+                member = Path(info.filename)
+                if info.is_dir() or member.name.startswith(".") or "__MACOSX" in member.parts:
+                    continue
+                name = f"{archive_name}/{info.filename}"
+                if member.suffix.lower() != ".pdf":
+                    items.append(BulkItem(name, error="O arquivo não é um PDF."))
+                elif info.file_size > settings.pdf_max_upload_bytes:
+                    items.append(BulkItem(name, error="O PDF excede o tamanho máximo permitido."))
+                else:
+                    with archive.open(info) as source:
+                        items.append(_stage_pdf(source, name))
+    except zipfile.BadZipFile:
+        items.append(BulkItem(archive_name, error="Arquivo ZIP inválido ou corrompido."))
+    return items
+
+
+def _stage_upload(spooled, name: str) -> List[BulkItem]:
+    with spooled:
+        if name.lower().endswith(".zip") or zipfile.is_zipfile(spooled):
+            spooled.seek(0)
+            return _stage_zip(spooled, name)
+        spooled.seek(0, 2)
+        if spooled.tell() > settings.pdf_max_upload_bytes:
+            return [BulkItem(name, error="O PDF excede o tamanho máximo permitido.")]
+        spooled.seek(0)
+        return [_stage_pdf(spooled, name)]
+
+
+async def stage_uploads(uploads: List[UploadFile]) -> List[BulkItem]:
+    """
+    Saves every uploaded PDF (or ZIP member) to disk. Raises PdfUploadTooLarge or
+    BulkLimitExceeded; problems with individual files are recorded on their items.
+    """
+    PDF_JOBS_DIR.mkdir(parents=True, exist_ok=True)
+    items: List[BulkItem] = []
+    try:
+        for upload in uploads:
+            spooled = await receive_upload(upload, settings.pdf_bulk_max_upload_bytes, settings.pdf_spool_memory_bytes)
+            items.extend(await asyncio.to_thread(_stage_upload, spooled, upload.filename or "arquivo.pdf"))
+            if len(items) > settings.pdf_bulk_max_files:
+                raise BulkLimitExceeded(f"O lote excede o limite de {settings.pdf_bulk_max_files} arquivos.")
+    except Exception:
+        for item in items:
+            item.discard_file()
+        raise
+    return items
+
+
+class PdfBulkIntake:
+    """Runs a staged batch through extraction and batched booking."""
+
+    def __init__(self, jobs: PdfJobManager):
+        self.jobs = jobs
+
+    async def run(self, items: List[BulkItem]) -> AsyncIterator[Dict[str, Any]]:
+        """Yields one result per file, in commit order, followed by a summary."""
+        started = time.perf_counter()
+        await catalog_service.ensure_fresh()
+        extracted: "asyncio.Queue[BulkItem]" = asyncio.Queue()
+        results: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue()
+        semaphore = asyncio.Semaphore(settings.pdf_bulk_concurrency)
+
+        async def extract(item: BulkItem):
+            if item.error is None:
+                async with semaphore:
+                    try:
+                        item.conversation_data, item.origin = await self.jobs.extract_file(item.path, item.file_hash)
+                    except PdfExtractionError as e:
+                        item.error = str(e)
+                    except Exception as e:
+                        logging.error(f"❌ Erro ao processar {item.name} no lote: {e}", exc_info=True)
+                        item.error = "Erro ao processar PDF."
+                    finally:
+                        item.discard_file()
+            await extracted.put(item)
+
+        tasks = [asyncio.create_task(extract(item)) for item in items]
+        writer = asyncio.create_task(self._write(len(items), extracted, results))
+        summary = {"type": "summary", "total": len(items), "appointments_created": 0, "errors": 0,
+                   "from_cache": 0, "from_template": 0}
+        try:
+            while (result := await results.get()) is not None:
+                if result["success"]:
+                    summary["appointments_created"] += 1
+                else:
+                    summary["errors"] += 1
+                summary["from_cache"] += "cache" in result["source"]
+                summary["from_template"] += "template" in result["source"]
+                yield result
+            await writer
+        finally:
+            # Client gone or writer failed: stop the remaining work and drop staged files
+            for task in tasks + [writer]:
+                task.cancel()
+            for item in items:
+                item.discard_file()
+
+        summary["elapsed_ms"] = round((time.perf_counter() - started) * 1000)
+        yield summary
+
+    async def _write(self, total: int, extracted: "asyncio.Queue[BulkItem]",
+                     results: "asyncio.Queue[Optional[Dict[str, Any]]]"):
+        """Books extracted items in transactions of up to `pdf_bulk_commit_batch` files."""
+        conn = await db_manager.get_connection()
+        try:
+            remaining = total
+            while remaining:
+                batch = [await extracted.get()]
+                while len(batch) < settings.pdf_bulk_commit_batch and not extracted.empty():
+                    batch.append(extracted.get_nowait())
+                remaining -= len(batch)
+
+                batch_results = []
+                reservations = []
+                # Doctors assigned in this batch, counted once it commits
+                assignments = []
+                # IMMEDIATE takes the write lock up front: other writers wait for the batch
+                # instead of failing with a lock upgrade deadlock
+                await conn.execute("BEGIN IMMEDIATE")
+                try:
+                    for item in batch:
+                        batch_results.append(await self._book(conn, item, reservations, assignments))
+                    await conn.commit()
+                except BaseException:
+                    # The bookings of this batch were added to the index as they were made
+                    for resources, start, end in reservations:
+                        availability_index.remove(resources, start, end)
+                    raise
+                for doctor_id in assignments:
+                    doctor_assigner.confirm(doctor_id)
+                for result in batch_results:
+                    await results.put(result)
+        finally:
+            await conn.close()
+            await results.put(None)
+
+    async def _book(self, conn, item: BulkItem, reservations: list, assignments: list) -> Dict[str, Any]:
+        result = {"type": "file", "file": item.name, "success": False, "source": item.origin}
+        if item.error is not None:
+            return {**result, "status": "error", "error": item.error}
+
+        await conn.execute("SAVEPOINT arquivo")
+        try:
+            appointment_data = await book_from_conversation(conn, item.conversation_data, commit=False,
+                                                            reservations=reservations, canal=CanalAgendamentoEnum.PDF.value,
+                                                            assignments=assignments)
+            await conn.execute("RELEASE SAVEPOINT arquivo")
+        except Exception as e:
+            await conn.execute("ROLLBACK TO SAVEPOINT arquivo")
+            await conn.execute("RELEASE SAVEPOINT arquivo")
+            logging.warning(f"Agendamento de {item.name} no lote falhou: {e}")
+            return {**result, "status": "ready_to_book", "error": f"Erro ao criar agendamento: {e}",
+                    "extracted_data": item.conversation_data}
+        return {**result, "success": True, "status": "appointment_created", "appointment_data": appointment_data}
@@ -0,0 +1,88 @@
+"""
+Content-hash cache of PDF extraction results.
+
+Entries are keyed by the SHA-256 of the uploaded bytes and, as a fallback for the same
+document re-exported or re-scanned into different bytes, by the SHA-256 of its
+normalized text. Both point to the parsed `conversation_data` and expire after
+`pdf_cache_ttl_seconds`.
+"""
+import re
+import json
+import hashlib
+import logging
+from typing import Any, BinaryIO, Dict, Optional, Tuple
+
+from src.config.settings import settings
+from src.database.connection import db_manager
+
+HASH_CHUNK_SIZE = 64 * 1024
+_WHITESPACE = re.compile(r"\s+")
+
+
+def copy_and_hash(source: BinaryIO, target: BinaryIO) -> str:
+    """Copies a file object and returns the SHA-256 of its content in the same pass."""
+    digest = hashlib.sha256()
+    while chunk := source.read(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+        target.write(chunk)
+    return digest.hexdigest()
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def text_sha256(text: str) -> str:
+    """Hash of the text with case and whitespace differences removed."""
+    normalized = _WHITESPACE.sub(" ", text).strip().lower()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class PdfExtractionCache:
+    """Reads and writes `Pdf_Cache` entries."""
+
+    def __init__(self, ttl_seconds: int = settings.pdf_cache_ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+
+    async def get(self, digest: str, kind: str) -> Optional[Dict[str, Any]]:
+        conn = await db_manager.get_connection()
+        try:
+            cursor = await conn.execute(
+                """
+                SELECT conversation_data FROM Pdf_Cache
+                WHERE hash = ? AND tipo_hash = ? AND expira_em > CURRENT_TIMESTAMP
+                """,
+                (digest, kind)
+            )
+            row = await cursor.fetchone()
+        finally:
+            await conn.close()
+        return json.loads(row[0]) if row else None
+
+    async def put(self, conversation_data: Dict[str, Any], *keys: Tuple[str, str]):
+        """Stores the data under every given (hash, kind) key and purges expired entries."""
+        payload = json.dumps(conversation_data, ensure_ascii=False)
+        conn = await db_manager.get_connection()
+        try:
+            await conn.executemany(
+                """
+                INSERT INTO Pdf_Cache (hash, tipo_hash, conversation_data, expira_em)
+                VALUES (?, ?, ?, datetime('now', ?))
+                ON CONFLICT(hash, tipo_hash) DO UPDATE SET
+                    conversation_data = excluded.conversation_data,
+                    data_criacao = CURRENT_TIMESTAMP,
+                    expira_em = excluded.expira_em
+                """,
+                [(digest, kind, payload, f"+{self.ttl_seconds} seconds") for digest, kind in keys]
+            )
+            await conn.execute("DELETE FROM Pdf_Cache WHERE expira_em <= CURRENT_TIMESTAMP")
+            await conn.commit()
+        except Exception as e:
+            # The cache is an optimization: a failed write must not fail the job
+            logging.error(f"Error writing PDF extraction cache: {e}")
+        finally:
+            await conn.close()
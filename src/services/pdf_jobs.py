@@ -0,0 +1,252 @@
+"""
+Background job pipeline for PDF intake.
+
+An upload is saved to disk and registered in `Pdf_Jobs`, and the request returns the
+job id right away. Text extraction runs in a ProcessPoolExecutor, the Gemini call in a
+worker thread, and booking on the event loop. Each stage is persisted, so clients can
+poll (or stream) the status and unfinished jobs are resumed after a restart.
+
+Extraction results are cached by content hash (see `pdf_cache`), so a re-uploaded
+PDF goes straight to booking, and PDFs in a known layout are read locally by the
+template engine (see `pdf_template_service`) instead of calling Gemini.
+"""
+import json
+import time
+import uuid
+import asyncio
+import logging
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import UploadFile
+
+from src.config.settings import settings, PDF_JOBS_DIR
+from src.database.connection import db_manager
+from src.services.catalog_service import catalog_service
+from src.services.pdf_template_service import PdfTemplateEngine
+from src.services.pdf_cache import PdfExtractionCache, copy_and_hash, file_sha256, text_sha256
+from src.services.pdf_service import (
+    PdfExtractionError, receive_upload, extract_pdf_text_parallel, extract_conversation_data,
+    validate_conversation_data, select_relevant_text
+)
+
+# Status -> progress percentage reported to clients
+JOB_PROGRESS = {
+    "pendente": 0,
+    "extraindo_texto": 10,
+    "extraindo_dados": 40,
+    "agendando": 80,
+    "concluido": 100,
+    "erro": 100,
+}
+FINAL_STATUSES = {"concluido", "erro"}
+
+
+async def _ignore_stage(stage: str):
+    pass
+
+
+class PdfJobManager:
+    """Creates, runs and reports on PDF intake jobs."""
+
+    def __init__(self, model, book: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]):
+        self.model = model
+        # Coroutine that books the appointment and returns the final response payload
+        self.book = book
+        self.cache = PdfExtractionCache()
+        self.templates = PdfTemplateEngine()
+        # Characters of extracted text vs characters actually sent to Gemini
+        self.prompt_stats = {"full_text_chars": 0, "prompt_text_chars": 0}
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._semaphore = asyncio.Semaphore(settings.pdf_job_concurrency)
+        self._changed = asyncio.Condition()
+        self._tasks = set()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=settings.pdf_parse_workers)
+        return self._executor
+
+    async def submit(self, upload: UploadFile) -> Dict[str, Any]:
+        """Stores the upload, registers the job and schedules it. Raises PdfUploadTooLarge."""
+        spooled = await receive_upload(upload, settings.pdf_max_upload_bytes, settings.pdf_spool_memory_bytes)
+        job_id = uuid.uuid4().hex
+        PDF_JOBS_DIR.mkdir(parents=True, exist_ok=True)
+        pdf_path = PDF_JOBS_DIR / f"{job_id}.pdf"
+
+        # The job file is what survives a restart; parsing later memory-maps it
+        with spooled, open(pdf_path, "wb") as f:
+            file_hash = copy_and_hash(spooled, f)
+
+        conn = await db_manager.get_connection()
+        try:
+            await conn.execute(
+                "INSERT INTO Pdf_Jobs (id_job, nome_arquivo, caminho_arquivo, status) VALUES (?, ?, ?, 'pendente')",
+                (job_id, upload.filename, str(pdf_path))
+            )
+            await conn.commit()
+        finally:
+            await conn.close()
+
+        self._start(job_id, pdf_path, file_hash)
+        return await self.get(job_id)
+
+    def _start(self, job_id: str, pdf_path: Path, file_hash: Optional[str] = None):
+        task = asyncio.create_task(self._run(job_id, pdf_path, file_hash))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job_id: str, pdf_path: Path, file_hash: Optional[str] = None):
+        async with self._semaphore:
+            try:
+                started = time.perf_counter()
+                conversation_data, origin = await self.extract_file(
+                    pdf_path, file_hash, on_stage=lambda stage: self._update(job_id, stage)
+                )
+
+                await self._update(job_id, "agendando")
+                result = await self.book(conversation_data)
+                result.update(origin)
+                cache_source = origin.get("cache")
+                if cache_source:
+                    result["message"] = "Dados reaproveitados de um envio anterior deste PDF. " + result["message"]
+                    logging.info(f"♻️ PDF (job {job_id}) servido do cache por {cache_source} "
+                                 f"em {(time.perf_counter() - started) * 1000:.0f} ms até o agendamento")
+                await self._update(job_id, "concluido", resultado=result)
+            except PdfExtractionError as e:
+                await self._update(job_id, "erro", erro=str(e))
+            except Exception as e:
+                logging.error(f"❌ Erro ao processar PDF (job {job_id}): {e}", exc_info=True)
+                await self._update(job_id, "erro", erro="Erro ao processar PDF.")
+            finally:
+                pdf_path.unlink(missing_ok=True)
+
+    async def extract_file(self, pdf_path: Path, file_hash: Optional[str] = None,
+                           on_stage: Optional[Callable[[str], Awaitable[None]]] = None
+                           ) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        """
+        Returns the PDF's conversation_data and where it came from: {"cache": "bytes"} or
+        {"cache": "texto"} for cache hits, {"template": name} for a local template match,
+        or {} for a Gemini extraction. `on_stage` is awaited with each status reached.
+        """
+        on_stage = on_stage or _ignore_stage
+        file_hash = file_hash or await asyncio.to_thread(file_sha256, str(pdf_path))
+        cached = await self.cache.get(file_hash, "bytes")
+        if cached is not None:
+            return cached, {"cache": "bytes"}
+
+        await on_stage("extraindo_texto")
+        full_text = await extract_pdf_text_parallel(
+            self.executor, str(pdf_path), settings.pdf_parse_workers, settings.pdf_pages_per_worker
+        )
+        text_hash = text_sha256(full_text)
+        cached = await self.cache.get(text_hash, "texto")
+        if cached is not None:
+            await self.cache.put(cached, (file_hash, "bytes"))
+            return cached, {"cache": "texto"}
+
+        await on_stage("extraindo_dados")
+        catalog = catalog_service.snapshot.options
+        matched = self.templates.extract(full_text, catalog)
+        if matched is not None:
+            template_name, conversation_data = matched
+            validate_conversation_data(conversation_data)
+            origin = {"template": template_name}
+            logging.info(f"📄 Dados extraídos de {pdf_path.name} pelo template '{template_name}': {conversation_data}")
+        else:
+            prompt_text = select_relevant_text(
+                full_text, catalog, settings.pdf_prompt_token_budget, settings.pdf_prompt_chunk_chars
+            )
+            self.prompt_stats["full_text_chars"] += len(full_text)
+            self.prompt_stats["prompt_text_chars"] += len(prompt_text)
+            started = time.perf_counter()
+            conversation_data = await asyncio.to_thread(extract_conversation_data, self.model, prompt_text)
+            self.templates.record_llm_call(time.perf_counter() - started)
+            origin = {}
+            logging.info(f"🔍 Dados extraídos de {pdf_path.name}: {conversation_data}")
+        await self.cache.put(conversation_data, (file_hash, "bytes"), (text_hash, "texto"))
+        return conversation_data, origin
+
+    async def _update(self, job_id: str, status: str, resultado: Optional[dict] = None, erro: Optional[str] = None):
+        conn = await db_manager.get_connection()
+        try:
+            await conn.execute(
+                """
+                UPDATE Pdf_Jobs
+                SET status = ?, progresso = ?, resultado = ?, erro = ?, data_atualizacao = CURRENT_TIMESTAMP
+                WHERE id_job = ?
+                """,
+                (status, JOB_PROGRESS[status], json.dumps(resultado, default=str) if resultado else None, erro, job_id)
+            )
+            await conn.commit()
+        finally:
+            await conn.close()
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        conn = await db_manager.get_connection()
+        try:
+            cursor = await conn.execute(
+                """
+                SELECT id_job, nome_arquivo, status, progresso, resultado, erro, data_criacao, data_atualizacao
+                FROM Pdf_Jobs WHERE id_job = ?
+                """,
+                (job_id,)
+            )
+            row = await cursor.fetchone()
+        finally:
+            await conn.close()
+        if row is None:
+            return None
+        job = dict(row)
+        job["job_id"] = job.pop("id_job")
+        job["resultado"] = json.loads(job["resultado"]) if job["resultado"] else None
+        return job
+
+    async def wait_for_change(self, timeout: float) -> bool:
+        """Waits until any job changes status. Returns False on timeout."""
+        async with self._changed:
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+                return True
+            except asyncio.TimeoutError:
+                return False
+
+    async def resume_pending(self) -> int:
+        """Re-schedules jobs interrupted by a restart. Returns how many were resumed."""
+        conn = await db_manager.get_connection()
+        try:
+            cursor = await conn.execute(
+                "SELECT id_job, caminho_arquivo FROM Pdf_Jobs WHERE status NOT IN ('concluido', 'erro')"
+            )
+            rows = await cursor.fetchall()
+        finally:
+            await conn.close()
+
+        resumed = 0
+        for job_id, path in rows:
+            pdf_path = Path(path)
+            if pdf_path.exists():
+                self._start(job_id, pdf_path)
+                resumed += 1
+            else:
+                await self._update(job_id, "erro", erro="Arquivo do PDF não encontrado após reinício.")
+        if resumed:
+            logging.info(f"▶️ {resumed} jobs de PDF retomados após reinício")
+        return resumed
+
+    def metrics(self) -> dict:
+        full_chars = self.prompt_stats["full_text_chars"]
+        return {
+            **self.templates.metrics(),
+            "prompt_full_text_chars": full_chars,
+            "prompt_sent_chars": self.prompt_stats["prompt_text_chars"],
+            "prompt_reduction": round(1 - self.prompt_stats["prompt_text_chars"] / full_chars, 4) if full_chars else None,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
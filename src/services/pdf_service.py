@@ -0,0 +1,244 @@
+"""
+Service layer for PDF intake: upload handling, text extraction and structured data
+extraction with Gemini.
+
+Page extraction functions are top-level so they can run inside a ProcessPoolExecutor.
+"""
+import re
+import json
+import mmap
+import asyncio
+import logging
+import tempfile
+from concurrent.futures import Executor
+from typing import Any, Dict, List
+
+from fastapi import UploadFile
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+CPF_PATTERN = re.compile(r"\b\d{3}\.?\d{3}\.?\d{3}-?\d{2}\b")
+DATE_PATTERN = re.compile(r"\b\d{1,2}[/.-]\d{1,2}[/.-]\d{4}\b|\b\d{4}-\d{2}-\d{2}\b")
+BOOKING_TYPE_PATTERN = re.compile(r"consulta|exame", re.IGNORECASE)
+REQUEST_PATTERN = re.compile(r"solicit[oa]|solicitação|encaminh", re.IGNORECASE)
+FIELD_LABEL_PATTERN = re.compile(r"nome|paciente|nascimento|sexo|telefone|celular|e-?mail|conv[eê]nio|prefer[eê]ncia",
+                                 re.IGNORECASE)
+
+
+PDF_EXTRACTION_PROMPT = """
+Você receberá o conteúdo extraído de um PDF. Extraia todos os dados relevantes para agendamento de consulta médica.
+Se algum dado não estiver presente, coloque o valor como null.
+Responda SOMENTE com um JSON no seguinte formato:
+
+IMPORTANTE:
+- Se não encontrar telefone, use "não informado"
+- Se não encontrar email, use "não informado"
+- Se não encontrar horário de preferência, use "manhã"
+- Se não encontrar local, use "Hospital Geral"
+- Se não encontrar convênio, use "Particular"
+
+{{
+ "paciente": {{
+   "nome": "...",
+   "cpf": "...",
+   "data_nascimento": "YYYY-MM-DD",
+   "sexo": "M" ou "F" ou "O"
+ }},
+ "contato": {{
+   "telefone": "... ou não informado",
+   "email": "... ou não informado"
+ }},
+ "agendamento_info": {{
+   "tipo": "consulta" ou "exame",
+   "especialidade": "... (se for consulta)",
+   "nome_exame": "... (se for exame)",
+   "local": "Hospital Geral",
+   "convenio": "Particular"
+ }},
+ "preferencias": {{
+   "data_preferencia": "YYYY-MM-DD",
+   "horario_preferencia": "manhã" ou "tarde" ou "noite" ou "HH:MM"
+ }}
+}}
+
+Conteúdo do PDF:
+{full_text}
+"""
+
+
+class PdfExtractionError(Exception):
+    """Raised when a PDF cannot be turned into booking data."""
+
+
+class PdfUploadTooLarge(PdfExtractionError):
+    """Raised when an upload exceeds the configured maximum size."""
+
+
+async def receive_upload(upload: UploadFile, max_bytes: int, spool_bytes: int) -> tempfile.SpooledTemporaryFile:
+    """
+    Streams an upload into a spooled temporary file (in memory up to `spool_bytes`,
+    on disk after that), aborting as soon as it grows past `max_bytes`.
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+    size = 0
+    try:
+        while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_bytes:
+                raise PdfUploadTooLarge(f"O PDF excede o tamanho máximo de {max_bytes // (1024 * 1024)} MB.")
+            spooled.write(chunk)
+    except Exception:
+        spooled.close()
+        raise
+    spooled.seek(0)
+    return spooled
+
+
+def count_pdf_pages(pdf_path: str) -> int:
+    from PyPDF2 import PdfReader
+
+    with open(pdf_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return len(PdfReader(mapped).pages)
+
+
+def extract_pages_text(pdf_path: str, start: int, stop: int) -> List[str]:
+    """Extracts the text of pages [start, stop) from a memory-mapped PDF, each page exactly once."""
+    from PyPDF2 import PdfReader
+
+    with open(pdf_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        reader = PdfReader(mapped)
+        return [reader.pages[index].extract_text() or "" for index in range(start, stop)]
+
+
+def extract_pdf_text(pdf_path: str) -> str:
+    """Extracts the text of every page of a PDF file (single process)."""
+    texts = extract_pages_text(pdf_path, 0, count_pdf_pages(pdf_path))
+    return "\n".join(text for text in texts if text)
+
+
+def has_booking_fields(text: str) -> bool:
+    """True when the text already holds what booking needs: a CPF, two dates (birth and preference) and the booking type."""
+    return (CPF_PATTERN.search(text) is not None
+            and len(DATE_PATTERN.findall(text)) >= 2
+            and BOOKING_TYPE_PATTERN.search(text) is not None)
+
+
+async def extract_pdf_text_parallel(executor: Executor, pdf_path: str, workers: int, pages_per_chunk: int) -> str:
+    """
+    Extracts the PDF text in the given process pool.
+
+    Small documents are read by a single worker. Large ones are split into page chunks,
+    processed in waves of `workers` chunks; once the text read so far contains the
+    booking fields, the remaining pages are skipped.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        total_pages = await loop.run_in_executor(executor, count_pdf_pages, pdf_path)
+    except Exception as e:
+        raise PdfExtractionError("O arquivo não é um PDF válido.") from e
+    if total_pages <= pages_per_chunk:
+        pages = await loop.run_in_executor(executor, extract_pages_text, pdf_path, 0, total_pages)
+        return "\n".join(text for text in pages if text)
+
+    chunks = [(start, min(start + pages_per_chunk, total_pages)) for start in range(0, total_pages, pages_per_chunk)]
+    texts: List[str] = []
+    for wave_start in range(0, len(chunks), workers):
+        wave = chunks[wave_start:wave_start + workers]
+        results = await asyncio.gather(*(
+            loop.run_in_executor(executor, extract_pages_text, pdf_path, start, stop) for start, stop in wave
+        ))
+        for pages in results:
+            texts.extend(text for text in pages if text)
+        if has_booking_fields("\n".join(texts)):
+            read_pages = wave[-1][1]
+            if read_pages < total_pages:
+                logging.info(f"⏩ Campos encontrados nas primeiras {read_pages} de {total_pages} páginas, parando a leitura")
+            break
+    return "\n".join(texts)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token for Portuguese text)."""
+    return len(text) // 4 + 1
+
+
+def split_text_chunks(text: str, chunk_chars: int) -> List[str]:
+    """Splits the text into consecutive chunks of about `chunk_chars`, on line boundaries."""
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for line in text.splitlines():
+        current.append(line)
+        size += len(line) + 1
+        if size >= chunk_chars:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def score_chunk(chunk: str, catalog_names: List[str]) -> int:
+    """Counts booking-relevant signals in a chunk: CPF, dates, catalog names, request phrases and field labels."""
+    folded = chunk.lower()
+    score = 5 * len(CPF_PATTERN.findall(chunk))
+    score += 2 * min(len(DATE_PATTERN.findall(chunk)), 3)
+    score += 3 * sum(1 for name in catalog_names if name in folded)
+    score += 3 * len(REQUEST_PATTERN.findall(chunk))
+    score += len(FIELD_LABEL_PATTERN.findall(chunk))
+    return score
+
+
+def select_relevant_text(full_text: str, catalog: Dict[str, List[str]], token_budget: int, chunk_chars: int) -> str:
+    """
+    Keeps the highest-scoring chunks of the text within `token_budget`, in their
+    original order. Texts that already fit the budget are returned unchanged.
+    """
+    if estimate_tokens(full_text) <= token_budget:
+        return full_text
+
+    catalog_names = [name.lower() for key in ("specialties", "exams") for name in catalog.get(key, [])]
+    chunks = split_text_chunks(full_text, chunk_chars)
+    # Higher score first; on ties, earlier chunks (headers usually carry the patient data)
+    ranked = sorted(range(len(chunks)), key=lambda i: (-score_chunk(chunks[i], catalog_names), i))
+
+    selected = []
+    used = 0
+    for index in ranked:
+        tokens = estimate_tokens(chunks[index])
+        if used + tokens > token_budget:
+            continue
+        selected.append(index)
+        used += tokens
+    return "\n".join(chunks[i] for i in sorted(selected))
+
+
+def build_extraction_prompt(full_text: str) -> str:
+    return PDF_EXTRACTION_PROMPT.format(full_text=full_text)
+
+
+def extract_conversation_data(model, full_text: str) -> Dict[str, Any]:
+    """Sends the PDF text to Gemini and returns the parsed `conversation_data` structure (blocking)."""
+    if not full_text.strip():
+        raise PdfExtractionError("Não foi possível extrair texto do PDF.")
+
+    logging.info(f"🔎 Enviando texto para o Gemini (~{estimate_tokens(full_text)} tokens)...")
+    result = model.generate_content(build_extraction_prompt(full_text), generation_config={"temperature": 0.3})
+    extracted_json = result.text.strip()
+    logging.info(f"📥 Resposta bruta do Gemini: {extracted_json[:300]}...")
+
+    # Limpeza para garantir que seja JSON válido
+    extracted_clean = extracted_json.replace("```json", "").replace("```", "").strip()
+    try:
+        conversation_data = json.loads(extracted_clean)
+    except json.JSONDecodeError as e:
+        raise PdfExtractionError("Erro ao interpretar a resposta da IA.") from e
+
+    validate_conversation_data(conversation_data)
+    return conversation_data
+
+
+def validate_conversation_data(conversation_data: Dict[str, Any]):
+    """Basic sanity check of the extracted structure."""
+    if "paciente" not in conversation_data or not conversation_data["paciente"].get("cpf"):
+        raise PdfExtractionError("Os dados extraídos estão incompletos ou inválidos.")
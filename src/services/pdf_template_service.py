@@ -0,0 +1,154 @@
+"""
+Local, template-based extraction of booking data from known PDF layouts.
+
+Templates are declared in `pdf_templates.json`: a template applies when all of its
+`detect` anchors (and none of its `reject` anchors) appear in the text, and each field
+is read with a regex whose `value` group is then normalized by the field type. A
+template result is used only when its confidence (share of required fields that
+were extracted and validated) reaches `min_confidence`; otherwise the PDF goes to
+Gemini as before.
+"""
+import re
+import json
+import time
+import logging
+import unicodedata
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+TEMPLATES_PATH = Path(__file__).parent / "pdf_templates.json"
+_WHITESPACE = re.compile(r"\s+")
+_SEXO = {"m": "M", "masculino": "M", "f": "F", "feminino": "F"}
+
+
+def _fold(value: str) -> str:
+    """Lowercase without accents, for anchor and catalog comparisons."""
+    decomposed = unicodedata.normalize("NFKD", value)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def _set_path(data: Dict[str, Any], path: str, value: Any):
+    section, _, key = path.partition(".")
+    data.setdefault(section, {})[key] = value
+
+
+class TemplateField:
+    __slots__ = ("path", "regex", "type", "catalog", "required")
+
+    def __init__(self, path: str, spec: Dict[str, Any]):
+        self.path = path
+        self.regex = re.compile(spec["pattern"], re.IGNORECASE)
+        self.type = spec.get("type", "text")
+        self.catalog = spec.get("catalog")
+        self.required = spec.get("required", True)
+
+    def extract(self, text: str, catalog: Dict[str, List[str]]) -> Optional[str]:
+        match = self.regex.search(text)
+        if not match:
+            return None
+        raw = match.group("value").strip()
+        if self.type == "cpf":
+            digits = re.sub(r"\D", "", raw)
+            return digits if len(digits) == 11 else None
+        if self.type == "date":
+            try:
+                return datetime.strptime(raw, "%d/%m/%Y").strftime("%Y-%m-%d")
+            except ValueError:
+                return None
+        if self.type == "sexo":
+            return _SEXO.get(_fold(raw), "O")
+        if self.type == "catalog":
+            # Only names the clinic actually offers, in their canonical spelling
+            folded = _fold(raw)
+            return next((name for name in catalog.get(self.catalog, []) if _fold(name) == folded), None)
+        return raw or None
+
+
+class PdfTemplate:
+    def __init__(self, spec: Dict[str, Any]):
+        self.name = spec["name"]
+        self.detect = [_fold(anchor) for anchor in spec["detect"]]
+        self.reject = [_fold(anchor) for anchor in spec.get("reject", [])]
+        self.min_confidence = spec.get("min_confidence", 1.0)
+        self.constants = spec.get("constants", {})
+        self.fields = [TemplateField(path, field) for path, field in spec["fields"].items()]
+        self.required_count = sum(1 for field in self.fields if field.required)
+
+    def applies_to(self, folded_text: str) -> bool:
+        return (all(anchor in folded_text for anchor in self.detect)
+                and not any(anchor in folded_text for anchor in self.reject))
+
+    def extract(self, text: str, catalog: Dict[str, List[str]]) -> Tuple[Dict[str, Any], float]:
+        """Returns the extracted values (by dotted path) and the template confidence."""
+        values: Dict[str, Any] = dict(self.constants)
+        required_found = 0
+        for field in self.fields:
+            value = field.extract(text, catalog)
+            if value is None:
+                continue
+            values[field.path] = value
+            required_found += field.required
+        confidence = required_found / self.required_count if self.required_count else 1.0
+        return values, confidence
+
+
+class PdfTemplateEngine:
+    """Matches PDF text against the registered templates and keeps hit/latency statistics."""
+
+    def __init__(self, templates_path: Path = TEMPLATES_PATH):
+        with open(templates_path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        self.templates = [PdfTemplate(spec) for spec in config["templates"]]
+        self.defaults = config.get("defaults", {})
+        self.attempts = 0
+        self.hits: Dict[str, int] = {template.name: 0 for template in self.templates}
+        self.template_seconds = 0.0
+        self.llm_calls = 0
+        self.llm_seconds = 0.0
+
+    def extract(self, full_text: str, catalog: Dict[str, List[str]]) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """
+        Returns (template name, conversation_data) when a template matches with enough
+        confidence, or None when the layout is unknown.
+        """
+        started = time.perf_counter()
+        self.attempts += 1
+        text = _WHITESPACE.sub(" ", full_text).strip()
+        folded = _fold(text)
+        try:
+            for template in self.templates:
+                if not template.applies_to(folded):
+                    continue
+                values, confidence = template.extract(text, catalog)
+                if confidence < template.min_confidence:
+                    logging.info(f"Template '{template.name}' matched with low confidence ({confidence:.0%}), using Gemini")
+                    continue
+                conversation_data: Dict[str, Any] = {}
+                for path, value in {**self.defaults, **values}.items():
+                    _set_path(conversation_data, path, value)
+                self.hits[template.name] += 1
+                return template.name, conversation_data
+            return None
+        finally:
+            self.template_seconds += time.perf_counter() - started
+
+    def record_llm_call(self, seconds: float):
+        self.llm_calls += 1
+        self.llm_seconds += seconds
+
+    def metrics(self) -> dict:
+        hits = sum(self.hits.values())
+        avg_llm = self.llm_seconds / self.llm_calls if self.llm_calls else None
+        avg_template = self.template_seconds / self.attempts if self.attempts else 0.0
+        return {
+            "attempts": self.attempts,
+            "template_hits": hits,
+            "hits_by_template": dict(self.hits),
+            "hit_rate": round(hits / self.attempts, 4) if self.attempts else None,
+            "llm_calls": self.llm_calls,
+            "avg_llm_ms": round(avg_llm * 1000, 1) if avg_llm is not None else None,
+            "avg_template_ms": round(avg_template * 1000, 3),
+            # Estimated from the average Gemini latency observed in this process
+            "estimated_latency_saved_ms": round(hits * (avg_llm - avg_template) * 1000) if avg_llm is not None else None,
+        }
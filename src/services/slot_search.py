@@ -0,0 +1,189 @@
+"""
+Earliest free slots of a specialty or exam across every doctor or exam room that can serve it.
+
+Candidates come from the catalog snapshot (Medico_Especialidades, Medico_Locais and
+Local_Exames), with doctors filtered by the plan through the eligibility bitsets. A doctor
+with a weekly schedule is one candidate per location where it works, searched only inside
+that location's weekly windows. Each candidate contributes a lazy, time-ordered stream of
+free starts read from the availability index, and the streams are k-way merged with a
+heap: finding the first N slots only computes the first few free days of each resource,
+however long the search horizon is.
+"""
+import heapq
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from src.config.settings import settings
+from src.services.availability_service import AvailabilityIndex, ResourceKey
+from src.services.catalog_service import CatalogSnapshot, minutes_of_day
+from src.services.eligibility import has, normalize_name
+
+# Tipos_Consulta row used for chatbot and PDF bookings (Primeira Consulta)
+DEFAULT_CONSULTATION_TYPE = 1
+
+Hours = Callable[[date], Optional[Tuple[int, int]]]
+
+
+def working_hours(day: date) -> Optional[Tuple[int, int]]:
+    """Service window of `day` (start, end minute) from the settings; None on days without service."""
+    if day.weekday() not in settings.working_weekdays:
+        return None
+    return minutes_of_day(settings.working_hours_start), minutes_of_day(settings.working_hours_end)
+
+
+class WeeklyHours:
+    """Hours of a doctor at one location, from its Medico_Locais rows."""
+    __slots__ = ("windows",)
+
+    def __init__(self, windows: Dict[int, Tuple[int, int]]):
+        # weekday (0 = Monday) -> (start, end minute of the day)
+        self.windows = windows
+
+    def __call__(self, day: date) -> Optional[Tuple[int, int]]:
+        return self.windows.get(day.weekday())
+
+
+class SlotCandidate:
+    """
+    A doctor or exam room that can take the appointment. `hours` restricts the search to
+    the candidate's own schedule; None means the clinic's working hours.
+    """
+    __slots__ = ("keys", "id_medico", "nome_medico", "id_local", "nome_local", "id_exame", "hours")
+
+    def __init__(self, keys: List[ResourceKey], id_medico: Optional[int] = None, nome_medico: Optional[str] = None,
+                 id_local: Optional[int] = None, nome_local: Optional[str] = None, id_exame: Optional[int] = None,
+                 hours: Optional[Hours] = None):
+        self.keys = keys
+        self.id_medico = id_medico
+        self.nome_medico = nome_medico
+        self.id_local = id_local
+        self.nome_local = nome_local
+        self.id_exame = id_exame
+        self.hours = hours
+
+    def slot(self, start: datetime, duration_minutes: int) -> dict:
+        return {
+            "data_hora_inicio": start.isoformat(),
+            "data_hora_fim": (start + timedelta(minutes=duration_minutes)).isoformat(),
+            "id_medico": self.id_medico,
+            "nome_medico": self.nome_medico,
+            "id_local": self.id_local,
+            "nome_local": self.nome_local,
+            "id_exame": self.id_exame,
+        }
+
+
+def find_location(snapshot: CatalogSnapshot, nome_local: Optional[str]) -> Optional[int]:
+    """Location id by name ignoring case and accents, or the first one whose name contains the text."""
+    wanted = normalize_name(nome_local)
+    if not wanted:
+        return None
+    names = [(normalize_name(loc["nome"]), loc["id"]) for loc in snapshot.locations]
+    location_id = next((location_id for name, location_id in names if name == wanted), None)
+    if location_id is None:
+        location_id = next((location_id for name, location_id in names if wanted in name or name in wanted), None)
+    return location_id
+
+
+def find_exam(snapshot: CatalogSnapshot, nome_exame: str) -> Optional[dict]:
+    """Exam by exact name, or the first one whose name contains the given text."""
+    wanted = nome_exame.lower().strip()
+    exam = snapshot.exam_details.get(wanted)
+    if exam is None:
+        exam = next((details for name, details in snapshot.exam_details.items() if wanted in name), None)
+    return exam
+
+
+def _location_name(snapshot: CatalogSnapshot, location_id: Optional[int]) -> Optional[str]:
+    return snapshot.locations_by_id.get(location_id, {}).get("nome")
+
+
+def find_candidates(snapshot: CatalogSnapshot, tipo: str, nome: str, convenio: Optional[str] = None,
+                    id_local: Optional[int] = None) -> Tuple[int, List[SlotCandidate]]:
+    """
+    Duration and resources for a consultation of specialty `nome` (doctors of the specialty
+    that accept the insurance, once per location of their schedule) or for exam `nome`
+    (rooms of the locations that perform it). `id_local` keeps only that location.
+    """
+    if tipo == "exame":
+        exam = find_exam(snapshot, nome)
+        if exam is None:
+            return 0, []
+        location_ids = snapshot.exam_locations.get(exam["nome"].lower(), [])
+        if id_local is not None:
+            location_ids = [location_id for location_id in location_ids if location_id == id_local]
+        return exam["duracao"], [
+            SlotCandidate([("local", location_id, exam["id"])], id_local=location_id,
+                          nome_local=_location_name(snapshot, location_id), id_exame=exam["id"])
+            for location_id in sorted(location_ids)
+        ]
+
+    duration = snapshot.consultation_durations.get(DEFAULT_CONSULTATION_TYPE, settings.appointment_default_minutes)
+    eligible = snapshot.eligibility.doctors(convenio)
+    candidates = []
+    for doctor in snapshot.specialty_doctors.get(nome.lower().strip(), []):
+        if not has(eligible, doctor["id"]):
+            continue
+        schedule = snapshot.doctor_schedules.get(doctor["id"])
+        if not schedule:
+            # No Medico_Locais rows: any location, clinic working hours
+            candidates.append(SlotCandidate([("medico", doctor["id"])], id_medico=doctor["id"],
+                                            nome_medico=doctor["nome"], id_local=id_local,
+                                            nome_local=_location_name(snapshot, id_local)))
+            continue
+        for location_id, windows in schedule.items():
+            if id_local is None or location_id == id_local:
+                candidates.append(SlotCandidate([("medico", doctor["id"])], id_medico=doctor["id"],
+                                                nome_medico=doctor["nome"], id_local=location_id,
+                                                nome_local=_location_name(snapshot, location_id),
+                                                hours=WeeklyHours(windows)))
+    return duration, candidates
+
+
+def _stream(index: AvailabilityIndex, candidate: SlotCandidate, position: int, after: datetime,
+            duration_minutes: int, hours: Hours, horizon_days: int, step_minutes: int) -> Iterator[Tuple[datetime, int]]:
+    for start in index.iter_free_starts(candidate.keys, after, duration_minutes, hours, horizon_days, step_minutes):
+        yield start, position
+
+
+def next_free_slots(index: AvailabilityIndex, candidates: List[SlotCandidate], duration_minutes: int,
+                    after: datetime, count: int, hours: Hours = working_hours,
+                    horizon_days: Optional[int] = None, step_minutes: Optional[int] = None,
+                    distinct_times: bool = False) -> List[dict]:
+    """
+    The `count` earliest free slots across all candidates, in chronological order (ties
+    in candidate order). `hours` applies to candidates without their own schedule. With
+    `distinct_times`, each start time is offered only once.
+    """
+    horizon_days = horizon_days or settings.slot_search_horizon_days
+    step_minutes = step_minutes or settings.slot_search_step_minutes
+    streams = [
+        _stream(index, candidate, position, after, duration_minutes, candidate.hours or hours, horizon_days,
+                step_minutes)
+        for position, candidate in enumerate(candidates)
+    ]
+    slots: List[dict] = []
+    last_start = None
+    for start, position in heapq.merge(*streams):
+        if distinct_times and start == last_start:
+            continue
+        last_start = start
+        slots.append(candidates[position].slot(start, duration_minutes))
+        if len(slots) >= count:
+            break
+    return slots
+
+
+def is_within_hours(start: datetime, duration_minutes: int, hours: Hours = working_hours) -> bool:
+    window = hours(start.date())
+    minute = start.hour * 60 + start.minute
+    return window is not None and window[0] <= minute and minute + duration_minutes <= window[1]
+
+
+def free_candidate(index: AvailabilityIndex, candidates: List[SlotCandidate], start: datetime,
+                   duration_minutes: int, hours: Hours = working_hours) -> Optional[SlotCandidate]:
+    """First candidate working and free for the whole appointment, or None."""
+    end = start + timedelta(minutes=duration_minutes)
+    return next((candidate for candidate in candidates
+                 if is_within_hours(start, duration_minutes, candidate.hours or hours)
+                 and index.is_free(candidate.keys, start, end)), None)
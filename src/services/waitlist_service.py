@@ -0,0 +1,484 @@
+"""
+Waitlist for appointments (or earlier appointments) and the matcher that offers freed slots.
+
+Cancellations, reschedules, declined and expired offers push the freed slot to the
+`WaitlistMatcher`, which runs in the background. It reads the queues that can use the
+slot (the exam's, or those of the doctor's specialties) page by page from the
+(id_especialidade | id_exame, status, prioridade DESC, id_espera) indexes, so entries come
+out already in service order, and offers the slot to the first compatible patient:
+same location if one was asked for, before the entry's deadline (and before the
+appointment it wants to bring forward), a plan the doctor accepts (the catalog's
+eligibility bitsets) and no clash with the patient's other appointments.
+
+While an offer is pending its slot is held in the availability index, so the chatbot and
+the API do not book it; accepting books (or moves) the appointment in one transaction,
+declining or expiring sends the slot back to the matcher for the next patient.
+"""
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import aiosqlite
+
+from src.config.settings import settings
+from src.database.codecs import OFFER_TIME_COLUMNS, WAITLIST_TIME_COLUMNS, decode_times, from_epoch, to_epoch
+from src.database.connection import db_manager
+from src.database.models.schemas import (
+    AgendamentoCreate, AgendamentoResponse, CanalAgendamentoEnum, ListaEsperaCreate, ListaEsperaResponse,
+    OfertaEsperaResponse, StatusAgendamentoEnum
+)
+from src.services import booking_service
+from src.services.availability_service import AvailabilityIndex, ResourceKey, availability_index
+from src.services.catalog_service import catalog_service
+from src.services.notification_service import enqueue_offer_message, outbox_dispatcher
+from src.services.slot_search import DEFAULT_CONSULTATION_TYPE
+
+# One page of a queue in service order. The second branch of the keyset continues after
+# the last entry read; both are range scans on the queue index.
+QUEUE_FIRST_PAGE_SQL = """
+    SELECT * FROM Lista_Espera
+    WHERE {column} = ? AND status = 'aguardando'
+    ORDER BY prioridade DESC, id_espera
+    LIMIT ?
+"""
+QUEUE_NEXT_PAGE_SQL = """
+    SELECT * FROM (
+        SELECT * FROM Lista_Espera
+        WHERE {column} = ? AND status = 'aguardando' AND prioridade = ? AND id_espera > ?
+        UNION ALL
+        SELECT * FROM Lista_Espera
+        WHERE {column} = ? AND status = 'aguardando' AND prioridade < ?
+    )
+    ORDER BY prioridade DESC, id_espera
+    LIMIT ?
+"""
+
+
+def _decode_entry(row) -> dict:
+    return decode_times(dict(row), WAITLIST_TIME_COLUMNS)
+
+
+def _decode_offer(row) -> dict:
+    return decode_times(dict(row), OFFER_TIME_COLUMNS)
+
+
+class FreedSlot:
+    """An interval of a doctor (consultations) or exam room that became free."""
+    __slots__ = ("id_medico", "id_local", "id_exame", "start", "end")
+
+    def __init__(self, id_medico: Optional[int], id_local: int, id_exame: Optional[int], start, end):
+        self.id_medico = id_medico
+        self.id_local = id_local
+        self.id_exame = id_exame
+        self.start = from_epoch(start)
+        self.end = from_epoch(end)
+
+    @classmethod
+    def of(cls, row) -> "FreedSlot":
+        """From an appointment or offer (model or row)."""
+        get = row.get if isinstance(row, dict) else (lambda name: getattr(row, name))
+        return cls(get("id_medico"), get("id_local"), get("id_exame"), get("data_hora_inicio"), get("data_hora_fim"))
+
+    @property
+    def resources(self) -> List[ResourceKey]:
+        return AvailabilityIndex.resources_for(self.id_medico, self.id_local, self.id_exame)
+
+    def __repr__(self):
+        return f"FreedSlot(medico={self.id_medico}, local={self.id_local}, exame={self.id_exame}, {self.start:%Y-%m-%d %H:%M})"
+
+
+async def add_to_waitlist(db: aiosqlite.Connection, entry: ListaEsperaCreate) -> ListaEsperaResponse:
+    """
+    Puts a patient in the queue of a specialty or exam. With `id_agendamento` the patient
+    already has that (active, own) appointment and only wants an earlier slot.
+    """
+    if (entry.id_especialidade is None) == (entry.id_exame is None):
+        raise booking_service.BookingValidationError("Informe uma especialidade ou um exame para a lista de espera")
+
+    data_limite = to_epoch(entry.data_limite)
+    if entry.id_agendamento is not None:
+        appointment = await booking_service.get_appointment(db, entry.id_agendamento)
+        if appointment is None or appointment.id_paciente != entry.id_paciente:
+            raise booking_service.BookingValidationError(
+                f"O agendamento {entry.id_agendamento} não pertence ao paciente {entry.id_paciente}")
+        if appointment.status != StatusAgendamentoEnum.AGENDADO:
+            raise booking_service.BookingValidationError(f"O agendamento {entry.id_agendamento} não está ativo")
+
+    cursor = await db.execute(
+        """
+        INSERT INTO Lista_Espera (id_paciente, id_especialidade, id_exame, id_convenio, id_local,
+                                  id_agendamento, data_limite, prioridade)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        RETURNING *
+        """,
+        (entry.id_paciente, entry.id_especialidade, entry.id_exame, entry.id_convenio, entry.id_local,
+         entry.id_agendamento, data_limite, entry.prioridade)
+    )
+    row = await cursor.fetchone()
+    await db.commit()
+    return ListaEsperaResponse(**_decode_entry(row))
+
+
+async def get_waitlist_entry(db: aiosqlite.Connection, entry_id: int) -> Optional[ListaEsperaResponse]:
+    """The queue entry with its latest offer, if any."""
+    async with db.execute("SELECT * FROM Lista_Espera WHERE id_espera = ?", (entry_id,)) as cursor:
+        row = await cursor.fetchone()
+    if row is None:
+        return None
+    async with db.execute(
+        "SELECT * FROM Ofertas_Espera WHERE id_espera = ? ORDER BY id_oferta DESC LIMIT 1", (entry_id,)
+    ) as cursor:
+        offer = await cursor.fetchone()
+    return ListaEsperaResponse(**_decode_entry(row),
+                               oferta=OfertaEsperaResponse(**_decode_offer(offer)) if offer else None)
+
+
+class WaitlistMatcher:
+    """Offers freed slots to the waitlist and keeps the offered slots held."""
+
+    def __init__(self, index: AvailabilityIndex):
+        self.index = index
+        self._queue: Optional[asyncio.Queue] = None
+        # id_oferta -> slot held in the index while the offer is pending
+        self._holds: Dict[int, FreedSlot] = {}
+        self.counters = {"freed": 0, "offered": 0, "unmatched": 0, "accepted": 0, "declined": 0, "expired": 0}
+        self.matched_seconds = 0.0
+
+    @property
+    def queue(self) -> asyncio.Queue:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        return self._queue
+
+    def notify(self, slot: FreedSlot):
+        """Schedules a freed slot for matching; never blocks the caller."""
+        self.counters["freed"] += 1
+        self.queue.put_nowait(slot)
+
+    def _hold(self, offer_id: int, slot: FreedSlot):
+        self.index.add(slot.resources, slot.start, slot.end)
+        self._holds[offer_id] = slot
+
+    def release(self, offer_id: int) -> Optional[FreedSlot]:
+        """Frees the slot held for the offer (no-op when it is not held)."""
+        slot = self._holds.pop(offer_id, None)
+        if slot is not None:
+            self.index.remove(slot.resources, slot.start, slot.end)
+        return slot
+
+    async def _queue_keys(self, db: aiosqlite.Connection, slot: FreedSlot) -> List[Tuple[str, int]]:
+        if slot.id_exame is not None:
+            return [("id_exame", slot.id_exame)]
+        async with db.execute(
+            "SELECT id_especialidade FROM Medico_Especialidades WHERE id_medico = ?", (slot.id_medico,)
+        ) as cursor:
+            return [("id_especialidade", row[0]) for row in await cursor.fetchall()]
+
+    @staticmethod
+    async def _pages(db: aiosqlite.Connection, column: str, value: int) -> AsyncIterator[aiosqlite.Row]:
+        batch = settings.waitlist_match_batch
+        query, params = QUEUE_FIRST_PAGE_SQL.format(column=column), (value, batch)
+        while True:
+            async with db.execute(query, params) as cursor:
+                rows = await cursor.fetchall()
+            for row in rows:
+                yield row
+            if len(rows) < batch:
+                return
+            last = rows[-1]
+            query = QUEUE_NEXT_PAGE_SQL.format(column=column)
+            params = (value, last["prioridade"], last["id_espera"], value, last["prioridade"], batch)
+
+    async def _entries(self, db: aiosqlite.Connection, slot: FreedSlot) -> AsyncIterator[aiosqlite.Row]:
+        """Waiting entries of every queue that can use the slot, merged in service order."""
+        pages = [self._pages(db, column, value) for column, value in await self._queue_keys(db, slot)]
+        heads = [await anext(page, None) for page in pages]
+        while True:
+            live = [i for i, head in enumerate(heads) if head is not None]
+            if not live:
+                return
+            i = min(live, key=lambda i: (-heads[i]["prioridade"], heads[i]["id_espera"]))
+            yield heads[i]
+            heads[i] = await anext(pages[i], None)
+
+    async def _compatible(self, db: aiosqlite.Connection, entry, slot: FreedSlot) -> bool:
+        if entry["id_local"] is not None and entry["id_local"] != slot.id_local:
+            return False
+        deadline = from_epoch(entry["data_limite"])
+        if deadline is not None and slot.start >= deadline:
+            return False
+        if slot.id_medico is not None:
+            snapshot = await catalog_service.ensure_fresh()
+            if not snapshot.eligibility.accepts(entry["id_convenio"], slot.id_medico):
+                return False
+        current_id = entry["id_agendamento"] or 0
+        if current_id:
+            current = await booking_service.get_appointment(db, current_id)
+            if current is None or current.status != StatusAgendamentoEnum.AGENDADO \
+                    or slot.start >= current.data_hora_inicio:
+                return False
+        if await booking_service.find_patient_overlap(db, entry["id_paciente"], slot.start, slot.end,
+                                                      exclude_id=current_id) is not None:
+            return False
+        # Not the same slot again after the patient declined it or let it expire
+        async with db.execute(
+            "SELECT 1 FROM Ofertas_Espera WHERE id_espera = ? AND data_hora_inicio = ? LIMIT 1",
+            (entry["id_espera"], to_epoch(slot.start))
+        ) as cursor:
+            return await cursor.fetchone() is None
+
+    async def match(self, db: aiosqlite.Connection, slot: FreedSlot) -> Optional[OfertaEsperaResponse]:
+        """Offers the slot to the first compatible waiting patient. Returns the offer, if any."""
+        started = time.perf_counter()
+        now = datetime.now()
+        if slot.start < now + timedelta(minutes=settings.waitlist_min_notice_minutes) \
+                or not self.index.is_free(slot.resources, slot.start, slot.end):
+            self.counters["unmatched"] += 1
+            return None
+
+        # Held from the start: nobody else books it while the queues are read
+        self.index.add(slot.resources, slot.start, slot.end)
+        offer = None
+        try:
+            async for entry in self._entries(db, slot):
+                if await self._compatible(db, entry, slot):
+                    offer = await self._offer(db, entry, slot, now)
+                    break
+        finally:
+            if offer is None:
+                self.index.remove(slot.resources, slot.start, slot.end)
+            self.matched_seconds += time.perf_counter() - started
+
+        if offer is None:
+            self.counters["unmatched"] += 1
+        return offer
+
+    async def _offer(self, db: aiosqlite.Connection, entry, slot: FreedSlot, now: datetime) -> OfertaEsperaResponse:
+        expires = min(now + timedelta(minutes=settings.waitlist_offer_minutes), slot.start)
+        try:
+            cursor = await db.execute(
+                """
+                INSERT INTO Ofertas_Espera (id_espera, id_medico, id_local, id_exame,
+                                            data_hora_inicio, data_hora_fim, expira_em)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                RETURNING *
+                """,
+                (entry["id_espera"], slot.id_medico, slot.id_local, slot.id_exame,
+                 to_epoch(slot.start), to_epoch(slot.end), to_epoch(expires))
+            )
+            offer = OfertaEsperaResponse(**_decode_offer(await cursor.fetchone()))
+            await db.execute("UPDATE Lista_Espera SET status = 'ofertado' WHERE id_espera = ?", (entry["id_espera"],))
+            await enqueue_offer_message(db, offer.id_oferta)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        outbox_dispatcher.wake()
+        # The index already holds the slot (see match); from now on it belongs to the offer
+        self._holds[offer.id_oferta] = slot
+        self.counters["offered"] += 1
+        logging.info(f"Horário {slot} oferecido ao paciente {entry['id_paciente']} "
+                     f"(espera {entry['id_espera']}, oferta {offer.id_oferta}, expira {expires:%H:%M})")
+        return offer
+
+    async def _close_offer(self, db: aiosqlite.Connection, offer_id: int, status: str) -> Optional[dict]:
+        """Marks a pending offer declined/expired and puts its entry back in the queue."""
+        cursor = await db.execute(
+            "UPDATE Ofertas_Espera SET status = ? WHERE id_oferta = ? AND status = 'pendente' RETURNING *",
+            (status, offer_id)
+        )
+        offer = await cursor.fetchone()
+        if offer is None:
+            return None
+        await db.execute("UPDATE Lista_Espera SET status = 'aguardando' WHERE id_espera = ? AND status = 'ofertado'",
+                         (offer["id_espera"],))
+        return _decode_offer(offer)
+
+    async def _get_offer(self, db: aiosqlite.Connection, offer_id: int):
+        async with db.execute(
+            """
+            SELECT o.*, e.id_paciente, e.id_convenio, e.id_especialidade, e.id_agendamento AS id_agendamento_espera,
+                   e.status AS status_espera
+            FROM Ofertas_Espera o
+            JOIN Lista_Espera e ON e.id_espera = o.id_espera
+            WHERE o.id_oferta = ?
+            """,
+            (offer_id,)
+        ) as cursor:
+            row = await cursor.fetchone()
+        return _decode_offer(row) if row else None
+
+    async def accept(self, db: aiosqlite.Connection, offer_id: int) -> Optional[AgendamentoResponse]:
+        """
+        Books the offered slot for the patient, or moves the appointment the entry wanted to
+        bring forward, in one transaction. Returns None when the offer does not exist;
+        raises BookingValidationError when it is no longer pending.
+        """
+        offer = await self._get_offer(db, offer_id)
+        if offer is None:
+            return None
+        if offer["status"] != "pendente" or offer["status_espera"] != "ofertado" \
+                or offer["expira_em"] <= datetime.now():
+            raise booking_service.BookingValidationError(f"A oferta {offer_id} não está mais disponível")
+
+        slot = self.release(offer_id)
+        freed = None
+        # Index changes made before the commit, undone if the transaction is rolled back
+        reservations, releases = [], []
+        try:
+            if offer["id_agendamento_espera"] is not None:
+                moved = await booking_service.reschedule_appointment(
+                    db, offer["id_agendamento_espera"], offer["data_hora_inicio"],
+                    id_medico=offer["id_medico"], commit=False, reservations=reservations, releases=releases
+                )
+                if moved is None:
+                    raise booking_service.BookingValidationError(
+                        f"O agendamento {offer['id_agendamento_espera']} não existe mais")
+                previous, appointment = moved
+                freed = FreedSlot.of(previous)
+            else:
+                appointment = await booking_service.create_appointment(db, AgendamentoCreate(
+                    id_paciente=offer["id_paciente"],
+                    id_local=offer["id_local"],
+                    id_convenio=offer["id_convenio"],
+                    id_tipo_consulta=DEFAULT_CONSULTATION_TYPE if offer["id_exame"] is None else None,
+                    id_exame=offer["id_exame"],
+                    id_medico=offer["id_medico"],
+                    id_especialidade=offer["id_especialidade"],
+                    data_hora_inicio=offer["data_hora_inicio"],
+                    data_hora_fim=offer["data_hora_fim"],
+                    status=StatusAgendamentoEnum.AGENDADO,
+                    observacoes=f"Agendado pela lista de espera (oferta {offer_id})"
+                ), commit=False, canal=CanalAgendamentoEnum.LISTA_ESPERA.value, reservations=reservations)
+            await db.execute("UPDATE Ofertas_Espera SET status = 'aceita', id_agendamento = ? WHERE id_oferta = ?",
+                             (appointment.id_agendamento, offer_id))
+            await db.execute("UPDATE Lista_Espera SET status = 'atendido' WHERE id_espera = ?", (offer["id_espera"],))
+            await db.commit()
+        except booking_service.SlotUnavailableError:
+            # The slot was taken meanwhile (another process): the offer is void
+            await db.rollback()
+            self._undo(reservations, releases)
+            await self._close_offer(db, offer_id, "expirada")
+            await db.commit()
+            raise
+        except Exception:
+            await db.rollback()
+            self._undo(reservations, releases)
+            if slot is not None:
+                self._hold(offer_id, slot)
+            raise
+
+        self.counters["accepted"] += 1
+        if freed is not None:
+            self.notify(freed)
+        return appointment
+
+    def _undo(self, reservations: list, releases: list):
+        """Puts the index back as it was before a rolled back accept."""
+        for resources, start, end in reservations:
+            availability_index.remove(resources, start, end)
+        for resources, start, end in releases:
+            availability_index.add(resources, start, end)
+
+    async def decline(self, db: aiosqlite.Connection, offer_id: int) -> Optional[OfertaEsperaResponse]:
+        """Declines a pending offer: the patient goes back to the queue and the slot to the next one."""
+        offer = await self._close_offer(db, offer_id, "recusada")
+        if offer is None:
+            await db.rollback()
+            if await self._get_offer(db, offer_id) is None:
+                return None
+            raise booking_service.BookingValidationError(f"A oferta {offer_id} não está mais pendente")
+        await db.commit()
+        self.counters["declined"] += 1
+        self.release(offer_id)
+        self.notify(FreedSlot.of(offer))
+        return OfertaEsperaResponse(**offer)
+
+    async def cancel_entry(self, db: aiosqlite.Connection, entry_id: int) -> Optional[ListaEsperaResponse]:
+        """Leaves the queue; a pending offer is declined and its slot offered to the next patient."""
+        async with db.execute(
+            "SELECT id_oferta FROM Ofertas_Espera WHERE id_espera = ? AND status = 'pendente'", (entry_id,)
+        ) as cursor:
+            pending = [row[0] for row in await cursor.fetchall()]
+        for offer_id in pending:
+            await self.decline(db, offer_id)
+        await db.execute(
+            "UPDATE Lista_Espera SET status = 'cancelado' WHERE id_espera = ? AND status IN ('aguardando', 'ofertado')",
+            (entry_id,)
+        )
+        await db.commit()
+        return await get_waitlist_entry(db, entry_id)
+
+    async def expire(self, db: aiosqlite.Connection) -> int:
+        """Expires the pending offers past `expira_em` and re-offers their slots. Returns how many."""
+        async with db.execute(
+            "SELECT id_oferta FROM Ofertas_Espera WHERE status = 'pendente' AND expira_em <= ?", (to_epoch(datetime.now()),)
+        ) as cursor:
+            expired = [row[0] for row in await cursor.fetchall()]
+        for offer_id in expired:
+            offer = await self._close_offer(db, offer_id, "expirada")
+            await db.commit()
+            self.release(offer_id)
+            if offer is not None:
+                self.counters["expired"] += 1
+                self.notify(FreedSlot.of(offer))
+        return len(expired)
+
+    async def restore(self, db: aiosqlite.Connection) -> int:
+        """Holds again the slots of the offers still pending (after a restart)."""
+        async with db.execute(
+            "SELECT * FROM Ofertas_Espera WHERE status = 'pendente' AND expira_em > ?", (to_epoch(datetime.now()),)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        for row in rows:
+            if row["id_oferta"] not in self._holds:
+                self._hold(row["id_oferta"], FreedSlot.of(dict(row)))
+        return len(rows)
+
+    def metrics(self) -> dict:
+        matched = self.counters["offered"] + self.counters["unmatched"]
+        return {
+            **self.counters,
+            "pending_slots": self.queue.qsize(),
+            "held_offers": len(self._holds),
+            "avg_match_ms": round(self.matched_seconds / matched * 1000, 3) if matched else 0.0,
+        }
+
+
+async def run_waitlist_matcher(matcher: "WaitlistMatcher"):
+    """Tarefa de fundo que oferece os horários liberados à lista de espera."""
+    while True:
+        slot = await matcher.queue.get()
+        conn = await db_manager.get_connection()
+        try:
+            while True:
+                try:
+                    await matcher.match(conn, slot)
+                except Exception as e:
+                    logging.error(f"Erro ao oferecer {slot} à lista de espera: {e}")
+                if matcher.queue.empty():
+                    break
+                slot = matcher.queue.get_nowait()
+        finally:
+            await conn.close()
+
+
+async def run_offer_sweeper(matcher: "WaitlistMatcher", interval_seconds: int):
+    """Tarefa de fundo que expira as ofertas não respondidas a tempo."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        conn = await db_manager.get_connection()
+        try:
+            expired = await matcher.expire(conn)
+            if expired:
+                logging.info(f"⏰ {expired} ofertas da lista de espera expiradas")
+        except Exception as e:
+            logging.error(f"Erro ao expirar ofertas da lista de espera: {e}")
+        finally:
+            await conn.close()
+
+
+# Global waitlist matcher
+waitlist_matcher = WaitlistMatcher(availability_index)